@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Asyncio (ASGI) serving mode for the web attendance system
+
+Serves the same application as run_web_system.py on a single event loop:
+- /api/camera/stream awaits frames published by the recognition loop
+  instead of polling, and each frame is JPEG-encoded once (by the same
+  web.stream_encoder the threaded stream uses) and shared by every viewer
+- /api/events pushes attendance events to dashboards (Server-Sent Events)
+- every other route is handed to the existing Flask app on a bounded
+  thread pool, so DB work never blocks the event loop
+
+Run with:
+    python run_web_system.py --async
+or under any ASGI server:
+    uvicorn async_web_system:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import run_web_system as web
+
+# Bounded pools: Flask/DB work and JPEG encoding
+DB_WORKERS = int(os.environ.get('ATTENDANCE_DB_WORKERS', '8'))
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='async-db')
+encode_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='async-jpeg')
+
+OFFLINE_INTERVAL = 1.0
+EVENT_QUEUE_SIZE = 100
+KEEPALIVE_INTERVAL = 15
+
+
+class FrameChannel:
+    """Async view of web.frame_publisher with one JPEG encode per frame"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.sequence = 0
+        self.next_frame = loop.create_future()
+        self.encoded_sequence = 0
+        self.encoded = None
+        self.encoding = None
+        self.offline = web.offline_jpeg()
+
+    def on_publish(self, sequence, value):
+        # Called on the recognition thread
+        try:
+            self.loop.call_soon_threadsafe(self._wake, sequence)
+        except RuntimeError:
+            pass  # Event loop already closed
+
+    def _wake(self, sequence):
+        self.sequence = sequence
+        waiters, self.next_frame = self.next_frame, self.loop.create_future()
+        waiters.set_result(sequence)
+
+    async def wait(self, last_sequence, timeout):
+        """Wait for a frame newer than last_sequence; returns its sequence or None"""
+        if self.sequence > last_sequence:
+            return self.sequence
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.next_frame), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def jpeg(self):
+        """JPEG of the latest frame, encoded at most once per frame"""
+        if self.encoded_sequence == self.sequence and self.encoded is not None:
+            return self.encoded
+        if self.encoding is None:
+            self.encoding = asyncio.ensure_future(self._encode_latest())
+        try:
+            return await asyncio.shield(self.encoding)
+        finally:
+            if self.encoding is not None and self.encoding.done():
+                self.encoding = None
+
+    async def _encode_latest(self):
+        sequence, value = web.frame_publisher.sequence, web.frame_publisher.value
+        if value is None:
+            return self.offline
+        encoded = await self.loop.run_in_executor(encode_executor, web.stream_encoder.encode, sequence, value)
+        if encoded is not None:
+            self.encoded_sequence, self.encoded = sequence, encoded
+        return encoded or self.offline
+
+
+class EventHub:
+    """Fans attendance events out to per-client bounded queues"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queues = set()
+
+    def on_publish(self, sequence, event):
+        try:
+            self.loop.call_soon_threadsafe(self._dispatch, event)
+        except RuntimeError:
+            pass
+
+    def _dispatch(self, event):
+        for queue in self.queues:
+            if queue.full():
+                # Slow client: drop its oldest event rather than grow memory
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def open(self):
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.queues.add(queue)
+        return queue
+
+    def close(self, queue):
+        self.queues.discard(queue)
+
+
+frame_channel = None
+event_hub = None
+
+
+async def watch_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream_frames(scope, receive, send):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                    (b'cache-control', b'no-cache')]
+    })
+
+    disconnected = asyncio.ensure_future(watch_disconnect(receive))
+    web.STREAM_CLIENTS.inc()
+    last_sequence = 0
+    try:
+        while not disconnected.done():
+            if web.recognition_active:
+                sequence = await frame_channel.wait(last_sequence, OFFLINE_INTERVAL)
+                if sequence is None:
+                    continue
+                last_sequence = sequence
+                body = await frame_channel.jpeg()
+            else:
+                body = frame_channel.offline
+                await asyncio.wait([disconnected], timeout=OFFLINE_INTERVAL)
+
+            # Separate messages, so the shared JPEG isn't copied per client
+            for chunk in (web.STREAM_BOUNDARY, body, b'\r\n'):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    except OSError:
+        pass  # Client went away mid-write
+    finally:
+        web.STREAM_CLIENTS.dec()
+        disconnected.cancel()
+
+
+async def stream_events(scope, receive, send):
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache')]
+    })
+
+    disconnected = asyncio.ensure_future(watch_disconnect(receive))
+    queue = event_hub.open()
+    try:
+        while not disconnected.done():
+            getter = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait([getter, disconnected], timeout=KEEPALIVE_INTERVAL,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                payload = f"event: attendance\ndata: {json.dumps(getter.result())}\n\n"
+            else:
+                getter.cancel()
+                payload = ": keepalive\n\n"
+            if not disconnected.done():
+                await send({'type': 'http.response.body', 'body': payload.encode(), 'more_body': True})
+    except OSError:
+        pass
+    finally:
+        event_hub.close(queue)
+        disconnected.cancel()
+
+
+def build_environ(scope, body):
+    """Translate an ASGI HTTP scope into a WSGI environ for the Flask app"""
+    server = scope.get('server') or ('localhost', 5000)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body))
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def call_flask(environ):
+    """Run one request through the Flask app (on a db_executor thread)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = web.app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+
+async def forward_to_flask(scope, receive, send):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+
+    loop = asyncio.get_running_loop()
+    environ = build_environ(scope, b''.join(chunks))
+    status, headers, body = await loop.run_in_executor(db_executor, call_flask, environ)
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+ROUTES = {
+    '/api/camera/stream': stream_frames,
+    '/api/events': stream_events
+}
+
+
+async def lifespan(receive, send):
+    global frame_channel, event_hub
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            frame_channel = FrameChannel(loop)
+            event_hub = EventHub(loop)
+            web.frame_publisher.subscribe(frame_channel.on_publish)
+            web.attendance_publisher.subscribe(event_hub.on_publish)
+            # Also when run under another ASGI server, without run_web_system.main()
+            web.warmup.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            web.frame_publisher.unsubscribe(frame_channel.on_publish)
+            web.attendance_publisher.unsubscribe(event_hub.on_publish)
+            web.recognition_active = False
+            web.camera_manager.stop_camera()
+            db_executor.shutdown(wait=False)
+            encode_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get(scope['path'])
+    if handler is not None and scope['method'] == 'GET':
+        await handler(scope, receive, send)
+    else:
+        await forward_to_flask(scope, receive, send)
+
+
+def serve(host='0.0.0.0', port=5000):
+    """Run the ASGI app with uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("Async mode needs an ASGI server: pip install uvicorn")
+        sys.exit(1)
+
+    print(f"Async server: http://{host}:{port} (DB workers: {DB_WORKERS})")
+    uvicorn.run(app, host=host, port=port, log_level='warning', lifespan='on')
+
+
+if __name__ == '__main__':
+    serve()
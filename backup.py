@@ -0,0 +1,167 @@
+"""
+Online backup and restore for the attendance database
+
+Backups use SQLite's online backup API, copying a limited number of
+pages per step and sleeping between steps. The source stays available to
+mark_attendance the whole time: in WAL mode writers never wait, and in
+rollback-journal mode they wait at most one step. Snapshots can be gzip
+compressed.
+
+Restores go the other way through the same API into the live database,
+as one transaction. Other connections see either the old or the new
+contents, never a mix, and no file is swapped under an open connection.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.005
+# Concurrent writes make the backup start over; after this many restarts
+# the rest is copied in one step instead
+MAX_RESTARTS = 3
+
+REQUIRED_TABLES = ('students', 'attendance')
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+class BackupManager:
+    def __init__(self, db_path="attendance_system.db", backup_dir=None):
+        self.db_path = db_path
+        self.backup_dir = backup_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "backups")
+
+    def create_backup(self, compress=True, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+        """Write a consistent snapshot of the live database into backup_dir"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        snapshot_path = os.path.join(self.backup_dir, f"attendance_{stamp}.db")
+
+        start = time.perf_counter()
+        steps, restarts = self._copy(self.db_path, snapshot_path, pages, sleep)
+        copy_seconds = time.perf_counter() - start
+
+        final_path = snapshot_path
+        if compress:
+            final_path = snapshot_path + '.gz'
+            with open(snapshot_path, 'rb') as src, gzip.open(final_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(snapshot_path)
+
+        return {
+            'file': final_path,
+            'size_bytes': os.path.getsize(final_path),
+            'compressed': compress,
+            'steps': steps,
+            'restarts': restarts,
+            'copy_seconds': round(copy_seconds, 3),
+            'total_seconds': round(time.perf_counter() - start, 3)
+        }
+
+    def _copy(self, source_path, target_path, pages, sleep):
+        """Copy source into target with the backup API, return (steps, restarts)"""
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        state = {'steps': 0, 'restarts': 0, 'remaining': None}
+
+        def progress(status, remaining, total):
+            state['steps'] += 1
+            # Remaining pages going up means the source changed and the copy restarted
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                if state['restarts'] >= MAX_RESTARTS:
+                    raise BackupRestarted()
+            state['remaining'] = remaining
+
+        try:
+            try:
+                source.backup(target, pages=pages, progress=progress, sleep=sleep)
+            except BackupRestarted:
+                # One step holds a single read transaction until done, which
+                # in WAL mode still lets writers proceed
+                source.backup(target, pages=-1)
+        finally:
+            target.close()
+            source.close()
+
+        return state['steps'], state['restarts']
+
+    def list_backups(self):
+        """Return backups in backup_dir, newest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+
+        backups = []
+        for name in os.listdir(self.backup_dir):
+            if not (name.endswith('.db') or name.endswith('.db.gz')):
+                continue
+            path = os.path.join(self.backup_dir, name)
+            backups.append({
+                'file': path,
+                'size_bytes': os.path.getsize(path),
+                'created': datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+            })
+        backups.sort(key=lambda b: b['created'], reverse=True)
+        return backups
+
+    def restore_backup(self, backup_path, safety_backup=True):
+        """Replace the live database contents with a backup file (.db or .db.gz)"""
+        start = time.perf_counter()
+        workdir = tempfile.mkdtemp(prefix="attendance_restore_", dir=os.path.dirname(os.path.abspath(self.db_path)))
+        try:
+            candidate = os.path.join(workdir, "restore.db")
+            with open(backup_path, 'rb') as f:
+                is_gzip = f.read(2) == b'\x1f\x8b'
+            if is_gzip:
+                with gzip.open(backup_path, 'rb') as src, open(candidate, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            else:
+                shutil.copyfile(backup_path, candidate)
+
+            valid, message = self.validate(candidate)
+            if not valid:
+                return False, message, None
+
+            safety = self.create_backup(compress=True) if safety_backup else None
+
+            # Single-transaction copy into the live database
+            source = sqlite3.connect(candidate)
+            target = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                source.backup(target, pages=-1)
+            finally:
+                target.close()
+                source.close()
+
+            return True, "Backup restored successfully", {
+                'seconds': round(time.perf_counter() - start, 3),
+                'safety_backup': safety['file'] if safety else None
+            }
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def validate(self, path):
+        """Check that a file is an intact attendance database"""
+        try:
+            conn = sqlite3.connect(path)
+            try:
+                result = conn.execute('PRAGMA quick_check').fetchone()[0]
+                tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            finally:
+                conn.close()
+        except sqlite3.DatabaseError as e:
+            return False, f"Not a valid database: {e}"
+
+        if result != 'ok':
+            return False, f"Backup failed integrity check: {result}"
+        missing = [t for t in REQUIRED_TABLES if t not in tables]
+        if missing:
+            return False, f"Backup is missing tables: {', '.join(missing)}"
+        return True, "ok"
@@ -0,0 +1,314 @@
+"""
+Offline attendance from recorded lecture videos
+
+Takes recordings instead of a live camera and computes attendance for a
+course and date on spare server capacity:
+
+    python -m batch --video lecture.mp4 --course CS101 --date 2026-10-19 --start 09:00
+
+Each video is cut into segments of --segment-seconds. A process pool
+decodes the segments in parallel, every --stride frames is recognized
+with FaceRecognitionSystem (the frames in between are only grabbed, not
+converted), and the workers return per-student sightings. A student
+seen in at least --min-sightings sampled frames is present. Their first
+and last sightings, offset from --start, become time_in and time_out.
+All rows are written in one transaction (DatabaseManager.
+mark_attendance_bulk), so a failed run writes nothing and a re-run
+merges with what is there.
+
+Several videos are treated as consecutive parts of the same lecture.
+--shards limits matching to the course's departments (see shards.py).
+The report gives throughput as video seconds processed per wall second.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import cv2
+
+from database import DatabaseManager
+
+# At 30 fps, two samples per second
+DEFAULT_STRIDE = 15
+DEFAULT_SEGMENT_SECONDS = 60
+DEFAULT_MIN_SIGHTINGS = 3
+DEFAULT_THRESHOLD = 0.7
+
+BATCH_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS batch_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        course TEXT NOT NULL,
+        date DATE NOT NULL,
+        videos TEXT NOT NULL,
+        video_seconds REAL,
+        wall_seconds REAL,
+        frames_sampled INTEGER,
+        students INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+# Per worker process, set up once by _init_worker
+_face_system = None
+_options = {}
+
+
+def probe(path):
+    """(fps, frame count) of a video; frame count is 0 when unknown"""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise ValueError(f"Cannot open video: {path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    finally:
+        cap.release()
+    return fps, max(frames, 0)
+
+
+def plan_segments(path, stride=DEFAULT_STRIDE, segment_seconds=DEFAULT_SEGMENT_SECONDS):
+    """(path, first frame, end frame or None, fps) per segment
+
+    Segment lengths are multiples of the stride, so the sampled frames
+    are the same as decoding the whole video in one pass.
+    """
+    fps, frames = probe(path)
+    if not frames:
+        return [(path, 0, None, fps)]
+    length = max(stride, int(round(segment_seconds * fps / stride)) * stride)
+    return [(path, first, min(first + length, frames), fps) for first in range(0, frames, length)]
+
+
+def _init_worker(db_path, precision, options):
+    global _face_system, _options
+    from face_recognition_system import FaceRecognitionSystem
+    _face_system = FaceRecognitionSystem(DatabaseManager(db_path), precision=precision, shards=options['shards'])
+    _options = options
+
+
+def _process_segment(segment):
+    """Recognize every stride-th frame of one segment; return its sightings"""
+    path, first, end, fps = segment
+    stride, scale, threshold = _options['stride'], _options['scale'], _options['threshold']
+    sightings = []
+    sampled = 0
+
+    cap = cv2.VideoCapture(path)
+    try:
+        if first:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+        index = first
+        while end is None or index < end:
+            if (index - first) % stride:
+                # Skipped frames are demuxed and decoded but never converted
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if scale != 1.0:
+                frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            recognized_faces, _ = _face_system.recognize_faces_in_frame(frame, scale=scale)
+            for face_info in recognized_faces:
+                if face_info.get('student_id') and face_info.get('confidence', 0) > threshold:
+                    sightings.append((index / fps, face_info['student_id'], float(face_info['confidence'])))
+            sampled += 1
+            index += 1
+    finally:
+        cap.release()
+
+    return {'path': path, 'frames': index - first, 'sampled': sampled, 'seconds': (index - first) / fps,
+            'sightings': sightings}
+
+
+class BatchProcessor:
+    def __init__(self, db_path="attendance_system.db", workers=None, stride=DEFAULT_STRIDE,
+                 segment_seconds=DEFAULT_SEGMENT_SECONDS, min_sightings=DEFAULT_MIN_SIGHTINGS,
+                 threshold=DEFAULT_THRESHOLD, scale=1.0, precision=None, shards=None):
+        self.db_path = db_path
+        self.workers = workers or os.cpu_count() or 1
+        self.stride = max(1, int(stride))
+        self.segment_seconds = segment_seconds
+        self.min_sightings = max(1, int(min_sightings))
+        self.threshold = threshold
+        self.scale = scale
+        self.precision = precision
+        self.shards = shards
+        self.init_schema()
+
+    def init_schema(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executescript(BATCH_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _results(self, segments):
+        """Segment results in plan order, from the pool or in-process for one worker"""
+        initargs = (self.db_path, self.precision,
+                    {'stride': self.stride, 'scale': self.scale, 'threshold': self.threshold, 'shards': self.shards})
+        if self.workers == 1 or len(segments) == 1:
+            _init_worker(*initargs)
+            for segment in segments:
+                yield _process_segment(segment)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(segments)), initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            yield from pool.map(_process_segment, segments)
+
+    def run(self, videos, course, day=None, start=None, write=True):
+        """Process videos and write attendance for course on day; return the report
+
+        start is the datetime.time the first video begins; without it the
+        rows get no time_in/time_out.
+        """
+        day = day or date.today().isoformat()
+        began = time.perf_counter()
+
+        segments, owners = [], []
+        for position, path in enumerate(videos):
+            planned = plan_segments(path, self.stride, self.segment_seconds)
+            segments.extend(planned)
+            owners.extend([position] * len(planned))
+
+        # Results arrive in plan order, so sightings are in time order and
+        # each video starts where the previous one ended
+        frames = sampled = 0
+        video_seconds = [0.0] * len(videos)
+        offset, current = 0.0, 0
+        students = {}
+        for done, (position, result) in enumerate(zip(owners, self._results(segments)), 1):
+            if position != current:
+                offset += video_seconds[current]
+                current = position
+            frames += result['frames']
+            sampled += result['sampled']
+            video_seconds[position] += result['seconds']
+            for seconds, student_id, confidence in result['sightings']:
+                seen = students.setdefault(student_id, {'sightings': 0, 'first': offset + seconds, 'confidence': 0})
+                seen['sightings'] += 1
+                seen['last'] = offset + seconds
+                seen['confidence'] = max(confidence, seen['confidence'])
+            print(f"Segment {done}/{len(segments)}: {os.path.basename(result['path'])} {result['seconds']:.0f}s, "
+                  f"{len(result['sightings'])} matches")
+
+        present = {sid: seen for sid, seen in students.items() if seen['sightings'] >= self.min_sightings}
+        records = [(sid, self._clock(day, start, seen['first']), self._clock(day, start, seen['last']))
+                   for sid, seen in sorted(present.items())]
+
+        changed = 0
+        if write and records:
+            changed = DatabaseManager(self.db_path).mark_attendance_bulk(day, records)
+        wall_seconds = time.perf_counter() - began
+        total_video = sum(video_seconds)
+        if write:
+            self._record_run(course, day, videos, total_video, wall_seconds, sampled, len(records))
+
+        names = {student[0]: student[1] for student in DatabaseManager(self.db_path).get_roster()[1]}
+        return {
+            'course': course,
+            'date': day,
+            'videos': list(videos),
+            'segments': len(segments),
+            'workers': self.workers,
+            'stride': self.stride,
+            'frames_decoded': frames,
+            'frames_sampled': sampled,
+            'video_seconds': round(total_video, 1),
+            'wall_seconds': round(wall_seconds, 2),
+            'video_seconds_per_wall_second': round(total_video / wall_seconds, 2) if wall_seconds > 0 else 0,
+            'present': [{'student_id': sid, 'name': names.get(sid), 'time_in': time_in, 'time_out': time_out,
+                         'sightings': present[sid]['sightings'],
+                         'best_confidence': round(present[sid]['confidence'], 4)}
+                        for sid, time_in, time_out in records],
+            # Matched too rarely to count; likely false matches or a glimpse
+            'unconfirmed': sorted(sid for sid in students if sid not in present),
+            'rows_written': changed
+        }
+
+    @staticmethod
+    def _clock(day, start, offset):
+        if start is None or offset is None:
+            return None
+        begin = datetime.combine(date.fromisoformat(day), start)
+        return (begin + timedelta(seconds=offset)).strftime('%H:%M:%S')
+
+    def _record_run(self, course, day, videos, video_seconds, wall_seconds, sampled, students):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('''
+                INSERT INTO batch_runs (course, date, videos, video_seconds, wall_seconds, frames_sampled, students)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (course, day, json.dumps(list(videos)), video_seconds, wall_seconds, sampled, students))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def parse_clock(value):
+    """'HH:MM' or 'HH:MM:SS' -> datetime.time"""
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Expected HH:MM or HH:MM:SS, got {value!r}")
+
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected YYYY-MM-DD, got {value!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute attendance from recorded lecture videos")
+    parser.add_argument('--video', action='append', required=True, help="recording to process (repeatable, in order)")
+    parser.add_argument('--course', required=True, help="course the recording belongs to")
+    parser.add_argument('--date', type=parse_day, default=None, help="lecture date, YYYY-MM-DD (default: today)")
+    parser.add_argument('--start', type=parse_clock, default=None, help="time the recording starts, HH:MM[:SS]")
+    parser.add_argument('--db', default='attendance_system.db', help="attendance database")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--stride', type=int, default=DEFAULT_STRIDE, help="recognize every Nth frame")
+    parser.add_argument('--segment-seconds', type=float, default=DEFAULT_SEGMENT_SECONDS,
+                        help="video length handed to a worker at a time")
+    parser.add_argument('--min-sightings', type=int, default=DEFAULT_MIN_SIGHTINGS,
+                        help="sampled frames a student must be matched in to count as present")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="confidence needed for a match")
+    parser.add_argument('--scale', type=float, default=1.0, help="resize factor applied before recognition")
+    parser.add_argument('--precision', default=None, help="gallery precision (float64 or int8)")
+    parser.add_argument('--shards', default=None, help="only match these departments, comma-separated ('Site/*' for a prefix)")
+    parser.add_argument('--dry-run', action='store_true', help="report without writing attendance")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    processor = BatchProcessor(args.db, args.workers, args.stride, args.segment_seconds, args.min_sightings,
+                               args.threshold, args.scale, args.precision, args.shards)
+    try:
+        report = processor.run(args.video, args.course, args.date, args.start, write=not args.dry_run)
+    except ValueError as e:
+        print(f"Batch failed: {e}", file=sys.stderr)
+        return 1
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
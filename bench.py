@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+"""
+Offline recognition benchmark
+
+Replays video files or image folders through the same pipeline as the
+web recognition loop (detect -> encode -> match -> mark attendance)
+against a synthetic gallery, and reports per-stage latency percentiles,
+throughput, memory and DB write rate as JSON.
+
+Usage:
+    python -m bench --video lecture.mp4 --gallery-size 1000
+    python -m bench --synthetic 300 --gallery-size 10000
+    python -m bench --images frames/ --gallery-size 5000 --output result.json
+    python -m bench --soak 3600 --stream-clients 2
+    python -m bench --compare-shards --gallery-size 100000 --shard-size 2000
+
+--soak runs the live web path instead (recognition loop, MJPEG stream
+clients) on a synthetic camera under tracemalloc and reports how traced
+memory, per-interval allocation peaks and GC activity evolve.
+
+Galleries come from datagen.py (deterministic per --seed);
+--history-days also preloads that many class days of attendance.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import gc
+import numpy as np
+import threading
+
+from database import DatabaseManager
+from datagen import encoding_blobs, load_attendance, load_students, student_id, student_name, synthetic_encodings
+from face_recognition_system import FaceRecognitionSystem, FACE_RECOGNITION_AVAILABLE
+from frame_buffers import POOL_ACQUIRES
+from frame_source import SyntheticSource, open_source
+from gallery import FaceGallery, PRECISIONS
+from metrics import max_rss_kb
+from roi import CameraZones, parse_line, parse_regions
+from shards import SHARD_EVICTIONS, ShardCache
+from voting import DEFAULT_K, DEFAULT_N, IdentityVoter
+
+# Replayed frames are treated as a camera running at this rate
+BENCH_FPS = 30
+STAGES = ('convert', 'detect', 'quality', 'encode', 'match', 'db_write', 'total')
+
+
+def iter_frames(specs):
+    """Yield BGR frames from each source spec in turn, without dropping any"""
+    for spec in specs:
+        source = open_source(spec)
+        if not source.open():
+            print(f"Could not open source: {spec}", file=sys.stderr)
+            source.release()
+            continue
+        while True:
+            ret, frame = source.read()
+            if not ret:
+                break
+            yield frame
+        source.release()
+
+
+def percentiles(samples):
+    """Summarize a list of latencies (seconds) in milliseconds"""
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples) * 1000.0
+    return {
+        'count': int(values.size),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p90_ms': round(float(np.percentile(values, 90)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'max_ms': round(float(values.max()), 3)
+    }
+
+
+def run_benchmark(face_system, frames, scale=1.0, threshold=0.7, max_frames=None, quality=True, vote=None,
+                  zones=None):
+    """Run frames through the recognition pipeline and collect timings
+
+    vote is a (k, n) pair to mark attendance only on K-of-N identity
+    commits like the live loops, or None to write every match. zones
+    (roi.CameraZones) limits the search to regions and, with an entry
+    line, marks on crossings; stage timings are summed over regions.
+    """
+    voter = IdentityVoter(vote[0], vote[1], threshold) if vote else None
+    timings = {stage: [] for stage in STAGES}
+    frame_count = 0
+    face_count = 0
+    encoded_count = 0
+    skipped = {}
+    db_writes = 0
+    # (frame number, student_id) of every match above the threshold
+    matches = set()
+    confidences = []
+    # student_ids the voter committed at least once
+    committed = set()
+
+    start = time.perf_counter()
+    for frame in frames:
+        if max_frames is not None and frame_count >= max_frames:
+            break
+
+        t0 = time.perf_counter()
+        if scale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
+        height, width = frame.shape[:2]
+        regions, line = zones.for_size(width, height) if zones else (None, None)
+        spent = dict.fromkeys(('convert', 'detect', 'quality', 'encode', 'match'), 0.0)
+        spent['convert'] = time.perf_counter() - t0
+        face_locations, good_locations, recognized_faces = [], [], []
+
+        # Same per-region pipeline as FaceRecognitionSystem.recognize_faces_in_frame
+        for top, right, bottom, left in regions or [(0, width, height, 0)]:
+            ta = time.perf_counter()
+            rgb_frame = cv2.cvtColor(frame[top:bottom, left:right], cv2.COLOR_BGR2RGB)
+            tb = time.perf_counter()
+            locations = face_system.detect_faces(rgb_frame)
+            tc = time.perf_counter()
+            if quality:
+                good, region_skipped = face_system.filter_faces(rgb_frame, locations, scale)
+            else:
+                good, region_skipped = locations, {}
+            td = time.perf_counter()
+            face_encodings = face_system.encode_faces(rgb_frame, good)
+            te = time.perf_counter()
+            recognized_faces.extend(face_system.match_face(e) for e in face_encodings)
+            tf = time.perf_counter()
+
+            face_locations.extend((t + top, r + left, b + top, l + left) for t, r, b, l in locations)
+            good_locations.extend((t + top, r + left, b + top, l + left) for t, r, b, l in good)
+            for reason in region_skipped.values():
+                skipped[reason] = skipped.get(reason, 0) + 1
+            for stage, seconds in zip(spent, (tb - ta, tc - tb, td - tc, te - td, tf - te)):
+                spent[stage] += seconds
+        t4 = time.perf_counter()
+
+        frame_matches = [f for f in recognized_faces
+                         if f.get('student_id') and f.get('confidence', 0) > threshold]
+        for face_info in frame_matches:
+            matches.add((frame_count, face_info['student_id']))
+            confidences.append(float(face_info['confidence']))
+
+        # Same marking rule as run_web_system.recognition_loop; replayed
+        # frames are spaced at BENCH_FPS for the voter's track timeout
+        if voter is not None:
+            to_mark = voter.update(good_locations, recognized_faces, now=frame_count / BENCH_FPS, line=line)
+            for face_info in to_mark:
+                committed.add(face_info['student_id'])
+        else:
+            to_mark = frame_matches
+        frame_writes = 0
+        for face_info in to_mark:
+            face_system.db.mark_attendance(face_info['student_id'], direction=face_info.get('direction'))
+            frame_writes += 1
+        t5 = time.perf_counter()
+
+        timings['convert'].append(spent['convert'])
+        timings['detect'].append(spent['detect'])
+        if face_locations:
+            timings['quality'].append(spent['quality'])
+        if good_locations:
+            timings['encode'].append(spent['encode'])
+            timings['match'].append(spent['match'])
+        if frame_writes:
+            timings['db_write'].append(t5 - t4)
+        timings['total'].append(t5 - t0)
+
+        frame_count += 1
+        face_count += len(face_locations)
+        encoded_count += len(good_locations)
+        db_writes += frame_writes
+
+    elapsed = time.perf_counter() - start
+
+    return {
+        'frames': frame_count,
+        'faces': face_count,
+        'encoder_calls': encoded_count,
+        'faces_skipped': skipped,
+        'matches': len(matches),
+        'mean_match_confidence': round(float(np.mean(confidences)), 4) if confidences else None,
+        'elapsed_s': round(elapsed, 3),
+        'fps': round(frame_count / elapsed, 2) if elapsed > 0 else 0,
+        'db_writes': db_writes,
+        'db_writes_per_s': round(db_writes / elapsed, 2) if elapsed > 0 else 0,
+        'vote': f"{voter.k}/{voter.n}" if voter else None,
+        'roi_area': zones.area_fraction() if zones else 1.0,
+        'entry_line': bool(zones and zones.line),
+        'never_committed': len({sid for _, sid in matches} - committed) if voter else None,
+        'stages': {stage: percentiles(samples) for stage, samples in timings.items()},
+        '_matches': matches
+    }
+
+
+def compare_quality(face_system, specs, **options):
+    """Run the same frames with and without quality gating
+
+    Without labelled video, matches that only happen without gating are
+    the candidates for false matches; they are listed for review.
+    """
+    ungated = run_benchmark(face_system, iter_frames(specs), quality=False, **options)
+    gated = run_benchmark(face_system, iter_frames(specs), quality=True, **options)
+    only_ungated = sorted(ungated.pop('_matches') - gated.pop('_matches'))
+
+    return {
+        'ungated': ungated,
+        'gated': gated,
+        'encoder_call_reduction': round(1 - gated['encoder_calls'] / ungated['encoder_calls'], 4) if ungated['encoder_calls'] else 0,
+        'matches_removed_by_gating': len(only_ungated),
+        'matches_removed_sample': [{'frame': f, 'student_id': sid} for f, sid in only_ungated[:50]]
+    }
+
+
+def compare_precision(size, seed=0, queries=200, noise=0.02):
+    """Compare gallery precisions against the list-of-arrays face_distance path
+
+    Queries are noisy copies of enrolled faces plus as many strangers.
+    Reports memory, time per query and how often the best match and the
+    match/no-match decision agree with the float64 result.
+    """
+    encodings = synthetic_encodings(size, seed)
+    rows = list(zip(map(student_id, range(size)), map(student_name, range(size)), encoding_blobs(encodings)))
+
+    rng = np.random.default_rng(seed + 1)
+    members = encodings[rng.integers(0, size, queries)] + rng.normal(scale=noise, size=(queries, 128))
+    strangers = synthetic_encodings(queries, seed + 2)
+    probes = np.vstack([members, strangers])
+
+    # What match_face did before the gallery snapshot: a list of arrays
+    # converted by face_recognition.face_distance on every call
+    baseline = [encodings[i].copy() for i in range(size)]
+    baseline_bytes = sys.getsizeof(baseline) + sum(sys.getsizeof(e) for e in baseline)
+
+    def face_distance(known, encoding):
+        return np.linalg.norm(np.asarray(known) - encoding, axis=1)
+
+    def measure(distance):
+        best = []
+        start = time.perf_counter()
+        for probe in probes:
+            d = distance(probe)
+            i = int(np.argmin(d))
+            best.append((i, float(d[i])))
+        return best, (time.perf_counter() - start) / len(probes)
+
+    reference, baseline_s = measure(lambda q: face_distance(baseline, q))
+    report = {'gallery_size': size, 'queries': len(probes),
+              'face_distance': {'bytes': baseline_bytes, 'ms_per_query': round(baseline_s * 1000, 3)}}
+
+    for precision in PRECISIONS:
+        gallery = FaceGallery.from_rows(rows, precision=precision)
+        best, seconds = measure(gallery.distances)
+        deltas = [abs(d - ref_d) for (_, d), (_, ref_d) in zip(best, reference)]
+        report[precision] = {
+            'bytes': gallery.nbytes(),
+            'memory_reduction': round(baseline_bytes / gallery.nbytes(), 2),
+            'ms_per_query': round(seconds * 1000, 3),
+            'speedup': round(baseline_s / seconds, 2),
+            'top1_agreement': sum(i == ref_i for (i, _), (ref_i, _) in zip(best, reference)) / len(probes),
+            'decision_agreement': sum((d < 0.6) == (ref_d < 0.6) for (_, d), (_, ref_d) in zip(best, reference)) / len(probes),
+            'max_distance_delta': float(max(deltas))
+        }
+    return report
+
+
+def compare_shards(size, shard_size, seed=0, queries=200, noise=0.02, precision=None, budget_mb=None,
+                   lookups=500):
+    """Compare matching against the whole gallery with cameras bound to shards
+
+    The gallery is spread over size // shard_size departments. For
+    bindings of 1 and 3 departments it reports the cold load time, memory
+    and time per query, and how often the best match agrees with the
+    full gallery for students of the bound departments. A rotation of
+    random single-department bindings then shows shard lookups, hits and
+    evictions under the memory budget (default: room for 10 shards).
+    """
+    departments = max(1, size // shard_size)
+    encodings = synthetic_encodings(size, seed)
+    rng = np.random.default_rng(seed + 1)
+
+    workdir = tempfile.mkdtemp(prefix="attendance_shards_")
+    try:
+        db = DatabaseManager(os.path.join(workdir, "bench.db"))
+        load_students(db.db_path, size, seed, departments)
+
+        t0 = time.perf_counter()
+        version, rows = db.get_face_gallery()
+        full = FaceGallery.from_rows(rows, version, precision)
+        full_load_s = time.perf_counter() - t0
+        del rows
+
+        def measure(gallery, probes):
+            best = []
+            start = time.perf_counter()
+            for probe in probes:
+                best.append(gallery.ids[int(np.argmin(gallery.distances(probe)))])
+            return best, (time.perf_counter() - start) / len(probes)
+
+        everyone = rng.integers(0, size, queries)
+        _, full_s = measure(full, encodings[everyone] + rng.normal(scale=noise, size=(queries, 128)))
+        report = {
+            'gallery_size': size,
+            'departments': departments,
+            'shard_size': shard_size,
+            'precision': full.precision,
+            'full': {'load_s': round(full_load_s, 3), 'bytes': full.nbytes(), 'ms_per_query': round(full_s * 1000, 3)}
+        }
+
+        for width in (1, 3):
+            bound = [f"Dept {d}" for d in range(min(width, departments))]
+            cache = ShardCache(db, precision)
+            t0 = time.perf_counter()
+            view = cache.view(bound)
+            cold_s = time.perf_counter() - t0
+
+            # Students of the bound departments, as load_students assigned them
+            members = rng.choice(np.flatnonzero(np.arange(size) % departments < width), queries)
+            probes = encodings[members] + rng.normal(scale=noise, size=(queries, 128))
+            sharded, sharded_s = measure(view, probes)
+            reference, _ = measure(full, probes)
+            report[f'{width}_shard'] = {
+                'students': len(view),
+                'bytes': view.nbytes(),
+                'cold_load_ms': round(cold_s * 1000, 1),
+                'ms_per_query': round(sharded_s * 1000, 3),
+                'speedup': round(full_s / sharded_s, 1),
+                'top1_agreement': sum(a == b for a, b in zip(sharded, reference)) / queries
+            }
+
+        shard_bytes = report['1_shard']['bytes']
+        budget = int(budget_mb * 2 ** 20) if budget_mb else shard_bytes * 10
+        cache = ShardCache(db, precision, budget_bytes=budget)
+        evictions = SHARD_EVICTIONS.labels().value()
+        hits, timings, peak = 0, [], 0
+        for department in rng.integers(0, departments, lookups):
+            name = f"Dept {department}"
+            hits += name in cache.shards
+            t0 = time.perf_counter()
+            cache.view([name])
+            timings.append(time.perf_counter() - t0)
+            peak = max(peak, cache.nbytes())
+        report['rotation'] = {
+            'lookups': lookups,
+            'budget_bytes': budget,
+            'hit_rate': round(hits / lookups, 3),
+            'evictions': int(SHARD_EVICTIONS.labels().value() - evictions),
+            'peak_bytes': peak,
+            'view_latency': percentiles(timings)
+        }
+        return report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def soak(seconds, clients=2, interval=60.0, gallery_size=100, seed=0):
+    """Run the web recognition loop and stream clients on a synthetic camera under tracemalloc
+
+    Every interval records traced memory, the allocation peak since the
+    previous sample (transient per-frame buffers show up here) and GC
+    collections. Steady traced memory and a small peak-over-current mean
+    the live path is not allocating per frame.
+    """
+    os.environ['ATTENDANCE_CAMERA_SOURCE'] = 'synthetic'
+    workdir = tempfile.mkdtemp(prefix="attendance_soak_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import run_web_system as web
+        load_students(web.db.db_path, gallery_size, seed)
+        web.face_system.refresh_gallery(force=True)
+
+        stop = threading.Event()
+        sent = [0] * clients
+
+        def stream_client(i):
+            stream = web.generate_frames()
+            for chunk in stream:
+                sent[i] += len(chunk)
+                if stop.is_set():
+                    break
+            stream.close()
+
+        gc.collect()
+        tracemalloc.start()
+        if not web.camera_manager.start_camera():
+            raise RuntimeError("Synthetic camera failed to start")
+        web.recognition_active = True
+        threads = [threading.Thread(target=web.recognition_loop, daemon=True)]
+        threads += [threading.Thread(target=stream_client, args=(i,), daemon=True) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+
+        samples = []
+        start = time.monotonic()
+        collections = sum(s['collections'] for s in gc.get_stats())
+        while time.monotonic() - start < seconds:
+            time.sleep(min(interval, max(0, seconds - (time.monotonic() - start))))
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            now_collections = sum(s['collections'] for s in gc.get_stats())
+            samples.append({
+                't_s': round(time.monotonic() - start, 1),
+                'frames': web.camera_manager.frame_count,
+                'traced_kb': current // 1024,
+                'peak_over_current_kb': (peak - current) // 1024,
+                'gc_collections': now_collections - collections,
+                'max_rss_kb': max_rss_kb()
+            })
+            collections = now_collections
+        elapsed = time.monotonic() - start
+
+        stop.set()
+        web.recognition_active = False
+        for thread in threads:
+            thread.join(timeout=5)
+        web.camera_manager.stop_camera()
+        tracemalloc.stop()
+
+        frames = samples[-1]['frames'] if samples else 0
+        steady = samples[1:] or samples
+        steady_seconds = samples[-1]['t_s'] - samples[0]['t_s'] if len(samples) > 1 else elapsed
+        return {
+            'seconds': round(elapsed, 1),
+            'stream_clients': clients,
+            'frames': frames,
+            'fps': round(frames / elapsed, 2) if elapsed else 0,
+            'stream_mb_sent': round(sum(sent) / 1e6, 1),
+            # First interval includes warm-up (imports, gallery, pool allocation)
+            'traced_growth_kb': steady[-1]['traced_kb'] - steady[0]['traced_kb'] if steady else 0,
+            'mean_peak_over_current_kb': round(float(np.mean([s['peak_over_current_kb'] for s in steady])), 1) if steady else 0,
+            'gc_collections_per_min': round(sum(s['gc_collections'] for s in steady) * 60 / steady_seconds, 1)
+            if steady_seconds else 0,
+            'pool_acquires': {values[0]: int(child.value()) for values, child in POOL_ACQUIRES.children()},
+            'samples': samples
+        }
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline face recognition benchmark")
+    parser.add_argument('--video', action='append', default=[], help="video file to replay (repeatable)")
+    parser.add_argument('--images', action='append', default=[], help="folder of images to replay (repeatable)")
+    parser.add_argument('--synthetic', type=int, default=0, help="also replay this many generated frames")
+    parser.add_argument('--gallery-size', type=int, default=100, help="number of synthetic students")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic gallery")
+    parser.add_argument('--history-days', type=int, default=0,
+                        help="preload this many class days of synthetic attendance (see datagen.py)")
+    parser.add_argument('--scale', type=float, default=1.0, help="resize factor applied before detection")
+    parser.add_argument('--threshold', type=float, default=0.7, help="confidence needed to mark attendance")
+    parser.add_argument('--max-frames', type=int, default=None, help="stop after this many frames")
+    parser.add_argument('--trace-memory', action='store_true', help="track Python allocations with tracemalloc")
+    parser.add_argument('--quality', choices=('on', 'off', 'compare'), default='on',
+                        help="face quality gating before encoding; compare runs the frames both ways")
+    parser.add_argument('--vote', type=parse_vote, default=f"{DEFAULT_K}/{DEFAULT_N}",
+                        help="mark on K/N identity votes like the live loops, or 'off' to write every match")
+    parser.add_argument('--roi', type=parse_regions, default='', help="only search these regions, x,y,w,h[;...] as frame fractions")
+    parser.add_argument('--entry-line', type=parse_line, default='', help="mark on crossings of this line, x1,y1,x2,y2 as frame fractions")
+    parser.add_argument('--precision', choices=PRECISIONS, default=None, help="gallery precision (default: $ATTENDANCE_GALLERY_PRECISION or float64)")
+    parser.add_argument('--compare-precision', action='store_true', help="only compare gallery precisions on --gallery-size faces")
+    parser.add_argument('--shards', default=None, help="match only these departments ('Dept 0,Dept 1'); the gallery has 10")
+    parser.add_argument('--compare-shards', action='store_true',
+                        help="only compare the full gallery with department shards of --shard-size faces")
+    parser.add_argument('--shard-size', type=int, default=2000, help="students per department for --compare-shards")
+    parser.add_argument('--shard-budget-mb', type=float, default=None,
+                        help="shard memory budget for --compare-shards (default: room for 10 shards)")
+    parser.add_argument('--soak', type=float, default=0, metavar='SECONDS',
+                        help="run the live web path on a synthetic camera for this long under tracemalloc")
+    parser.add_argument('--stream-clients', type=int, default=2, help="MJPEG stream clients during --soak")
+    parser.add_argument('--soak-interval', type=float, default=60, help="seconds between --soak memory samples")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    return parser.parse_args(argv)
+
+
+def parse_vote(value):
+    """'3/5' -> (3, 5), 'off' -> None"""
+    if value == 'off':
+        return None
+    try:
+        k, n = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"--vote expects K/N or off, got {value!r}")
+    return k, n
+
+
+def write_report(report, path=None):
+    output = json.dumps(report, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare_precision:
+        write_report(compare_precision(args.gallery_size, args.seed), args.output)
+        return 0
+    if args.compare_shards:
+        write_report(compare_shards(args.gallery_size, args.shard_size, args.seed, precision=args.precision,
+                                    budget_mb=args.shard_budget_mb), args.output)
+        return 0
+    if args.soak:
+        write_report(soak(args.soak, args.stream_clients, args.soak_interval, args.gallery_size, args.seed),
+                     args.output)
+        return 0
+    if not args.video and not args.images and not args.synthetic:
+        print("Nothing to replay: pass --video, --images or --synthetic", file=sys.stderr)
+        return 2
+
+    specs = args.video + args.images
+    if args.synthetic:
+        specs.append(SyntheticSource(fps=None, frames=args.synthetic, seed=args.seed))
+
+    workdir = tempfile.mkdtemp(prefix="attendance_bench_")
+    try:
+        db = DatabaseManager(os.path.join(workdir, "bench.db"))
+        load_students(db.db_path, args.gallery_size, args.seed)
+        # Attendance writes then land in a table of realistic size
+        history_rows = load_attendance(db.db_path, args.history_days, args.seed) if args.history_days else 0
+
+        if args.trace_memory:
+            tracemalloc.start()
+
+        t0 = time.perf_counter()
+        face_system = FaceRecognitionSystem(db, precision=args.precision, shards=args.shards)
+        gallery_load_s = time.perf_counter() - t0
+
+        options = {'scale': args.scale, 'threshold': args.threshold, 'max_frames': args.max_frames,
+                   'vote': args.vote, 'zones': CameraZones(args.roi, args.entry_line)}
+        if args.quality == 'compare':
+            results = compare_quality(face_system, specs, **options)
+        else:
+            results = run_benchmark(face_system, iter_frames(specs), quality=args.quality == 'on', **options)
+            results.pop('_matches')
+
+        report = {
+            'face_recognition_available': FACE_RECOGNITION_AVAILABLE,
+            'gallery_size': len(face_system.known_face_ids),
+            'gallery_precision': face_system.gallery.precision,
+            'shards': list(face_system.shard_bindings),
+            'gallery_bytes': face_system.gallery.nbytes(),
+            'gallery_load_s': round(gallery_load_s, 3),
+            'history_rows': history_rows,
+            'scale': args.scale,
+            'sources': {'video': args.video, 'images': args.images, 'synthetic': args.synthetic},
+            **results,
+            'memory': {'max_rss_kb': max_rss_kb()}
+        }
+
+        if args.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report['memory']['python_current_kb'] = current // 1024
+            report['memory']['python_peak_kb'] = peak // 1024
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
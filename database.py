@@ -1,10 +1,21 @@
 import sqlite3
 import os
+import threading
 from datetime import datetime
+import metrics
+
+DB_QUERY_SECONDS = metrics.histogram(
+    'attendance_db_query_seconds', 'Time spent in DatabaseManager calls', ('operation',))
+ROSTER_CACHE = metrics.counter('attendance_roster_cache_total', 'Roster cache lookups', ('result',))
+
+# Roster rows per database file, shared by every DatabaseManager in the process:
+# {db_path: (students version, [(student_id, name, email, phone, department), ...])}
+_roster_cache = {}
+_roster_lock = threading.Lock()
 
 class DatabaseManager:
-    def __init__(self):
-        self.db_path = "attendance_system.db"
+    def __init__(self, db_path="attendance_system.db"):
+        self.db_path = db_path
         self.init_database()
     
     def init_database(self):
@@ -12,6 +23,12 @@ class DatabaseManager:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # Lets maintenance release freed pages without a full VACUUM (new databases only)
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
+        # WAL lets readers (reports, backups) run alongside attendance writes
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Students table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS students (
@@ -40,9 +57,77 @@ class DatabaseManager:
             )
         ''')
         
+        # Key/value settings (camera, recognition) saved from the settings page
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # mark_attendance looks up (student_id, date) and daily views filter on
+        # date. status makes the first index covering for per-student reports
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student_date_status ON attendance (student_id, date, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date)')
+        # Gallery shards load one department at a time
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_students_department ON students (department)')
+        
+        # Change counters, bumped by triggers so caches can tell when data changed.
+        # time_out updates (every repeat recognition) don't change reports, so they don't count
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO data_versions (name) VALUES ('attendance'), ('students')")
+        for table, events in (('attendance', ('INSERT', 'UPDATE OF student_id, date, status', 'DELETE')),
+                              ('students', ('INSERT', 'UPDATE', 'DELETE'))):
+            for event in events:
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_version_{event.split()[0].lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                    END
+                ''')
+        
+        # Students whose gallery entry changed, so running recognizers can
+        # apply just those instead of reloading every encoding
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS student_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS student_changes_insert AFTER INSERT ON students
+            BEGIN
+                INSERT INTO student_changes (student_id) VALUES (NEW.student_id);
+            END
+        ''')
+        # department moves a student between gallery shards (see shards.py)
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS student_changes_update
+            AFTER UPDATE OF student_id, name, face_encoding, department ON students
+            BEGIN
+                INSERT INTO student_changes (student_id) VALUES (OLD.student_id);
+                INSERT INTO student_changes (student_id) SELECT NEW.student_id WHERE NEW.student_id != OLD.student_id;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS student_changes_delete AFTER DELETE ON students
+            BEGIN
+                INSERT INTO student_changes (student_id) VALUES (OLD.student_id);
+            END
+        ''')
+        
         conn.commit()
         conn.close()
     
+    @DB_QUERY_SECONDS.labels('add_student').time()
     def add_student(self, student_id, name, email, phone, department, face_encoding):
         """Add new student to database"""
         conn = sqlite3.connect(self.db_path)
@@ -60,16 +145,53 @@ class DatabaseManager:
         finally:
             conn.close()
     
-    def get_all_students(self):
-        """Get all students from database"""
+    def get_data_version(self, name):
+        """Change counter for a table ('students' or 'attendance')"""
         conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        try:
+            row = conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else 0
+    
+    def get_roster(self):
+        """Return (version, students), served from memory until students change"""
+        version = self.get_data_version('students')
+        cached = _roster_cache.get(self.db_path)
+        if cached and cached[0] == version:
+            ROSTER_CACHE.labels('hit').inc()
+            return cached
         
-        cursor.execute('SELECT student_id, name, email, phone, department FROM students')
-        students = cursor.fetchall()
-        conn.close()
-        return students
+        ROSTER_CACHE.labels('miss').inc()
+        with _roster_lock:
+            cached = _roster_cache.get(self.db_path)
+            if cached and cached[0] == version:
+                return cached
+            
+            conn = sqlite3.connect(self.db_path)
+            try:
+                # Read the version again inside the same snapshot as the rows
+                conn.execute('BEGIN')
+                version = conn.execute("SELECT version FROM data_versions WHERE name = 'students'").fetchone()[0]
+                students = conn.execute('SELECT student_id, name, email, phone, department FROM students').fetchall()
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+            
+            cached = (version, students)
+            _roster_cache[self.db_path] = cached
+            return cached
+    
+    def clear_roster_cache(self):
+        with _roster_lock:
+            _roster_cache.pop(self.db_path, None)
     
+    @DB_QUERY_SECONDS.labels('get_all_students').time()
+    def get_all_students(self):
+        """Get all students from database"""
+        return list(self.get_roster()[1])
+    
+    @DB_QUERY_SECONDS.labels('get_student_face_encodings').time()
     def get_student_face_encodings(self):
         """Get all face encodings with student IDs"""
         conn = sqlite3.connect(self.db_path)
@@ -80,13 +202,83 @@ class DatabaseManager:
         conn.close()
         return data
     
-    def mark_attendance(self, student_id, status='Present'):
-        """Mark attendance for a student"""
+    @DB_QUERY_SECONDS.labels('get_face_gallery').time()
+    def get_face_gallery(self, department=None):
+        """Return (change seq, face encoding rows) read in one snapshot
+        
+        With a department, only that department's students (one gallery shard).
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('BEGIN')
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM student_changes').fetchone()[0]
+            if department is None:
+                rows = conn.execute('SELECT student_id, name, face_encoding FROM students WHERE face_encoding IS NOT NULL').fetchall()
+            else:
+                rows = conn.execute('''
+                    SELECT student_id, name, face_encoding FROM students
+                    WHERE department = ? AND face_encoding IS NOT NULL
+                ''', (department,)).fetchall()
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return seq, rows
+    
+    def get_departments(self):
+        """Departments that have students, sorted"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('SELECT DISTINCT department FROM students WHERE department IS NOT NULL ORDER BY department').fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+    
+    def get_face_change_seq(self):
+        """Latest student change-log sequence number"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM student_changes').fetchone()[0]
+        finally:
+            conn.close()
+    
+    @DB_QUERY_SECONDS.labels('get_face_changes').time()
+    def get_face_changes(self, since, with_department=False):
+        """Return (change seq, rows) for students changed after since
+        
+        Rows are (student_id, name, face_encoding), plus department with
+        with_department; deleted students come back with the rest None.
+        """
+        columns = 'c.student_id, s.name, s.face_encoding' + (', s.department' if with_department else '')
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('BEGIN')
+            seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM student_changes').fetchone()[0]
+            rows = conn.execute(f'''
+                SELECT {columns}
+                FROM (SELECT DISTINCT student_id FROM student_changes WHERE seq > ?) c
+                LEFT JOIN students s ON s.student_id = c.student_id
+            ''', (since,)).fetchall()
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return seq, rows
+    
+    @DB_QUERY_SECONDS.labels('mark_attendance').time()
+    def mark_attendance(self, student_id, status='Present', direction=None):
+        """Mark attendance for a student
+        
+        Without a direction, the first sighting of the day sets time_in and
+        any later one moves time_out. Entry line cameras pass 'in' or
+        'out': an entry sets time_in once and clears time_out (the student
+        is back inside), an exit sets time_out.
+        """
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
-        today = datetime.now().date()
-        current_time = datetime.now().time()
+        # sqlite3 has no adapter for datetime.time, so store ISO strings
+        now = datetime.now()
+        today = now.date().isoformat()
+        current_time = now.strftime('%H:%M:%S')
         
         # Check if already marked today
         cursor.execute('''
@@ -96,7 +288,27 @@ class DatabaseManager:
         
         existing = cursor.fetchone()
         
-        if existing:
+        if direction == 'in':
+            if existing:
+                cursor.execute('''
+                    UPDATE attendance SET time_in = COALESCE(time_in, ?), time_out = NULL
+                    WHERE id = ?
+                ''', (current_time, existing[0]))
+            else:
+                cursor.execute('''
+                    INSERT INTO attendance (student_id, date, time_in, status)
+                    VALUES (?, ?, ?, ?)
+                ''', (student_id, today, current_time, status))
+        elif direction == 'out':
+            if existing:
+                cursor.execute('UPDATE attendance SET time_out = ? WHERE id = ?', (current_time, existing[0]))
+            else:
+                # Left without being seen coming in (e.g. arrived before the camera started)
+                cursor.execute('''
+                    INSERT INTO attendance (student_id, date, time_out, status)
+                    VALUES (?, ?, ?, ?)
+                ''', (student_id, today, current_time, status))
+        elif existing:
             # Update time_out if already marked in
             if existing[1]:  # time_in exists
                 cursor.execute('''
@@ -114,6 +326,45 @@ class DatabaseManager:
         conn.close()
         return True
     
+    @DB_QUERY_SECONDS.labels('mark_attendance_bulk').time()
+    def mark_attendance_bulk(self, date, records, status='Present'):
+        """Write many students' attendance for one date in a single transaction
+        
+        records are (student_id, time_in, time_out) with times as
+        'HH:MM:SS' or None. Existing rows keep the earliest time_in and the
+        latest time_out, so re-running a batch or mixing it with live
+        marks is harmless. Returns the number of rows inserted or changed.
+        """
+        changed = 0
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                cursor = conn.cursor()
+                for student_id, time_in, time_out in records:
+                    existing = cursor.execute('''
+                        SELECT id, time_in, time_out FROM attendance WHERE student_id = ? AND date = ?
+                    ''', (student_id, date)).fetchone()
+                    
+                    if existing is None:
+                        cursor.execute('''
+                            INSERT INTO attendance (student_id, date, time_in, time_out, status)
+                            VALUES (?, ?, ?, ?, ?)
+                        ''', (student_id, date, time_in, time_out, status))
+                        changed += 1
+                        continue
+                    
+                    row_id, old_in, old_out = existing
+                    new_in = min(t for t in (old_in, time_in) if t) if (old_in or time_in) else None
+                    new_out = max(t for t in (old_out, time_out) if t) if (old_out or time_out) else None
+                    if (new_in, new_out) != (old_in, old_out):
+                        cursor.execute('UPDATE attendance SET time_in = ?, time_out = ? WHERE id = ?',
+                                       (new_in, new_out, row_id))
+                        changed += 1
+        finally:
+            conn.close()
+        return changed
+    
+    @DB_QUERY_SECONDS.labels('get_attendance_records').time()
     def get_attendance_records(self, date=None):
         """Get attendance records for a specific date or all"""
         conn = sqlite3.connect(self.db_path)
@@ -121,24 +372,27 @@ class DatabaseManager:
         
         if date:
             cursor.execute('''
-                SELECT s.name, s.student_id, a.date, a.time_in, a.time_out, a.status
-                FROM attendance a
-                JOIN students s ON a.student_id = s.student_id
-                WHERE a.date = ?
-                ORDER BY a.time_in
+                SELECT student_id, date, time_in, time_out, status
+                FROM attendance
+                WHERE date = ?
+                ORDER BY time_in
             ''', (date,))
         else:
             cursor.execute('''
-                SELECT s.name, s.student_id, a.date, a.time_in, a.time_out, a.status
-                FROM attendance a
-                JOIN students s ON a.student_id = s.student_id
-                ORDER BY a.date DESC, a.time_in
+                SELECT student_id, date, time_in, time_out, status
+                FROM attendance
+                ORDER BY date DESC, time_in
             ''')
         
-        records = cursor.fetchall()
+        rows = cursor.fetchall()
         conn.close()
-        return records
+        
+        # Names come from the cached roster instead of a JOIN; like the JOIN,
+        # rows of students no longer on the roster are left out
+        names = {student[0]: student[1] for student in self.get_roster()[1]}
+        return [(names[row[0]],) + row for row in rows if row[0] in names]
     
+    @DB_QUERY_SECONDS.labels('delete_student').time()
     def delete_student(self, student_id):
         """Delete student and their attendance records"""
         conn = sqlite3.connect(self.db_path)
@@ -149,4 +403,44 @@ class DatabaseManager:
         
         conn.commit()
         conn.close()
-        return True
\ No newline at end of file
+        return True
+    
+    def get_setting(self, key, default=None):
+        """Get a stored setting, or default if it was never saved"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row and row[0] is not None else default
+    
+    def set_setting(self, key, value):
+        """Save a setting"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('''
+                INSERT INTO settings (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            ''', (key, None if value is None else str(value)))
+            conn.commit()
+        finally:
+            conn.close()
+        return True
+    
+    @DB_QUERY_SECONDS.labels('get_database_info').time()
+    def get_database_info(self):
+        """Get record counts and file size of the database"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COUNT(*) FROM students')
+        students = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM attendance')
+        records = cursor.fetchone()[0]
+        conn.close()
+        
+        return {
+            'students': students,
+            'records': records,
+            'size_bytes': os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+        }
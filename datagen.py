@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Deterministic synthetic data for scale testing
+
+    python -m datagen --db scale.db --students 50000 --days 120 --seed 0
+
+Loads students and class days of attendance into a DatabaseManager
+database. The same seed gives the same rows every time:
+
+- students S0000000, S0000001, ... with generated names, spread round
+  robin over --departments: student i is in "Dept {i % departments}"
+- face encodings shaped like dlib's: a component every face shares plus
+  a per-student part. Different students are about 0.9 apart and
+  probe_encodings() (the same student seen again) about 0.4 away, either
+  side of the 0.6 match threshold
+- attendance on the --days weekdays up to --end (default yesterday).
+  Each student has their own attendance rate, drawn from Beta(6, 1):
+  0.86 on average, with a tail of students the low attendance report
+  should find. Arrival is around 08:55 and departure about three hours
+  later
+
+Each load is one transaction on one connection, with synchronous off,
+the rollback journal in memory and a large page cache. Rows go through
+a single prepared INSERT (executemany). The attendance indexes and
+triggers are dropped for the load and recreated at the end. The report
+rollups (see reports.py) are filled from totals counted while
+generating, and the data_versions counters are bumped once, so caches
+see the new data. Encodings are serialized by splicing their bytes into
+a pickle template rather than pickling every array.
+
+The target database must not have students (load_students) or
+attendance (load_attendance) yet. bench.py and loadtest.py build their
+data with this module.
+"""
+
+import argparse
+import json
+import pickle
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from itertools import repeat
+
+import numpy as np
+
+from database import DatabaseManager
+from reports import ReportEngine
+
+DEFAULT_DEPARTMENTS = 10
+ENCODING_SIZE = 128
+# Face encodings: shared component, then the spread between students and
+# between two sightings of one student (per dimension)
+ENCODING_MEAN_NORM = 0.6
+STUDENT_SPREAD = 0.9 / np.sqrt(2 * ENCODING_SIZE)
+PROBE_SPREAD = 0.4 / np.sqrt(ENCODING_SIZE)
+# Attendance: per-student rate ~ Beta(a, b); arrival and stay in seconds
+ATTENDANCE_RATE = (6.0, 1.0)
+ARRIVAL = (8 * 3600 + 55 * 60, 420)
+STAY = (3 * 3600, 1200)
+# Page cache for the load connection, in KiB
+LOAD_CACHE_KB = 262144
+
+FIRST_NAMES = ('Aisha', 'Ben', 'Carlos', 'Dana', 'Elif', 'Farah', 'Gabriel', 'Hana', 'Ivan', 'Jin',
+               'Kofi', 'Lena', 'Mateo', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sven', 'Tariq',
+               'Uma', 'Victor', 'Wei', 'Ximena', 'Yusuf', 'Zoe')
+LAST_NAMES = ('Anderson', 'Bianchi', 'Chen', 'Dubois', 'Eze', 'Fischer', 'Garcia', 'Haddad', 'Ito',
+              'Jensen', 'Kim', 'Lopez', 'Mensah', 'Novak', 'Okafor', 'Patel', 'Quispe', 'Rossi',
+              'Silva', 'Tanaka', 'Umarov', 'Virtanen', 'Wojcik', 'Xu', 'Yilmaz', 'Zhang')
+
+
+def student_id(index):
+    return f"S{index:07d}"
+
+
+def student_name(index):
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    last = LAST_NAMES[(index // len(FIRST_NAMES)) % len(LAST_NAMES)]
+    return f"{first} {last}"
+
+
+def department(index, departments=DEFAULT_DEPARTMENTS):
+    return f"Dept {index % departments}"
+
+
+def synthetic_encodings(size, seed=0):
+    """(size, 128) encodings of size different students"""
+    mean = np.random.default_rng(0).normal(size=ENCODING_SIZE)
+    mean *= ENCODING_MEAN_NORM / np.linalg.norm(mean)
+    rng = np.random.default_rng((seed, 0))
+    return mean + rng.normal(scale=STUDENT_SPREAD, size=(size, ENCODING_SIZE))
+
+
+def probe_encodings(encodings, seed=0, spread=PROBE_SPREAD):
+    """Another sighting of each student: encodings plus per-sighting noise"""
+    rng = np.random.default_rng((seed, 1))
+    return encodings + rng.normal(scale=spread, size=np.shape(encodings))
+
+
+def encoding_blobs(encodings):
+    """pickle.dumps() of every row, built from one pickled template"""
+    encodings = np.ascontiguousarray(encodings, dtype=np.float64)
+    marker = np.arange(1, ENCODING_SIZE + 1, dtype=np.float64) * np.pi
+    template, payload = pickle.dumps(marker), marker.tobytes()
+    start = template.index(payload)
+    prefix, suffix = template[:start], template[start + len(payload):]
+    raw = memoryview(encodings.tobytes())
+    width = len(payload)
+    return [prefix + raw[i * width:(i + 1) * width] + suffix for i in range(len(encodings))]
+
+
+@contextmanager
+def bulk_load(db_path):
+    """One transaction on a connection tuned for loading; WAL again afterwards"""
+    conn = sqlite3.connect(db_path, isolation_level=None, timeout=30)
+    try:
+        conn.execute('PRAGMA journal_mode=MEMORY')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute(f'PRAGMA cache_size=-{LOAD_CACHE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+
+
+def _require_empty(conn, table):
+    if conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone():
+        raise ValueError(f"{table} already has rows; generate into a new database")
+
+
+def load_students(db_path, size, seed=0, departments=DEFAULT_DEPARTMENTS):
+    """Insert size students with encodings; returns their encodings"""
+    DatabaseManager(db_path)
+    encodings = synthetic_encodings(size, seed)
+    rows = zip((student_id(i) for i in range(size)), (student_name(i) for i in range(size)),
+               (f"{student_id(i).lower()}@example.edu" for i in range(size)), repeat(None),
+               (department(i, departments) for i in range(size)), encoding_blobs(encodings))
+    with bulk_load(db_path) as conn:
+        _require_empty(conn, 'students')
+        # Student triggers stay: they keep the gallery change log and roster version right
+        conn.executemany('''
+            INSERT INTO students (student_id, name, email, phone, department, face_encoding)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+    return encodings
+
+
+def class_days(days, end=None):
+    """The last `days` weekdays up to end (default yesterday), oldest first"""
+    day = end or date.today() - timedelta(days=1)
+    result = []
+    while len(result) < days:
+        if day.weekday() < 5:
+            result.append(day)
+        day -= timedelta(days=1)
+    return result[::-1]
+
+
+def load_attendance(db_path, days, seed=0, end=None):
+    """Insert attendance for every student in the database; returns the row count"""
+    DatabaseManager(db_path)
+    # Creates the rollup tables, which are filled below instead of by their triggers
+    ReportEngine(db_path)
+    rng = np.random.default_rng((seed, 2))
+    clock = [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in range(86400)]
+    total = 0
+
+    with bulk_load(db_path) as conn:
+        _require_empty(conn, 'attendance')
+        roster = conn.execute('SELECT student_id, COALESCE(department, \'\') FROM students ORDER BY id').fetchall()
+        if not roster:
+            return 0
+        ids = [row[0] for row in roster]
+        names, codes = np.unique([row[1] for row in roster], return_inverse=True)
+        rates = rng.beta(*ATTENDANCE_RATE, size=len(ids))
+
+        # Per-row triggers and index maintenance are what make large inserts slow
+        schema = conn.execute('''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE tbl_name = 'attendance' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+        ''').fetchall()
+        for kind, name, _ in schema:
+            conn.execute(f'DROP {kind.upper()} "{name}"')
+
+        calendar = class_days(days, end)
+        months = sorted({day.strftime('%Y-%m') for day in calendar})
+        monthly = np.zeros((len(months), len(ids)), dtype=np.int32)
+        daily = []
+        for day in calendar:
+            present = np.flatnonzero(rng.random(len(ids)) < rates)
+            arrival = np.clip(rng.normal(*ARRIVAL, size=present.size), 0, 86399).astype(np.int64)
+            leave = np.clip(arrival + rng.normal(*STAY, size=present.size), arrival, 86399).astype(np.int64)
+            conn.executemany('''
+                INSERT INTO attendance (student_id, date, time_in, time_out, status)
+                VALUES (?, ?, ?, ?, 'Present')
+            ''', zip([ids[i] for i in present], repeat(day.isoformat()),
+                     [clock[s] for s in arrival], [clock[s] for s in leave]))
+            total += present.size
+            monthly[months.index(day.strftime('%Y-%m')), present] += 1
+            counts = np.bincount(codes[present], minlength=len(names))
+            daily.extend((day.isoformat(), str(names[d]), int(counts[d]), int(counts[d])) for d in np.flatnonzero(counts))
+
+        for kind, name, sql in schema:
+            conn.execute(sql)
+
+        conn.executemany('INSERT INTO attendance_monthly_totals (student_id, month, present) VALUES (?, ?, ?)',
+                         ((ids[s], months[m], int(monthly[m, s])) for m, s in zip(*np.nonzero(monthly))))
+        conn.executemany('INSERT INTO attendance_daily_totals (date, department, recorded, present) VALUES (?, ?, ?, ?)',
+                         daily)
+        conn.execute("UPDATE data_versions SET version = version + 1 WHERE name = 'attendance'")
+    return total
+
+
+def generate(db_path, students, days=0, seed=0, departments=DEFAULT_DEPARTMENTS, end=None):
+    """Load students and attendance; returns a report with row counts and load rates"""
+    t0 = time.perf_counter()
+    load_students(db_path, students, seed, departments)
+    students_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    rows = load_attendance(db_path, days, seed, end) if days else 0
+    attendance_s = time.perf_counter() - t0
+    return {
+        'db': db_path,
+        'seed': seed,
+        'students': students,
+        'departments': departments,
+        'class_days': days,
+        'attendance_rows': rows,
+        'students_s': round(students_s, 2),
+        'attendance_s': round(attendance_s, 2),
+        'students_per_s': round(students / students_s) if students_s else None,
+        'attendance_rows_per_s': round(rows / attendance_s) if attendance_s and rows else None
+    }
+
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected YYYY-MM-DD, got {value!r}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load deterministic synthetic students and attendance")
+    parser.add_argument('--db', default='attendance_system.db', help="database to load (must have no students)")
+    parser.add_argument('--students', type=int, default=1000, help="number of students")
+    parser.add_argument('--days', type=int, default=60, help="class days (weekdays) of attendance")
+    parser.add_argument('--departments', type=int, default=DEFAULT_DEPARTMENTS, help="departments to spread students over")
+    parser.add_argument('--seed', type=int, default=0, help="same seed, same data")
+    parser.add_argument('--end', type=parse_day, default=None, help="last class day, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        report = generate(args.db, args.students, args.days, args.seed, max(1, args.departments), args.end)
+    except ValueError as e:
+        print(f"Generation failed: {e}", file=sys.stderr)
+        return 1
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
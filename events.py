@@ -0,0 +1,292 @@
+"""
+Recognition event log
+
+attendance keeps one row per student per day; everything else the
+pipeline sees is gone once the frame is processed. The event log keeps
+it for analytics: every face the recognition loop looks at (a sighting)
+and every identity the voter confirms (a commit, with the entry line
+direction if there is one).
+
+Storage is columnar and partitioned by day:
+
+    events/2026-10-19/1760860800123456789-4242-0.npz
+
+Each file is one flushed chunk: a packed numpy struct array of EVENT_DTYPE
+(20 bytes per event) plus the student ids its student codes refer to, so
+chunks written by different processes never share mutable state.
+Files are written to a temporary name and renamed, and never modified
+afterwards.
+
+EventLog.record_frame() only copies a few fields into a preallocated
+buffer. Full buffers, and partial ones every flush_interval seconds, are
+written by a background thread. Events still in the buffer are not
+visible to queries until flush().
+
+Queries load a date range into one array (load) and work on whole
+columns: hourly_occupancy() and dwell_times().
+"""
+
+import glob
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import metrics
+
+EVENT_DTYPE = np.dtype([
+    ('ts', '<f8'),            # capture time, seconds since the epoch
+    ('student', '<i4'),       # index into the chunk's student ids, -1 for unknown faces
+    ('confidence', '<f2'),
+    ('kind', 'i1'),           # SIGHTING or COMMIT
+    ('direction', 'i1'),      # 1 in, -1 out, 0 none
+    ('x', '<u2'),             # face box centre, frame pixels (0 for commits)
+    ('y', '<u2')
+])
+SIGHTING, COMMIT = 0, 1
+DIRECTIONS = {'in': 1, 'out': -1}
+
+DEFAULT_BUFFER_ROWS = 4096
+DEFAULT_FLUSH_INTERVAL = 5.0
+# Chunks waiting for the writer; past this, new chunks are dropped rather than growing memory
+MAX_PENDING_CHUNKS = 64
+# Sightings further apart than this start a new visit
+DEFAULT_MAX_GAP = 300
+DEFAULT_MIN_CONFIDENCE = 0.7
+
+EVENTS_RECORDED = metrics.counter('attendance_events_recorded_total', 'Recognition events buffered', ('kind',))
+EVENTS_DROPPED = metrics.counter('attendance_events_dropped_total', 'Recognition events dropped because the writer fell behind')
+EVENT_FLUSH_SECONDS = metrics.histogram('attendance_event_flush_seconds', 'Time to write one event chunk')
+
+
+def default_directory(db_path="attendance_system.db"):
+    """$ATTENDANCE_EVENT_DIR, or events/ next to the database"""
+    return os.environ.get('ATTENDANCE_EVENT_DIR') or os.path.join(os.path.dirname(os.path.abspath(db_path)), 'events')
+
+
+class EventLog:
+    def __init__(self, directory, buffer_rows=DEFAULT_BUFFER_ROWS, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.directory = directory
+        self.buffer_rows = buffer_rows
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self._new_buffer()
+        self.pending = deque()
+        self.wake = threading.Event()
+        self.closed = False
+        self.chunks_written = 0
+        self.writer = None
+
+    def _new_buffer(self):
+        self.buffer = np.zeros(self.buffer_rows, EVENT_DTYPE)
+        self.size = 0
+        # student_id -> code, and the ids in code order, for the current buffer
+        self.codes = {}
+        self.students = []
+
+    def _code(self, student_id):
+        if not student_id:
+            return -1
+        code = self.codes.get(student_id)
+        if code is None:
+            code = self.codes[student_id] = len(self.students)
+            self.students.append(student_id)
+        return code
+
+    def _append(self, ts, student_id, confidence, kind, direction=0, x=0, y=0):
+        # Called with the lock held
+        if self.size == self.buffer_rows:
+            self._swap()
+        self.buffer[self.size] = (ts, self._code(student_id), confidence, kind, direction, x, y)
+        self.size += 1
+
+    def record_frame(self, ts, face_locations, recognized_faces):
+        """Log one sighting per face of a processed frame"""
+        if self.closed or not face_locations:
+            return
+        with self.lock:
+            for (top, right, bottom, left), face_info in zip(face_locations, recognized_faces):
+                self._append(ts, face_info.get('student_id'), face_info.get('confidence', 0), SIGHTING,
+                             x=(left + right) // 2, y=(top + bottom) // 2)
+        EVENTS_RECORDED.labels('sighting').inc(len(face_locations))
+        self._start_writer()
+
+    def record_commit(self, ts, face_info):
+        """Log an identity confirmed by the voter (attendance written)"""
+        if self.closed:
+            return
+        with self.lock:
+            self._append(ts, face_info.get('student_id'), face_info.get('confidence', 0), COMMIT,
+                         direction=DIRECTIONS.get(face_info.get('direction'), 0))
+        EVENTS_RECORDED.labels('commit').inc()
+        self._start_writer()
+
+    def _swap(self):
+        """Queue the buffered events for writing and start a new buffer (lock held)"""
+        if not self.size:
+            return
+        if len(self.pending) >= MAX_PENDING_CHUNKS:
+            EVENTS_DROPPED.inc(self.size)
+        else:
+            self.pending.append((self.buffer[:self.size], np.array(self.students, dtype=str)))
+        self._new_buffer()
+        self.wake.set()
+
+    def _start_writer(self):
+        if self.writer is None:
+            with self.lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._run, name='event-log-writer', daemon=True)
+                    self.writer.start()
+
+    def _run(self):
+        while not self.closed:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Event log write error: {e}")
+
+    def flush(self):
+        """Write every buffered event to disk"""
+        with self.lock:
+            self._swap()
+        with self.write_lock:
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        return
+                    rows, students = self.pending.popleft()
+                with EVENT_FLUSH_SECONDS.time():
+                    self._write(rows, students)
+
+    def _write(self, rows, students):
+        days = partition_days(rows['ts'])
+        unique = np.unique(days)
+        for day in unique:
+            part = rows if len(unique) == 1 else rows[days == day]
+            directory = os.path.join(self.directory, str(day))
+            os.makedirs(directory, exist_ok=True)
+            name = f"{time.time_ns()}-{os.getpid()}-{self.chunks_written}"
+            tmp = os.path.join(directory, f".{name}.tmp")
+            with open(tmp, 'wb') as f:
+                np.savez(f, events=part, students=students)
+            os.replace(tmp, os.path.join(directory, f"{name}.npz"))
+            self.chunks_written += 1
+
+    def close(self):
+        """Write what is buffered and stop the writer"""
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self.wake.set()
+
+
+def partition_days(ts):
+    """Local date of each timestamp as datetime64[D]; one lookup when they share a day"""
+    ts = np.asarray(ts)
+    first, last = date.fromtimestamp(ts.min()), date.fromtimestamp(ts.max())
+    if first == last:
+        return np.full(len(ts), np.datetime64(first, 'D'))
+    return np.array([date.fromtimestamp(t) for t in ts], dtype='datetime64[D]')
+
+
+def load(directory, date_from, date_to=None):
+    """(events, student_ids) for the days date_from..date_to
+
+    events is one EVENT_DTYPE array in time order whose student column
+    indexes student_ids (-1 for unknown faces).
+    """
+    date_to = date_to or date_from
+    chunks, id_lists = [], []
+    day = date_from
+    while day <= date_to:
+        for path in sorted(glob.glob(os.path.join(directory, day.isoformat(), '*.npz'))):
+            with np.load(path) as data:
+                chunks.append(data['events'])
+                id_lists.append(data['students'])
+        day += timedelta(days=1)
+    if not chunks:
+        return np.zeros(0, EVENT_DTYPE), np.zeros(0, dtype=str)
+
+    # Chunk-local codes -> codes into one sorted list of ids
+    student_ids, inverse = np.unique(np.concatenate(id_lists), return_inverse=True)
+    offsets = np.cumsum([0] + [len(ids) for ids in id_lists[:-1]])
+    for rows, offset in zip(chunks, offsets):
+        known = rows['student'] >= 0
+        rows['student'][known] = inverse[rows['student'][known] + offset]
+    events = np.concatenate(chunks)
+    return events[np.argsort(events['ts'], kind='stable')], student_ids
+
+
+def hourly_occupancy(events, day, min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """Per-hour counts for one day
+
+    faces: sightings of any face; students: distinct students matched
+    in that hour; entries/exits: entry line crossings; inside: entries
+    minus exits so far.
+    """
+    midnight = datetime.combine(day, datetime.min.time()).timestamp()
+    events = events[(events['ts'] >= midnight) & (events['ts'] < midnight + 86400)]
+    hours = ((events['ts'] - midnight) // 3600).astype(np.int64)
+
+    sightings = events['kind'] == SIGHTING
+    matched = sightings & (events['student'] >= 0) & (events['confidence'] >= min_confidence)
+    # Distinct (hour, student) pairs, counted per hour
+    width = int(events['student'].max(initial=0)) + 1
+    pairs = np.unique(hours[matched] * width + events['student'][matched])
+    students = np.bincount(pairs // width, minlength=24)
+
+    commits = events['kind'] == COMMIT
+    entries = np.bincount(hours[commits & (events['direction'] > 0)], minlength=24)
+    exits = np.bincount(hours[commits & (events['direction'] < 0)], minlength=24)
+    return {
+        'date': day.isoformat(),
+        'hours': list(range(24)),
+        'faces': np.bincount(hours[sightings], minlength=24).tolist(),
+        'students': students.tolist(),
+        'entries': entries.tolist(),
+        'exits': exits.tolist(),
+        'inside': np.cumsum(entries - exits).tolist()
+    }
+
+
+def dwell_times(events, student_ids, max_gap=DEFAULT_MAX_GAP, min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """Time each student spent in view, longest first
+
+    Consecutive sightings of a student up to max_gap seconds apart count
+    as one visit and the time between them as dwell; a longer gap starts
+    a new visit.
+    """
+    keep = (events['kind'] == SIGHTING) & (events['student'] >= 0) & (events['confidence'] >= min_confidence)
+    seen = events[keep]
+    if not len(seen):
+        return []
+    order = np.lexsort((seen['ts'], seen['student']))
+    students, ts = seen['student'][order], seen['ts'][order]
+
+    same = students[1:] == students[:-1]
+    gaps = np.diff(ts)
+    continued = same & (gaps <= max_gap)
+    dwell = np.bincount(students[1:][continued], weights=gaps[continued], minlength=len(student_ids))
+    visits = np.bincount(students[np.r_[True, ~continued]], minlength=len(student_ids))
+
+    first_of = np.r_[True, ~same]
+    last_of = np.r_[~same, True]
+    present = students[first_of]
+    first, last = ts[first_of], ts[last_of]
+    result = [{
+        'student_id': str(student_ids[code]),
+        'dwell_s': round(float(dwell[code]), 1),
+        'visits': int(visits[code]),
+        'first_seen': datetime.fromtimestamp(start).isoformat(timespec='seconds'),
+        'last_seen': datetime.fromtimestamp(end).isoformat(timespec='seconds')
+    } for code, start, end in zip(present, first, last)]
+    result.sort(key=lambda row: row['dwell_s'], reverse=True)
+    return result
@@ -1,7 +1,13 @@
 import cv2
 import numpy as np
 import pickle
+import threading
+import time
 from database import DatabaseManager
+from gallery import FaceGallery
+from shards import parse_shards, shard_cache
+from frame_source import acquire_source, source_from_settings
+import metrics
 
 try:
     import face_recognition
@@ -10,33 +16,162 @@ except ImportError:
     FACE_RECOGNITION_AVAILABLE = False
     print("Warning: face_recognition library not fully available. Using basic face detection.")
 
+RECOGNITION_STAGE_SECONDS = metrics.histogram(
+    'attendance_recognition_stage_seconds', 'Time spent in each recognition stage', ('stage',))
+DETECT_SECONDS = RECOGNITION_STAGE_SECONDS.labels('detect')
+ENCODE_SECONDS = RECOGNITION_STAGE_SECONDS.labels('encode')
+MATCH_SECONDS = RECOGNITION_STAGE_SECONDS.labels('match')
+FRAMES_PROCESSED = metrics.counter('attendance_frames_processed_total', 'Frames run through face recognition')
+FACES_DETECTED = metrics.counter('attendance_faces_detected_total', 'Faces found by the detector')
+FACES_RECOGNIZED = metrics.counter('attendance_faces_recognized_total', 'Faces matched to a known student')
+RECOGNITION_ERRORS = metrics.counter('attendance_recognition_errors_total', 'Frames that failed recognition')
+GALLERY_SIZE = metrics.gauge('attendance_gallery_size', 'Known faces in the in-memory gallery')
+GALLERY_BYTES = metrics.gauge('attendance_gallery_bytes', 'Memory held by gallery encoding arrays')
+GALLERY_UPDATES = metrics.counter('attendance_gallery_updates_total', 'Gallery reloads', ('kind',))
+
+QUALITY_SECONDS = RECOGNITION_STAGE_SECONDS.labels('quality')
+FACES_SKIPPED = metrics.counter(
+    'attendance_faces_skipped_total', 'Detected faces not encoded because of low quality', ('reason',))
+
+# Faces failing any of these are not encoded. Overridable through the
+# quality_<name> settings; 0 turns a check off
+DEFAULT_QUALITY = {
+    # Shorter side of the detection box, in pixels of the captured frame
+    # (scaled down with frames that are resized before recognition)
+    'min_face_size': 36,
+    # Variance of the Laplacian over the face resized to QUALITY_SAMPLE_SIZE
+    'min_sharpness': 40.0,
+    # Nose offset from the eye midpoint divided by the eye distance
+    'max_yaw': 0.35
+}
+QUALITY_SAMPLE_SIZE = 64
+
+# How often recognition checks the student change log for enrollments
+# made by other processes
+GALLERY_POLL_INTERVAL = 1.0
+
 class FaceRecognitionSystem:
-    def __init__(self):
-        self.db = DatabaseManager()
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_face_ids = []
+    def __init__(self, db=None, precision=None, shards=None):
+        self.db = db if db is not None else DatabaseManager()
+        self.face_cascade = None
+        self.gallery = FaceGallery(precision=precision)
+        self.precision = self.gallery.precision
+        self.gallery_lock = threading.Lock()
+        self.gallery_checked = 0
+        # Departments this camera may match (see shards.py); empty matches everyone
+        self.shard_bindings = parse_shards(shards) if isinstance(shards, str) else tuple(shards or ())
         self.load_known_faces()
+        self.load_quality_settings()
+    
+    # Views of the current gallery snapshot
+    @property
+    def known_face_encodings(self):
+        return self.gallery.encodings
+    
+    @property
+    def known_face_names(self):
+        return self.gallery.names
+    
+    @property
+    def known_face_ids(self):
+        return self.gallery.ids
+    
+    @property
+    def sharded(self):
+        return bool(self.shard_bindings) and hasattr(self.db, 'get_departments')
+    
+    def bind_shards(self, shards):
+        """Match only the given departments ('Physics', 'North/*'); empty for everyone"""
+        bindings = parse_shards(shards) if isinstance(shards, str) else tuple(shards or ())
+        if bindings != self.shard_bindings:
+            self.shard_bindings = bindings
+            self.load_known_faces()
     
     def load_known_faces(self):
         """Load known faces from database"""
-        self.known_face_encodings = []
-        self.known_face_names = []
-        self.known_face_ids = []
+        with self.gallery_lock:
+            if self.sharded:
+                # Shards are shared with other cameras and loaded on first use
+                self.gallery = shard_cache(self.db, self.precision).view(self.shard_bindings)
+            else:
+                if hasattr(self.db, 'get_face_gallery'):
+                    version, face_data = self.db.get_face_gallery()
+                else:
+                    version, face_data = 0, self.db.get_student_face_encodings()
+                self.gallery = FaceGallery.from_rows(face_data, version, self.precision)
+            self.gallery_checked = time.monotonic()
+        GALLERY_UPDATES.labels('full').inc()
+        GALLERY_SIZE.set(len(self.gallery))
+        GALLERY_BYTES.set(self.gallery.nbytes())
+    
+    def refresh_gallery(self, force=False):
+        """Apply students added, changed or removed since the gallery was built
+        
+        Called from recognition; checks the change log at most every
+        GALLERY_POLL_INTERVAL seconds unless forced.
+        """
+        if not hasattr(self.db, 'get_face_changes'):
+            return False
+        if not force and time.monotonic() - self.gallery_checked < GALLERY_POLL_INTERVAL:
+            return False
         
-        face_data = self.db.get_student_face_encodings()
+        if self.sharded:
+            return self._refresh_shards()
+        
+        with self.gallery_lock:
+            self.gallery_checked = time.monotonic()
+            gallery = self.gallery
+            seq = self.db.get_face_change_seq()
+            if seq == gallery.version:
+                return False
+            if seq < gallery.version:
+                # Change log went backwards: the database was restored
+                full_reload = True
+            else:
+                full_reload = False
+                seq, changes = self.db.get_face_changes(gallery.version)
+                self.gallery = gallery.apply(changes, seq)
         
-        for student_id, name, encoding_blob in face_data:
-            if encoding_blob:
+        if full_reload:
+            self.load_known_faces()
+            return True
+        GALLERY_UPDATES.labels('incremental').inc()
+        GALLERY_SIZE.set(len(self.gallery))
+        GALLERY_BYTES.set(self.gallery.nbytes())
+        return True
+    
+    def _refresh_shards(self):
+        """Bring the shared shards up to date and rebuild this camera's view if they changed"""
+        cache = shard_cache(self.db, self.precision)
+        with self.gallery_lock:
+            self.gallery_checked = time.monotonic()
+            cache.refresh()
+            if cache.generation == self.gallery.generation:
+                return False
+            self.gallery = cache.view(self.shard_bindings)
+        GALLERY_UPDATES.labels('incremental').inc()
+        GALLERY_SIZE.set(len(self.gallery))
+        GALLERY_BYTES.set(self.gallery.nbytes())
+        return True
+    
+    def load_quality_settings(self):
+        """Read the face quality thresholds from settings"""
+        self.quality = dict(DEFAULT_QUALITY)
+        if hasattr(self.db, 'get_setting'):
+            for name, default in DEFAULT_QUALITY.items():
                 try:
-                    encoding = pickle.loads(encoding_blob)
-                    self.known_face_encodings.append(encoding)
-                    self.known_face_names.append(name)
-                    self.known_face_ids.append(student_id)
-                except:
-                    continue
-    
-    def capture_face_encoding(self, image_path=None, camera_capture=False):
+                    self.quality[name] = float(self.db.get_setting(f'quality_{name}', default))
+                except (TypeError, ValueError):
+                    pass
+    
+    def open_camera(self, source=None):
+        """Acquire the given source, or the camera configured in settings"""
+        if source is None and hasattr(self.db, 'get_setting'):
+            spec, options = source_from_settings(self.db.get_setting)
+            return acquire_source(spec, **options)
+        return acquire_source(source)
+    
+    def capture_face_encoding(self, image_path=None, camera_capture=False, source=None):
         """Capture and return face encoding from image or camera"""
         if not FACE_RECOGNITION_AVAILABLE:
             # Return a dummy encoding for demo purposes
@@ -44,8 +179,8 @@ class FaceRecognitionSystem:
         
         try:
             if camera_capture:
-                # Capture from camera
-                cap = cv2.VideoCapture(0)
+                # Capture from camera (shared with live recognition if running)
+                cap = self.open_camera(source)
                 ret, frame = cap.read()
                 cap.release()
                 
@@ -73,88 +208,221 @@ class FaceRecognitionSystem:
             print(f"Error capturing face: {e}")
             return None
     
-    def recognize_faces_in_frame(self, frame):
-        """Recognize faces in a video frame"""
+    def load_models(self):
+        """Load the face detector now rather than on the first frame"""
+        # face_recognition loads its dlib models when it is imported
+        if not FACE_RECOGNITION_AVAILABLE and self.face_cascade is None:
+            self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    
+    def warm_up(self, frame):
+        """Run every recognition stage once on a BGR frame, outside the metrics
+        
+        Pays the first HOG pass, dlib and BLAS initialization and the first
+        pass over the gallery arrays (see warmup.py). Encoding and matching
+        run on a box in the middle of the frame when no face is detected.
+        Returns the number of faces detected.
+        """
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        face_locations = self.detect_faces(rgb_frame)
+        height, width = rgb_frame.shape[:2]
+        location = face_locations[0] if face_locations else (height // 4, width * 3 // 4, height * 3 // 4, width // 4)
+        self.face_quality(cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY), rgb_frame, location)
+        encodings = self.encode_faces(rgb_frame, [location])
+        self.match_face(encodings[0] if encodings else None)
+        return len(face_locations)
+    
+    def detect_faces(self, rgb_frame):
+        """Find face locations (top, right, bottom, left) in an RGB frame"""
         if not FACE_RECOGNITION_AVAILABLE:
             # Use basic OpenCV face detection for demo
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            self.load_models()
+            gray = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
             
-            recognized_faces = []
-            face_locations = []
-            
-            for (x, y, w, h) in faces:
-                # Convert to face_recognition format (top, right, bottom, left)
-                face_locations.append((y, x + w, y + h, x))
-                
-                # For demo, recognize first student if available
-                if len(self.known_face_names) > 0:
-                    recognized_faces.append({
-                        'name': self.known_face_names[0],
-                        'student_id': self.known_face_ids[0],
-                        'confidence': 0.85
-                    })
-                else:
-                    recognized_faces.append({
-                        'name': "Demo User",
-                        'student_id': "DEMO001",
-                        'confidence': 0.80
-                    })
+            # Convert to face_recognition format (top, right, bottom, left)
+            return [(y, x + w, y + h, x) for (x, y, w, h) in faces]
+        
+        return face_recognition.face_locations(rgb_frame)
+    
+    def estimate_yaw(self, rgb_frame, location):
+        """Signed head turn from the 5-point landmarks, about 0 for a frontal face"""
+        landmarks = face_recognition.face_landmarks(rgb_frame, [location], model='small')
+        if not landmarks:
+            return None
+        points = landmarks[0]
+        left_eye = np.mean(points['left_eye'], axis=0)
+        right_eye = np.mean(points['right_eye'], axis=0)
+        eye_distance = np.linalg.norm(right_eye - left_eye)
+        if eye_distance == 0:
+            return None
+        nose = np.asarray(points['nose_tip'][0], dtype=np.float64)
+        return float((nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance)
+    
+    def face_quality(self, gray_frame, rgb_frame, location, scale=1.0):
+        """Return why a face should not be encoded ('size', 'blur', 'pose'), or None
+        
+        Checks run cheapest first: box size, then sharpness, then the
+        landmark pose estimate. scale is the resize applied to the
+        captured frame, so the size limit stays in capture pixels.
+        """
+        top, right, bottom, left = location
+        if min(bottom - top, right - left) < self.quality['min_face_size'] * scale:
+            return 'size'
+        
+        if self.quality['min_sharpness'] > 0:
+            crop = gray_frame[max(top, 0):bottom, max(left, 0):right]
+            if crop.size == 0:
+                return 'size'
+            sample = cv2.resize(crop, (QUALITY_SAMPLE_SIZE, QUALITY_SAMPLE_SIZE), interpolation=cv2.INTER_AREA)
+            if cv2.Laplacian(sample, cv2.CV_64F).var() < self.quality['min_sharpness']:
+                return 'blur'
+        
+        # The OpenCV fallback detector only finds frontal faces anyway
+        if FACE_RECOGNITION_AVAILABLE and self.quality['max_yaw'] > 0:
+            yaw = self.estimate_yaw(rgb_frame, location)
+            if yaw is not None and abs(yaw) > self.quality['max_yaw']:
+                return 'pose'
+        return None
+    
+    def filter_faces(self, rgb_frame, face_locations, scale=1.0):
+        """Return (locations worth encoding, {index: reason} for skipped ones)"""
+        if not face_locations:
+            return [], {}
+        gray_frame = cv2.cvtColor(rgb_frame, cv2.COLOR_RGB2GRAY)
+        good, skipped = [], {}
+        for i, location in enumerate(face_locations):
+            reason = self.face_quality(gray_frame, rgb_frame, location, scale)
+            if reason:
+                skipped[i] = reason
+                FACES_SKIPPED.labels(reason).inc()
+            else:
+                good.append(location)
+        return good, skipped
+    
+    def encode_faces(self, rgb_frame, face_locations):
+        """Compute face encodings for the given face locations"""
+        if not FACE_RECOGNITION_AVAILABLE:
+            return [None] * len(face_locations)
+        
+        return face_recognition.face_encodings(rgb_frame, face_locations)
+    
+    def match_face(self, face_encoding):
+        """Match a single face encoding against the known faces"""
+        # One snapshot for the whole match, even if a refresh swaps it meanwhile
+        gallery = self.gallery
+        
+        if face_encoding is None:
+            # For demo, recognize first student if available
+            if len(gallery) > 0:
+                return {
+                    'name': gallery.names[0],
+                    'student_id': gallery.ids[0],
+                    'confidence': 0.85
+                }
+            return {
+                'name': "Demo User",
+                'student_id': "DEMO001",
+                'confidence': 0.80
+            }
+        
+        name = "Unknown"
+        student_id = None
+        
+        # Find best match
+        face_distances = gallery.distances(face_encoding)
+        
+        if len(face_distances) > 0:
+            best_match_index = np.argmin(face_distances)
             
-            return recognized_faces, face_locations
+            if face_distances[best_match_index] < 0.6:
+                name = gallery.names[best_match_index]
+                student_id = gallery.ids[best_match_index]
         
+        return {
+            'name': name,
+            'student_id': student_id,
+            'confidence': 1 - min(face_distances) if len(face_distances) > 0 else 0
+        }
+    
+    def recognize_faces_in_frame(self, frame, regions=None, scale=1.0):
+        """Recognize faces in a video frame
+        
+        regions are (top, right, bottom, left) pixel boxes (see roi.py);
+        only those parts of the frame are converted and searched. Returned
+        locations are always in full-frame coordinates. scale is the
+        resize already applied to the captured frame, if any.
+        """
         try:
-            # Convert BGR to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Pick up enrollments made by other processes
+            self.refresh_gallery()
             
-            # Find face locations and encodings
-            face_locations = face_recognition.face_locations(rgb_frame)
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
-            
-            recognized_faces = []
+            if not regions:
+                recognized_faces, face_locations = self._recognize_region(frame, scale)
+            else:
+                recognized_faces, face_locations = [], []
+                for top, right, bottom, left in regions:
+                    # Slicing is a view; only the region is converted and searched
+                    faces, locations = self._recognize_region(frame[top:bottom, left:right], scale)
+                    recognized_faces.extend(faces)
+                    face_locations.extend((t + top, r + left, b + top, l + left) for t, r, b, l in locations)
             
-            for face_encoding in face_encodings:
-                # Compare with known faces
-                matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding)
-                name = "Unknown"
-                student_id = None
-                
-                # Find best match
-                face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
-                
-                if len(face_distances) > 0:
-                    best_match_index = np.argmin(face_distances)
-                    
-                    if matches[best_match_index] and face_distances[best_match_index] < 0.6:
-                        name = self.known_face_names[best_match_index]
-                        student_id = self.known_face_ids[best_match_index]
-                
-                recognized_faces.append({
-                    'name': name,
-                    'student_id': student_id,
-                    'confidence': 1 - min(face_distances) if len(face_distances) > 0 else 0
-                })
+            FRAMES_PROCESSED.inc()
+            FACES_DETECTED.inc(len(face_locations))
+            FACES_RECOGNIZED.inc(sum(1 for face in recognized_faces if face['student_id']))
             
             return recognized_faces, face_locations
         except Exception as e:
+            RECOGNITION_ERRORS.inc()
             print(f"Face recognition error: {e}")
             return [], []
     
-    def start_recognition(self, callback=None):
+    def _recognize_region(self, frame, scale=1.0):
+        """(recognized_faces, face_locations) for one BGR image"""
+        # Convert BGR to RGB
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        
+        # Find face locations and encodings
+        with DETECT_SECONDS.time():
+            face_locations = self.detect_faces(rgb_frame)
+        
+        # Tiny, blurred and turned faces aren't worth encoding
+        with QUALITY_SECONDS.time():
+            good_locations, skipped = self.filter_faces(rgb_frame, face_locations, scale)
+        
+        with ENCODE_SECONDS.time():
+            face_encodings = self.encode_faces(rgb_frame, good_locations)
+        
+        # Compare with known faces
+        with MATCH_SECONDS.time():
+            matches = iter([self.match_face(face_encoding) for face_encoding in face_encodings])
+        
+        # One entry per detected face, in detection order, so callers can zip with locations
+        recognized_faces = [
+            {'name': 'Unknown', 'student_id': None, 'confidence': 0, 'quality': skipped[i]}
+            if i in skipped else next(matches)
+            for i in range(len(face_locations))
+        ]
+        return recognized_faces, face_locations
+    
+    def start_recognition(self, callback=None, source=None):
         """Start real-time face recognition"""
-        cap = cv2.VideoCapture(0)
+        cap = self.open_camera(source)
         
         while True:
             ret, frame = cap.read()
             if not ret:
-                break
+                # Live cameras are reconnected by the capture supervisor; only recorded media end
+                if not cap.isOpened():
+                    break
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+                continue
             
             # Resize frame for faster processing
             small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
             
             # Recognize faces
-            recognized_faces, face_locations = self.recognize_faces_in_frame(small_frame)
+            recognized_faces, face_locations = self.recognize_faces_in_frame(small_frame, scale=0.25)
             
             # Scale back face locations
             face_locations = [(top*4, right*4, bottom*4, left*4) for (top, right, bottom, left) in face_locations]
@@ -199,8 +467,8 @@ class FaceRecognitionSystem:
         success = self.db.add_student(student_id, name, email, phone, department, encoding_blob)
         
         if success:
-            # Reload known faces
-            self.load_known_faces()
+            # Add just the new student to the gallery
+            self.refresh_gallery(force=True)
             return True, "Student added successfully"
         else:
             return False, "Student ID already exists"
\ No newline at end of file
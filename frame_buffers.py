@@ -0,0 +1,163 @@
+"""
+Reusable frame buffers for the live paths
+
+At 30 fps, copying every frame for each consumer and allocating a new
+image for every annotation and encode turns into megabytes per second of
+short-lived arrays. The live paths reuse memory instead:
+
+- FramePool: a small ring of preallocated frame buffers. The recognition
+  loop copies each camera frame into a pooled buffer once and publishes
+  it; readers retain() it while they use it and release() it afterwards,
+  and the buffer goes back to the pool when the last reference is gone.
+- draw_faces: in-place annotation with the recognition results.
+- StreamEncoder: annotates the published frame into one reusable canvas
+  and JPEG-encodes it once per frame; every stream client gets the same
+  bytes object.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+import metrics
+
+DEFAULT_POOL_SIZE = 4
+
+POOL_ACQUIRES = metrics.counter('attendance_frame_pool_acquires_total', 'Frame buffers handed out', ('result',))
+JPEG_ENCODE_SECONDS = metrics.histogram('attendance_jpeg_encode_seconds', 'Time to JPEG-encode a stream frame')
+
+
+class PooledFrame:
+    """Reference-counted handle on one pool buffer
+
+    A handle is created per acquire, so a reader holding an old handle
+    can tell (retain() returns False) that its buffer has been recycled.
+    """
+    __slots__ = ('pool', 'slot', 'generation', 'array', 'refs')
+
+    def __init__(self, pool, slot, generation, array):
+        self.pool = pool
+        self.slot = slot
+        self.generation = generation
+        self.array = array
+        self.refs = 1
+
+    def retain(self):
+        """Take another reference; False if the buffer was already released"""
+        with self.pool.lock:
+            if self.refs == 0:
+                return False
+            self.refs += 1
+            return True
+
+    def release(self):
+        with self.pool.lock:
+            self.refs -= 1
+            if self.refs == 0:
+                self.pool._recycle(self)
+
+
+class FramePool:
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.shape = None
+        self.dtype = None
+        self.buffers = []
+        self.free = []
+        # Bumped when the frame size changes; stale handles aren't recycled
+        self.generation = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        """A handle on a buffer of shape/dtype with one reference"""
+        with self.lock:
+            if shape != self.shape or dtype != self.dtype:
+                self.shape, self.dtype = shape, dtype
+                self.buffers = [np.empty(shape, dtype) for _ in range(self.size)]
+                self.free = list(range(self.size))
+                self.generation += 1
+            if self.free:
+                slot = self.free.pop()
+                POOL_ACQUIRES.labels('reused').inc()
+                return PooledFrame(self, slot, self.generation, self.buffers[slot])
+        # Every buffer is still referenced; a one-off array keeps the caller going
+        POOL_ACQUIRES.labels('allocated').inc()
+        return PooledFrame(self, None, None, np.empty(shape, dtype))
+
+    def copy(self, frame):
+        """Copy frame into a pooled buffer"""
+        pooled = self.acquire(frame.shape, frame.dtype)
+        np.copyto(pooled.array, frame)
+        return pooled
+
+    def _recycle(self, pooled):
+        # Called with the lock held
+        if pooled.slot is not None and pooled.generation == self.generation:
+            self.free.append(pooled.slot)
+
+
+def draw_faces(frame, recognized_faces, face_locations, show_confidence=True):
+    """Draw boxes and name labels on frame in place"""
+    for (top, right, bottom, left), face_info in zip(face_locations, recognized_faces):
+        color = (0, 255, 0) if face_info.get('student_id') else (0, 0, 255)
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+
+        name = face_info.get('name', 'Unknown')
+        label = f"{name} ({face_info.get('confidence', 0):.1%})" if show_confidence else name
+
+        cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
+        cv2.putText(frame, label, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
+    return frame
+
+
+class Canvas:
+    """Reusable output buffer for annotating a copy of a frame"""
+
+    def __init__(self):
+        self.array = None
+
+    def load(self, frame):
+        if self.array is None or self.array.shape != frame.shape or self.array.dtype != frame.dtype:
+            self.array = np.empty_like(frame)
+        np.copyto(self.array, frame)
+        return self.array
+
+
+class StreamEncoder:
+    """Annotated JPEG of the latest published frame, encoded once per frame
+
+    Published values are (PooledFrame, recognized_faces, face_locations).
+    overlay, if given, is called with the canvas before the faces are
+    drawn (e.g. CameraZones.draw).
+    """
+
+    def __init__(self, overlay=None):
+        self.overlay = overlay
+        self.lock = threading.Lock()
+        self.canvas = Canvas()
+        self.sequence = 0
+        self.jpeg = None
+
+    def encode(self, sequence, value):
+        """JPEG bytes for published (sequence, value); None if the frame is gone"""
+        with self.lock:
+            if sequence == self.sequence and self.jpeg is not None:
+                return self.jpeg
+
+            pooled, recognized_faces, face_locations = value
+            if not pooled.retain():
+                return self.jpeg
+            try:
+                canvas = self.canvas.load(pooled.array)
+            finally:
+                pooled.release()
+
+            if self.overlay is not None:
+                self.overlay(canvas)
+            draw_faces(canvas, recognized_faces, face_locations)
+            with JPEG_ENCODE_SECONDS.time():
+                ret, buffer = cv2.imencode('.jpg', canvas)
+            if ret:
+                self.sequence, self.jpeg = sequence, buffer.tobytes()
+            return self.jpeg
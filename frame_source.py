@@ -0,0 +1,622 @@
+"""
+Frame sources for the attendance system
+
+Every consumer (GUI live view, enrollment capture, web recognition loop,
+benchmarks) reads frames through the same small interface, modelled on
+cv2.VideoCapture: open(), read() -> (ret, frame), isOpened(), release().
+
+Implementations:
+- CaptureSource: webcam index, video file or network stream (RTSP/HTTP)
+- ImageFolderSource: sorted images from a directory
+- SyntheticSource: generated frames, no hardware needed
+
+acquire_source() wraps a source in a LatestFrameReader, which drains the
+device on its own thread and keeps only the newest frame, and shares it
+between consumers with reference counting so two parts of the
+application never open the same camera twice.
+
+Cameras are opened with the resolution, frame rate and FOURCC from the
+stored settings (source_from_settings()). MJPG lets USB cameras deliver
+720p/1080p at full frame rate where raw YUYV is limited by USB bandwidth.
+
+Live sources (camera indexes and stream URLs) are supervised by their
+reader: a failed read reopens the device with exponential backoff, and a
+device that stops delivering frames without failing (a hung USB camera
+or RTSP stream blocks in read()) is reopened once the newest frame is
+older than camera_stall_seconds. Consumers keep running meanwhile; reads
+just time out until frames arrive again. Recorded media still end.
+"""
+
+import inspect
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import metrics
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Camera used when no source is given; can point at a file, folder,
+# stream URL or "synthetic" for running without hardware
+DEFAULT_SOURCE = os.environ.get('ATTENDANCE_CAMERA_SOURCE', '0')
+
+DEFAULT_RESOLUTION = '640x480'
+DEFAULT_FPS = 30
+DEFAULT_FOURCC = 'MJPG'
+
+# Reconnect delays for a failed live source: doubled after every failed attempt
+RECONNECT_INITIAL = 0.5
+RECONNECT_MAX = 30.0
+# A live source with no new frame for this long is reopened
+DEFAULT_STALL_AFTER = 5.0
+
+CAMERA_UP = metrics.gauge('attendance_camera_up', '1 while the camera delivers frames, 0 while it is reconnecting')
+CAMERA_RECONNECTS = metrics.counter('attendance_camera_reconnects_total', 'Attempts to reopen a failed camera', ('result',))
+CAMERA_STALLS = metrics.counter('attendance_camera_stalls_total', 'Cameras that stopped delivering frames without failing a read')
+CAMERA_FRAME_AGE = metrics.gauge('attendance_camera_frame_age_seconds', 'Age of the newest camera frame')
+
+
+class FrameSource:
+    """Base class for anything that produces BGR frames"""
+
+    # Live sources are reopened when they fail; others end at their first failed read
+    live = False
+
+    def open(self):
+        """Prepare the source, return True on success"""
+        return True
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        """Return (ret, frame) like cv2.VideoCapture.read()"""
+        raise NotImplementedError
+
+    def describe(self):
+        """Capture properties for status pages"""
+        return {'source': type(self).__name__}
+
+    def release(self):
+        pass
+
+
+class CaptureSource(FrameSource):
+    """Webcam, video file or network stream opened through OpenCV"""
+
+    def __init__(self, device, realtime=False, loop=False, width=None, height=None, fps=None, fourcc=None):
+        self.device = device
+        self.realtime = realtime
+        self.loop = loop
+        # Cameras and network streams; a video file that stops has ended
+        self.live = isinstance(device, int) or '://' in str(device)
+        self.requested = {'width': width, 'height': height, 'fps': fps, 'fourcc': fourcc}
+        self.capture = None
+        self.frame_interval = 0
+        self.next_frame_time = 0
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.device)
+        if not self.capture.isOpened():
+            return False
+
+        if isinstance(self.device, int):
+            self._configure_device()
+
+        # Pace file playback at its native rate so it behaves like a camera
+        if self.realtime:
+            fps = self.capture.get(cv2.CAP_PROP_FPS)
+            self.frame_interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        return True
+
+    def _configure_device(self):
+        # FOURCC first: V4L2 only offers the larger sizes once MJPG is selected
+        fourcc = self.requested['fourcc']
+        if fourcc:
+            self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc[:4].ljust(4)))
+        if self.requested['width'] and self.requested['height']:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.requested['width'])
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.requested['height'])
+        if self.requested['fps']:
+            self.capture.set(cv2.CAP_PROP_FPS, self.requested['fps'])
+        # The reader thread drains the device anyway; a short driver queue
+        # means less stale data when the reader falls behind
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def describe(self):
+        """Requested and actual capture properties (the device may round or refuse)"""
+        actual = {}
+        if self.capture is not None:
+            code = int(self.capture.get(cv2.CAP_PROP_FOURCC))
+            actual = {
+                'width': int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                'height': int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'fps': self.capture.get(cv2.CAP_PROP_FPS),
+                'fourcc': ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00') if code > 0 else None
+            }
+        return {'source': str(self.device), 'requested': self.requested, 'actual': actual}
+
+    def isOpened(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def read(self):
+        if self.capture is None:
+            return False, None
+
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+
+        if ret and self.frame_interval:
+            now = time.monotonic()
+            if self.next_frame_time > now:
+                time.sleep(self.next_frame_time - now)
+            self.next_frame_time = max(now, self.next_frame_time) + self.frame_interval
+        return ret, frame
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class ImageFolderSource(FrameSource):
+    """Images from a directory, in file name order"""
+
+    def __init__(self, directory, loop=False, fps=None):
+        self.directory = directory
+        self.loop = loop
+        self.frame_interval = 1.0 / fps if fps else 0
+        self.paths = []
+        self.index = 0
+
+    def open(self):
+        if not os.path.isdir(self.directory):
+            return False
+        self.paths = [
+            os.path.join(self.directory, name)
+            for name in sorted(os.listdir(self.directory))
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+        self.index = 0
+        return len(self.paths) > 0
+
+    def isOpened(self):
+        return len(self.paths) > 0
+
+    def read(self):
+        # Give up after a whole pass of undecodable files, or looping would spin forever
+        for _ in range(len(self.paths)):
+            if self.index >= len(self.paths):
+                if not self.loop:
+                    return False, None
+                self.index = 0
+
+            path = self.paths[self.index]
+            self.index += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                if self.frame_interval:
+                    time.sleep(self.frame_interval)
+                return True, frame
+        return False, None
+
+    def release(self):
+        self.paths = []
+
+
+class SyntheticSource(FrameSource):
+    """Generated frames with a moving face-sized blob, for tests and benchmarks"""
+
+    def __init__(self, width=640, height=480, fps=30, frames=None, seed=0):
+        self.width = width
+        self.height = height
+        self.frame_interval = 1.0 / fps if fps else 0
+        self.frames = frames
+        self.seed = seed
+        self.count = 0
+        self.background = None
+
+    def open(self):
+        rng = np.random.default_rng(self.seed)
+        self.background = rng.integers(0, 64, (self.height, self.width, 3), dtype=np.uint8)
+        self.count = 0
+        return True
+
+    def isOpened(self):
+        return self.background is not None
+
+    def read(self):
+        if self.background is None:
+            return False, None
+        if self.frames is not None and self.count >= self.frames:
+            return False, None
+
+        if self.frame_interval:
+            time.sleep(self.frame_interval)
+
+        frame = self.background.copy()
+        radius = min(self.width, self.height) // 8
+        span = self.width - 2 * radius
+        x = radius + (self.count * 4) % max(span, 1)
+        y = self.height // 2
+        cv2.ellipse(frame, (x, y), (radius, int(radius * 1.3)), 0, 0, 360, (150, 180, 220), -1)
+        cv2.putText(frame, f"#{self.count}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        self.count += 1
+        return True, frame
+
+    def describe(self):
+        fps = 1.0 / self.frame_interval if self.frame_interval else None
+        return {'source': 'synthetic', 'actual': {'width': self.width, 'height': self.height, 'fps': fps}}
+
+    def release(self):
+        self.background = None
+
+
+def _supported(cls, options):
+    """Keep only the options a source type takes (folders have no fourcc, ...)"""
+    parameters = inspect.signature(cls.__init__).parameters
+    return {name: value for name, value in options.items() if name in parameters}
+
+
+def open_source(spec=None, **options):
+    """Create an unopened FrameSource from a spec string or camera index"""
+    if spec is None:
+        spec = DEFAULT_SOURCE
+    if isinstance(spec, FrameSource):
+        return spec
+    if isinstance(spec, int) or (isinstance(spec, str) and spec.isdigit()):
+        return CaptureSource(int(spec), **_supported(CaptureSource, options))
+    if spec == 'synthetic':
+        return SyntheticSource(**_supported(SyntheticSource, options))
+    if os.path.isdir(spec):
+        return ImageFolderSource(spec, **_supported(ImageFolderSource, options))
+    # Video file or stream URL (rtsp://, http://, ...)
+    return CaptureSource(spec, **_supported(CaptureSource, options))
+
+
+def source_from_settings(get_setting):
+    """Return (spec, options) for the configured camera
+
+    get_setting(key, default) is DatabaseManager.get_setting or similar.
+    ATTENDANCE_CAMERA_SOURCE, when set, takes precedence over the stored
+    camera_index.
+    """
+    spec = os.environ.get('ATTENDANCE_CAMERA_SOURCE') or str(get_setting('camera_index', '0'))
+    options = {'fourcc': get_setting('camera_fourcc', DEFAULT_FOURCC) or None}
+
+    try:
+        width, height = (int(v) for v in str(get_setting('camera_resolution', DEFAULT_RESOLUTION)).lower().split('x'))
+        options.update(width=width, height=height)
+    except ValueError:
+        pass
+    try:
+        options['fps'] = float(get_setting('camera_fps', DEFAULT_FPS))
+    except (TypeError, ValueError):
+        pass
+    try:
+        options['stall_after'] = float(get_setting('camera_stall_seconds', DEFAULT_STALL_AFTER))
+    except (TypeError, ValueError):
+        pass
+    return spec, options
+
+
+class LatestFrameReader:
+    """Reads a source on a background thread and keeps only the newest frame
+
+    Live sources are supervised. A failed read releases the source and
+    reopens it after RECONNECT_INITIAL seconds, doubling the delay up to
+    RECONNECT_MAX while attempts fail. A watchdog thread compares the
+    newest frame's timestamp against stall_after: a reader stuck in
+    read() is abandoned (it releases its source whenever the read
+    returns) and a fresh source from factory is opened. Without a factory
+    stalls are only counted, since the stuck source can't be reopened
+    while it is being read.
+    """
+
+    def __init__(self, source, factory=None, stall_after=DEFAULT_STALL_AFTER):
+        self.source = source
+        # Returns a new, unopened source for reconnects after a stall
+        self.factory = factory
+        self.stall_after = stall_after
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = None
+        self.running = False
+        self.ended = False
+        self.thread = None
+        # Bumped on every reconnect; a reader thread from an older connection exits
+        self.connection = 0
+        self.state = 'closed'
+        self.opened_at = None
+        self.down_since = None
+        self.reconnects = 0
+        self.stalls = 0
+        self.last_error = None
+
+    def start(self):
+        """Open the source and start the reader thread"""
+        if not self.source.open():
+            self.source.release()
+            return False
+
+        self.running = True
+        self.state = 'running'
+        self.opened_at = time.time()
+        self._spawn(self.source)
+        if self.source.live:
+            CAMERA_UP.set(1)
+            if self.stall_after:
+                threading.Thread(target=self._watch, name='frame-watchdog', daemon=True).start()
+        return True
+
+    def _spawn(self, source=None):
+        """Start a reader thread for a new connection; it opens source first if it is None"""
+        with self.condition:
+            self.connection += 1
+            connection = self.connection
+        self.thread = threading.Thread(target=self._run, args=(connection, source), daemon=True)
+        self.thread.start()
+
+    def _current(self, connection):
+        # Called with the condition held
+        return self.running and connection == self.connection
+
+    def _run(self, connection, source):
+        try:
+            while True:
+                if source is None:
+                    source = self._reconnect(connection)
+                    if source is None:
+                        return
+
+                ret, frame = source.read()
+                timestamp = time.time()
+
+                with self.condition:
+                    if not self._current(connection):
+                        return
+                    if ret:
+                        self.frame = frame
+                        self.sequence += 1
+                        self.timestamp = timestamp
+                        self.condition.notify_all()
+                        continue
+                    if not source.live:
+                        self.ended = True
+                        self.running = False
+                        self.state = 'ended'
+                        self.condition.notify_all()
+                        return
+                    self._mark_down(timestamp, 'read failed')
+
+                source.release()
+                source = None
+        finally:
+            if source is not None:
+                source.release()
+
+    def _reconnect(self, connection):
+        """Reopen the source with exponential backoff; None once stopped or superseded"""
+        delay = RECONNECT_INITIAL
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self._current(connection), delay)
+                if not self._current(connection):
+                    return None
+
+            source = self.factory() if self.factory else self.source
+            try:
+                opened = source.open()
+            except Exception as e:
+                opened = False
+                self.last_error = str(e)
+
+            if opened:
+                with self.condition:
+                    if not self._current(connection):
+                        source.release()
+                        return None
+                    self.source = source
+                    self.state = 'running'
+                    self.opened_at = time.time()
+                    self.down_since = None
+                    self.reconnects += 1
+                CAMERA_RECONNECTS.labels('ok').inc()
+                CAMERA_UP.set(1)
+                print(f"Camera reconnected: {source.describe().get('source')}")
+                return source
+
+            source.release()
+            CAMERA_RECONNECTS.labels('failed').inc()
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    def _mark_down(self, now, reason):
+        # Called with the condition held
+        if self.down_since is None:
+            self.down_since = now
+            print(f"Camera lost ({reason}), reconnecting")
+        self.state = 'reconnecting'
+        self.last_error = reason
+        CAMERA_UP.set(0)
+
+    def _watch(self):
+        """Detect a source that stopped delivering frames without failing a read"""
+        interval = min(1.0, self.stall_after / 2)
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running, interval)
+                if not self.running:
+                    return
+                now = time.time()
+                age = now - max(self.timestamp or 0, self.opened_at or 0)
+                CAMERA_FRAME_AGE.set(now - self.timestamp if self.timestamp else age)
+                if self.state != 'running' or age < self.stall_after:
+                    continue
+                self.stalls += 1
+                CAMERA_STALLS.inc()
+                if self.factory is None:
+                    # Counted again every stall_after seconds; the stuck read may still return
+                    self.opened_at = now
+                    continue
+                self._mark_down(now, f"no frame for {age:.1f}s")
+            # The stuck thread belongs to an old connection now and exits when its read returns
+            self._spawn()
+
+    def health(self):
+        """State, frame age and reconnect counts for status pages"""
+        with self.condition:
+            now = time.time()
+            return {
+                'state': self.state,
+                'frame_age_s': round(now - self.timestamp, 3) if self.timestamp else None,
+                'down_s': round(now - self.down_since, 1) if self.down_since else None,
+                'reconnects': self.reconnects,
+                'stalls': self.stalls,
+                'last_error': self.last_error
+            }
+
+    def wait_for_frame(self, last_sequence=0, timeout=None):
+        """Block until a frame newer than last_sequence is available
+
+        Returns (sequence, frame, timestamp), or (last_sequence, None, None)
+        on timeout or end of stream.
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.sequence > last_sequence or self.ended or not self.running,
+                timeout
+            )
+            if self.sequence > last_sequence:
+                return self.sequence, self.frame, self.timestamp
+            return last_sequence, None, None
+
+    def latest(self):
+        """Return (sequence, frame, timestamp) without waiting"""
+        with self.condition:
+            return self.sequence, self.frame, self.timestamp
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            if self.state != 'ended':
+                self.state = 'closed'
+            self.condition.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+
+class SharedFrameSource:
+    """Reference-counted handle on a LatestFrameReader
+
+    Behaves like cv2.VideoCapture for existing call sites: read() returns
+    the newest frame not yet seen by this handle, release() drops the
+    reference and the device is closed when the last handle goes away.
+    """
+
+    def __init__(self, key, reader):
+        self.key = key
+        self.reader = reader
+        self.last_sequence = 0
+        self.released = reader is None
+
+    def isOpened(self):
+        return not self.released and self.reader.running
+
+    def read(self, timeout=2.0, copy=True):
+        if self.released:
+            return False, None
+
+        sequence, frame, _ = self.reader.wait_for_frame(self.last_sequence, timeout)
+        if frame is None:
+            return False, None
+
+        self.last_sequence = sequence
+        # Frames are shared between handles, so hand out a private copy by default
+        return True, frame.copy() if copy else frame
+
+    def describe(self):
+        if self.released:
+            return {}
+        return self.reader.source.describe()
+
+    def health(self):
+        """Supervisor state of the shared reader (see LatestFrameReader.health)"""
+        if self.released:
+            return {'state': 'closed'}
+        return self.reader.health()
+
+    def read_with_timestamp(self, timeout=2.0, copy=True):
+        """Like read() but also return the capture time of the frame"""
+        if self.released:
+            return False, None, None
+
+        sequence, frame, timestamp = self.reader.wait_for_frame(self.last_sequence, timeout)
+        if frame is None:
+            return False, None, None
+
+        self.last_sequence = sequence
+        return True, frame.copy() if copy else frame, timestamp
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        _release_reader(self.key, self.reader)
+
+
+_shared_readers = {}
+_shared_lock = threading.Lock()
+
+
+def acquire_source(spec=None, **options):
+    """Get a shared handle on a frame source, opening it if needed
+
+    options only apply when this call opens the source; a source that is
+    already open keeps the settings it was opened with. stall_after is
+    the supervisor's stall timeout in seconds, 0 to turn it off.
+    """
+    stall_after = options.pop('stall_after', DEFAULT_STALL_AFTER)
+    if spec is None:
+        spec = DEFAULT_SOURCE
+    key = str(spec)
+
+    # Recorded media is replayed at camera pace when shared
+    if isinstance(spec, str) and os.path.isfile(spec):
+        options.setdefault('realtime', True)
+    elif isinstance(spec, str) and os.path.isdir(spec):
+        options.setdefault('fps', 30)
+
+    with _shared_lock:
+        entry = _shared_readers.get(key)
+        if entry is None or not entry['reader'].running:
+            # A source object passed in can't be recreated after a stall
+            factory = None if isinstance(spec, FrameSource) else lambda: open_source(spec, **options)
+            reader = LatestFrameReader(open_source(spec, **options), factory, stall_after)
+            if not reader.start():
+                return SharedFrameSource(key, None)
+            entry = {'reader': reader, 'refs': 0}
+            _shared_readers[key] = entry
+
+        entry['refs'] += 1
+        return SharedFrameSource(key, entry['reader'])
+
+
+def _release_reader(key, reader):
+    with _shared_lock:
+        entry = _shared_readers.get(key)
+        if entry is None or entry['reader'] is not reader:
+            # The reader ended and was replaced; nothing else holds it
+            reader.stop()
+            return
+        entry['refs'] -= 1
+        if entry['refs'] > 0:
+            return
+        del _shared_readers[key]
+
+    reader.stop()
@@ -0,0 +1,200 @@
+"""
+In-memory face gallery
+
+A FaceGallery is an immutable snapshot of the known faces: student ids,
+names and one (N, 128) encoding matrix. Updates build a new snapshot and
+FaceRecognitionSystem swaps it in with a single attribute assignment, so
+a match that already holds the old snapshot finishes against consistent
+data and never sees a half-applied change.
+
+version is the student change-log sequence (DatabaseManager.
+get_face_changes) the snapshot reflects, so a process only has to apply
+the changes made after it.
+
+Precision (ATTENDANCE_GALLERY_PRECISION):
+- float64 (default): exact face_recognition.face_distance results
+- int8: encodings are stored as int8 codes with a per-dimension scale
+  plus a float16 copy. A scan uses integer dot products over the codes
+  to rank every face, then the RERANK_TOP_K closest are recomputed in
+  float32 from the float16 copy. About 3x less memory and a much faster
+  scan on large galleries; the best match and its distance agree with
+  float64 to within float16 rounding (see `python -m bench
+  --compare-precision`).
+"""
+
+import os
+import pickle
+
+import numpy as np
+
+ENCODING_SIZE = 128
+PRECISIONS = ('float64', 'int8')
+DEFAULT_PRECISION = os.environ.get('ATTENDANCE_GALLERY_PRECISION', 'float64')
+RERANK_TOP_K = 10
+# Queries are quantized to int16; int8 codes * int16 query * 128 dims fits int32
+QUERY_LEVELS = 32767
+
+
+def decode_encoding(blob):
+    """Unpickle a stored face encoding, or None if it is missing or unreadable"""
+    if not blob:
+        return None
+    try:
+        encoding = np.asarray(pickle.loads(blob), dtype=np.float64)
+    except Exception:
+        return None
+    return encoding if encoding.shape == (ENCODING_SIZE,) else None
+
+
+class FaceGallery:
+    def __init__(self, ids=(), names=(), encodings=None, version=0, precision=None, _quantized=None):
+        self.precision = precision or DEFAULT_PRECISION
+        if self.precision not in PRECISIONS:
+            raise ValueError(f"Unknown gallery precision: {self.precision}")
+
+        dtype = np.float64 if self.precision == 'float64' else np.float16
+        if encodings is None:
+            encodings = np.empty((0, ENCODING_SIZE))
+        self.ids = list(ids)
+        self.names = list(names)
+        self.encodings = np.ascontiguousarray(encodings, dtype=dtype)
+        self.version = version
+        self.index = {student_id: i for i, student_id in enumerate(self.ids)}
+
+        self.scale = self.codes = self.norms = None
+        if self.precision == 'int8':
+            if _quantized is not None:
+                self.scale, self.codes, self.norms = _quantized
+            else:
+                self._quantize()
+
+    @classmethod
+    def from_rows(cls, rows, version=0, precision=None):
+        """Build from (student_id, name, face_encoding blob) rows"""
+        ids, names, encodings = [], [], []
+        for student_id, name, blob in rows:
+            encoding = decode_encoding(blob)
+            if encoding is not None:
+                ids.append(student_id)
+                names.append(name)
+                encodings.append(encoding)
+        matrix = np.vstack(encodings) if encodings else None
+        return cls(ids, names, matrix, version, precision)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        """Bytes held by the encoding arrays"""
+        arrays = (self.encodings, self.codes, self.norms, self.scale)
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def _quantize(self):
+        values = self.encodings.astype(np.float32)
+        if len(values):
+            self.scale = np.maximum(np.abs(values).max(axis=0) / 127, 1e-12).astype(np.float32)
+        else:
+            self.scale = np.ones(ENCODING_SIZE, dtype=np.float32)
+        self.codes, self.norms = self._encode_rows(values)
+
+    def _encode_rows(self, values):
+        """int8 codes and squared norms of the dequantized rows"""
+        codes = np.clip(np.rint(values / self.scale), -127, 127).astype(np.int8)
+        dequantized = codes * self.scale
+        return codes, np.einsum('ij,ij->i', dequantized, dequantized)
+
+    def apply(self, changes, version):
+        """Return a new gallery with changes applied
+
+        changes are (student_id, name, face_encoding blob) rows; a row with
+        no usable encoding (deleted student, encoding removed) drops the
+        student.
+        """
+        ids = list(self.ids)
+        names = list(self.names)
+        encodings = self.encodings.copy()
+        removed, updated = [], []
+        added_ids, added_names, added = [], [], []
+
+        for student_id, name, blob in changes:
+            encoding = decode_encoding(blob)
+            position = self.index.get(student_id)
+            if encoding is None:
+                if position is not None:
+                    removed.append(position)
+            elif position is not None:
+                names[position] = name
+                encodings[position] = encoding
+                updated.append(position)
+            else:
+                added_ids.append(student_id)
+                added_names.append(name)
+                added.append(encoding)
+
+        keep = None
+        if removed:
+            keep = np.ones(len(ids), dtype=bool)
+            keep[removed] = False
+            ids = [s for s, kept in zip(ids, keep) if kept]
+            names = [n for n, kept in zip(names, keep) if kept]
+        new_rows = np.vstack(added).astype(encodings.dtype) if added else None
+        ids.extend(added_ids)
+        names.extend(added_names)
+
+        quantized = None
+        if self.precision == 'int8':
+            quantized = self._apply_codes(encodings, updated, keep, new_rows)
+        if keep is not None:
+            encodings = encodings[keep]
+        if new_rows is not None:
+            encodings = np.vstack([encodings, new_rows])
+
+        return FaceGallery(ids, names, encodings, version, self.precision, quantized)
+
+    def _apply_codes(self, encodings, updated, keep, new_rows):
+        """Codes for the next snapshot, re-encoding only changed rows
+
+        Returns None (quantize from scratch) when a changed row falls
+        outside the current scale.
+        """
+        changed = encodings[updated].astype(np.float32)
+        if new_rows is not None:
+            changed = np.vstack([changed, new_rows.astype(np.float32)])
+        if len(changed) and np.any(np.abs(changed) > self.scale * 127):
+            return None
+
+        codes, norms = self.codes.copy(), self.norms.copy()
+        if updated:
+            codes[updated], norms[updated] = self._encode_rows(changed[:len(updated)])
+        if keep is not None:
+            codes, norms = codes[keep], norms[keep]
+        if new_rows is not None:
+            new_codes, new_norms = self._encode_rows(changed[len(updated):])
+            codes, norms = np.vstack([codes, new_codes]), np.concatenate([norms, new_norms])
+        return self.scale, codes, norms
+
+    def distances(self, encoding):
+        """Euclidean distance from encoding to every known face (face_recognition.face_distance)
+
+        In int8 mode only the RERANK_TOP_K closest faces get exact
+        distances; the rest are the integer-scan estimates.
+        """
+        if not self.ids:
+            return np.empty(0)
+        if self.precision == 'float64':
+            return np.linalg.norm(self.encodings - encoding, axis=1)
+
+        query = np.asarray(encoding, dtype=np.float32)
+        weighted = query * self.scale
+        step = float(np.abs(weighted).max()) / QUERY_LEVELS or 1.0
+        query_codes = np.rint(weighted / step).astype(np.int32)
+
+        # |q - x|^2 = |q|^2 - 2 q.x + |x|^2 with q.x from an int8 x int32 dot product
+        dots = np.einsum('ij,j->i', self.codes, query_codes)
+        squared = float(query @ query) - 2 * step * dots + self.norms
+        distances = np.sqrt(np.maximum(squared, 0))
+
+        k = min(RERANK_TOP_K, len(self.ids))
+        top = np.argpartition(squared, k - 1)[:k]
+        distances[top] = np.linalg.norm(self.encodings[top].astype(np.float32) - query, axis=1)
+        return distances
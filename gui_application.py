@@ -4,13 +4,21 @@ import cv2
 from PIL import Image, ImageTk
 import threading
 from datetime import datetime, date
+import numpy as np
 import pandas as pd
 from database import DatabaseManager
+from frame_source import acquire_source, source_from_settings
+from voting import voter_from_settings
+from roi import CameraZones
+from frame_buffers import Canvas, draw_faces
 try:
     from face_recognition_system import FaceRecognitionSystem
 except ImportError:
     from simple_face_system import SimpleFaceRecognitionSystem as FaceRecognitionSystem
 
+# Size of the live view in the recognition page
+DISPLAY_SIZE = (640, 480)
+
 class AttendanceSystemGUI:
     def __init__(self):
         self.root = tk.Tk()
@@ -153,45 +161,62 @@ class AttendanceSystemGUI:
     
     def video_loop(self):
         """Video processing loop"""
-        cap = cv2.VideoCapture(0)
+        spec, options = source_from_settings(self.db.get_setting)
+        cap = acquire_source(spec, **options)
+        voter = voter_from_settings(self.db.get_setting)
+        zones = CameraZones.from_settings(self.db.get_setting)
+        self.face_system.bind_shards(self.db.get_setting('camera_shards', ''))
+        
+        # Buffers reused for every frame: annotated copy, resized copy, RGBA
+        # pixels and the Tk image, which is repainted in place
+        canvas = Canvas()
+        resized = None
+        rgba = np.empty((DISPLAY_SIZE[1], DISPLAY_SIZE[0], 4), dtype=np.uint8)
+        photo = None
         
         while self.recognition_active:
-            ret, frame = cap.read()
+            # Shared with other readers: recognition only reads it, drawing happens on the canvas
+            ret, frame = cap.read(copy=False)
             if not ret:
-                break
+                # Live cameras are reconnected by the capture supervisor; only recorded media end
+                if not cap.isOpened():
+                    break
+                continue
             
             # Process frame for face recognition
-            recognized_faces, face_locations = self.face_system.recognize_faces_in_frame(frame)
+            regions, line = zones.for_size(frame.shape[1], frame.shape[0])
+            recognized_faces, face_locations = self.face_system.recognize_faces_in_frame(frame, regions)
+            
+            # Draw regions, rectangles and labels
+            annotated = canvas.load(frame)
+            zones.draw(annotated)
+            draw_faces(annotated, recognized_faces, face_locations, show_confidence=False)
             
-            # Draw rectangles and labels
-            for (top, right, bottom, left), face_info in zip(face_locations, recognized_faces):
-                color = (0, 255, 0) if face_info['student_id'] else (0, 0, 255)
-                cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                
-                label = f"{face_info['name']}"
-                cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
-                cv2.putText(frame, label, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
-                
-                # Mark attendance
-                if face_info['student_id']:
-                    self.mark_attendance(face_info['student_id'], face_info['name'])
+            # Mark attendance once a face has matched the same student in K of N frames
+            for face_info in voter.update(face_locations, recognized_faces, line=line):
+                self.mark_attendance(face_info['student_id'], face_info['name'], face_info.get('direction'))
             
             # Convert frame to display
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_pil = Image.fromarray(frame_rgb)
-            frame_pil = frame_pil.resize((640, 480), Image.Resampling.LANCZOS)
-            frame_tk = ImageTk.PhotoImage(frame_pil)
+            if annotated.shape[1::-1] != DISPLAY_SIZE:
+                resized = cv2.resize(annotated, DISPLAY_SIZE, dst=resized, interpolation=cv2.INTER_AREA)
+                annotated = resized
+            cv2.cvtColor(annotated, cv2.COLOR_BGR2RGBA, dst=rgba)
+            image = Image.frombuffer('RGBA', DISPLAY_SIZE, rgba, 'raw', 'RGBA', 0, 1)
             
             # Update camera label
-            if hasattr(self, 'camera_label'):
-                self.camera_label.config(image=frame_tk, text='')
-                self.camera_label.image = frame_tk
+            if photo is None:
+                photo = ImageTk.PhotoImage(image)
+                if hasattr(self, 'camera_label'):
+                    self.camera_label.config(image=photo, text='')
+                    self.camera_label.image = photo
+            else:
+                photo.paste(image)
         
         cap.release()
     
-    def mark_attendance(self, student_id, name):
+    def mark_attendance(self, student_id, name, direction=None):
         """Mark attendance for recognized student"""
-        success = self.db.mark_attendance(student_id)
+        success = self.db.mark_attendance(student_id, direction=direction)
         if success:
             self.refresh_attendance_log()
     
@@ -513,7 +538,8 @@ class AttendanceSystemGUI:
     
     def reload_face_data(self):
         """Reload face recognition data"""
-        self.face_system.load_known_faces()
+        # Changes are normally picked up automatically; this applies them now
+        self.face_system.refresh_gallery(force=True)
         messagebox.showinfo("Success", "Face recognition data reloaded successfully")
     
     def run(self):
@@ -0,0 +1,296 @@
+"""
+Headless recognition daemon for kiosk and door units
+
+Runs capture, recognition and attendance marking without a display or
+the web UI:
+
+    python main.py --headless [--source 0] [--port 8081]
+
+- GET /healthz answers 200 while frames keep arriving or the camera is
+  being reconnected, and 503 once it has been silent for --stale-after
+  seconds otherwise, for systemd or container health checks
+- GET /metrics serves the same Prometheus metrics as the web server
+- SIGTERM/SIGINT finish the frame in progress, release the camera and
+  checkpoint the WAL before exiting
+- --sync-url forwards attendance to a central server (see sync.py)
+- --roi / --entry-line limit detection to the doorway and mark time_in /
+  time_out on line crossings (see roi.py)
+- --shards matches only the bound departments' students (see shards.py)
+- every face seen and every confirmed identity goes to the recognition
+  event log (see events.py), flushed on shutdown
+- models, caches and a first inference are warmed up while the camera
+  opens (see warmup.py); no frame is recognized before that. GET /readyz
+  answers 200 once warm and frames are arriving
+
+Memory stays flat on long runs: the shared grab-latest reader holds only
+the newest frame, frames are downscaled before recognition, and the
+per-student cooldown table is pruned as entries expire.
+"""
+
+import json
+import signal
+import sqlite3
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+import metrics
+from database import DatabaseManager
+from events import EventLog, default_directory
+from frame_source import acquire_source, source_from_settings
+from sync import OutboxSync, SyncError
+from roi import CameraZones
+from voting import voter_from_settings
+from warmup import WarmUp
+
+DEFAULT_HEALTH_PORT = 8081
+DEFAULT_SCALE = 0.5
+# A student seen again within this many seconds is not written again
+DEFAULT_COOLDOWN = 60
+DEFAULT_STALE_AFTER = 10
+
+
+class HeadlessDaemon:
+    def __init__(self, db=None, face_system=None, source=None, scale=DEFAULT_SCALE,
+                 cooldown=DEFAULT_COOLDOWN, stale_after=DEFAULT_STALE_AFTER, max_fps=None,
+                 sync_url=None, roi=None, entry_line=None, shards=None):
+        self.db = db if db is not None else DatabaseManager()
+        if face_system is None:
+            from face_recognition_system import FaceRecognitionSystem
+            face_system = FaceRecognitionSystem(self.db)
+        self.face_system = face_system
+        self.source = source
+        self.scale = scale
+        self.cooldown = cooldown
+        self.stale_after = stale_after
+        self.min_interval = 1.0 / max_fps if max_fps else 0
+        self.threshold = float(self.db.get_setting('recognition_threshold', '0.7'))
+        self.voter = voter_from_settings(self.db.get_setting, self.threshold)
+        self.zones = CameraZones.from_settings(self.db.get_setting, roi, entry_line)
+        self.face_system.bind_shards(shards if shards is not None else self.db.get_setting('camera_shards', ''))
+        self.outbox = OutboxSync(self.db.db_path, sync_url) if sync_url else None
+        self.event_log = EventLog(default_directory(self.db.db_path))
+        # Shards are already bound above
+        self.warmup = WarmUp(self.face_system, self.db, scale=scale)
+
+        self.stop_event = threading.Event()
+        self.camera = None
+        self.server = None
+        self.started_at = time.time()
+        self.last_frame_at = None
+        self.frames = 0
+        self.marked = 0
+        # (student_id, direction) -> time of the last attendance write
+        self.last_marked = {}
+        self.marked_day = date.today()
+
+    def health(self):
+        """(healthy, details) for the health endpoint"""
+        now = time.time()
+        age = now - self.last_frame_at if self.last_frame_at else None
+        handle = self.camera
+        camera = handle.health() if handle is not None else {}
+        if self.stop_event.is_set():
+            status = 'stopping'
+        elif not self.warmup.ready and age is None:
+            status = 'warming'
+        elif camera.get('state') == 'reconnecting':
+            # The capture supervisor is on it; restarting the daemon wouldn't help
+            status = 'reconnecting'
+        elif age is None:
+            # The camera gets stale_after seconds from the end of the warm-up
+            since = self.warmup.finished_at or self.started_at
+            status = 'starting' if now - since < self.stale_after else 'no_frames'
+        else:
+            status = 'ok' if age < self.stale_after else 'stale'
+
+        return status in ('ok', 'starting', 'warming', 'reconnecting'), {
+            'status': status,
+            'ready': status == 'ok' and self.warmup.ready,
+            'warmup': self.warmup.status(),
+            'uptime_s': round(now - self.started_at, 1),
+            'frames': self.frames,
+            'last_frame_age_s': round(age, 3) if age is not None else None,
+            'camera': camera,
+            'marked': self.marked,
+            'sync': self.outbox.status() if self.outbox else None,
+            'max_rss_kb': metrics.max_rss_kb()
+        }
+
+    def start_health_server(self, host, port):
+        daemon = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/healthz':
+                    healthy, details = daemon.health()
+                    self.reply(200 if healthy else 503, 'application/json', json.dumps(details))
+                elif self.path == '/readyz':
+                    _, details = daemon.health()
+                    self.reply(200 if details['ready'] else 503, 'application/json', json.dumps(details))
+                elif self.path == '/metrics':
+                    self.reply(200, metrics.CONTENT_TYPE, metrics.render_text())
+                else:
+                    self.reply(404, 'text/plain', 'not found\n')
+
+            def reply(self, status, content_type, body):
+                body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Health probes every few seconds would flood the journal
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), HealthHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Health check on http://{host}:{port}/healthz, metrics on /metrics")
+
+    def open_camera(self):
+        spec, options = source_from_settings(self.db.get_setting)
+        if self.source is not None:
+            spec = self.source
+        return acquire_source(spec, **options)
+
+    def mark(self, student_id, now, direction=None):
+        # New day: everyone can be marked in again, and the table starts empty
+        today = date.today()
+        if today != self.marked_day:
+            self.last_marked.clear()
+            self.marked_day = today
+
+        # An exit right after an entry is a separate event, not a repeat
+        key = (student_id, direction)
+        last = self.last_marked.get(key)
+        if last is not None and now - last < self.cooldown:
+            return False
+
+        self.db.mark_attendance(student_id, direction=direction)
+        self.last_marked[key] = now
+        self.marked += 1
+        metrics.ATTENDANCE_MARKED.inc()
+
+        if len(self.last_marked) > 1000:
+            expired = [key for key, seen in self.last_marked.items() if now - seen >= self.cooldown]
+            for key in expired:
+                del self.last_marked[key]
+        return True
+
+    def process(self, frame, captured_at):
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        regions, line = self.zones.for_size(frame.shape[1], frame.shape[0])
+        recognized_faces, face_locations = self.face_system.recognize_faces_in_frame(frame, regions, self.scale)
+
+        self.event_log.record_frame(captured_at, face_locations, recognized_faces)
+        now = time.time()
+        for face_info in self.voter.update(face_locations, recognized_faces, line=line):
+            self.event_log.record_commit(captured_at, face_info)
+            direction = face_info.get('direction')
+            if self.mark(face_info['student_id'], now, direction):
+                print(f"Attendance marked for: {face_info['name']}" + (f" ({direction})" if direction else ""))
+        metrics.CAPTURE_LATENCY.observe(time.time() - captured_at)
+
+    def request_stop(self, signum=None, frame=None):
+        if not self.stop_event.is_set():
+            print("Stopping headless daemon...")
+        self.stop_event.set()
+
+    def run(self, host='0.0.0.0', port=DEFAULT_HEALTH_PORT):
+        """Run until SIGTERM/SIGINT or the source ends; return an exit code"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.request_stop)
+            signal.signal(signal.SIGINT, self.request_stop)
+
+        if port:
+            self.start_health_server(host, port)
+
+        if self.outbox:
+            self.outbox.start(self.stop_event)
+
+        # Warms up while the camera opens
+        self.warmup.start()
+        self.camera = self.open_camera()
+        if not self.camera.isOpened():
+            print("Failed to open camera")
+            self.shutdown()
+            return 1
+        print(f"Camera opened: {self.camera.describe()}")
+        while not self.warmup.wait(timeout=1.0):
+            if self.stop_event.is_set():
+                self.shutdown()
+                return 0
+        if self.zones:
+            print(f"Searching {self.zones.area_fraction():.0%} of the frame"
+                  + (", entry line on" if self.zones.line else ""))
+        if self.face_system.shard_bindings:
+            print(f"Matching {len(self.face_system.gallery)} students of {', '.join(self.face_system.shard_bindings)}")
+
+        exit_code = 0
+        try:
+            while not self.stop_event.is_set():
+                ret, frame, captured_at = self.camera.read_with_timestamp(timeout=1.0, copy=False)
+                if not ret:
+                    if not self.camera.isOpened():
+                        # Recorded media ran out (live cameras are reconnected); let the service manager decide
+                        print("Camera stopped delivering frames")
+                        exit_code = 1
+                        break
+                    continue
+
+                self.frames += 1
+                self.last_frame_at = captured_at
+                started = time.time()
+                try:
+                    self.process(frame, captured_at)
+                except Exception as e:
+                    print(f"Recognition error: {e}")
+
+                if self.min_interval:
+                    self.stop_event.wait(max(0, self.min_interval - (time.time() - started)))
+        finally:
+            self.shutdown()
+        return exit_code
+
+    def shutdown(self):
+        """Release the camera, flush the WAL and stop the health server"""
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
+
+        try:
+            self.event_log.close()
+        except OSError as e:
+            print(f"Event log flush failed: {e}")
+        
+        # Last upload attempt; whatever doesn't make it stays in the outbox
+        if self.outbox:
+            self.outbox.timeout = 5
+            try:
+                self.outbox.sync_once()
+            except SyncError as e:
+                print(f"Final sync skipped: {e}")
+
+        # Attendance writes are committed as they happen; the checkpoint moves
+        # them into the main database file so nothing is left in the WAL
+        try:
+            conn = sqlite3.connect(self.db.db_path, timeout=30)
+            try:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"WAL checkpoint failed: {e}")
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        print(f"Headless daemon stopped after {self.frames} frames, {self.marked} attendance writes")
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Load test for the web API and MJPEG stream
+
+Drives the dashboard, report and settings endpoints and the camera
+stream at a configurable mix while the recognition loop runs on a
+synthetic camera, to find how many users the server sustains before
+recognition starves:
+
+    python -m loadtest --users 1,8,32 --stream-clients 2 --output flask.json
+    python -m loadtest --server async --users 1,8,32 --output async.json
+    python -m loadtest --url http://10.0.0.5:5000 --users 16
+
+Without --url a server (run_web_system, or async_web_system with
+--server async) is started in a child process, in a temporary directory
+with a synthetic gallery, today's attendance and the synthetic camera.
+A --url target keeps its own camera and data; its camera is started if
+it is not running.
+
+Each step runs --users closed-loop clients for --duration seconds. A
+client picks an endpoint by --mix weight, waits for the answer, sleeps
+--think seconds and repeats; /api/students is sent with the ETag of the
+previous answer, like a browser. Stream clients read the MJPEG stream
+for the whole step. The report has per-endpoint latency percentiles and
+errors, stream frame gaps, and the recognition frame rate of each step
+against an idle --baseline period, so runs against different servers or
+commits can be compared key by key.
+
+The load generator needs CPU too: on the server's own host the
+recognition frame rate drops more than it would with remote clients.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from bench import percentiles, write_report
+from datagen import load_attendance, load_students, student_id
+
+# name -> (method, path)
+ENDPOINTS = {
+    'stats': ('GET', '/api/stats'),
+    'students': ('GET', '/api/students'),
+    'today': ('GET', '/api/attendance/today'),
+    'settings': ('GET', '/api/settings'),
+    'settings_save': ('POST', '/api/settings'),
+    'camera_status': ('GET', '/api/camera/status')
+}
+# Endpoints answering with a list; an empty one is counted as an error once it is expected to have rows
+LIST_ENDPOINTS = ('students', 'today')
+# A dashboard polls stats and today's attendance; reports and settings are rarer
+DEFAULT_MIX = 'stats=4,today=4,students=2,camera_status=2,settings=1,settings_save=0.2'
+DEFAULT_USERS = '1,8,32'
+DEFAULT_DURATION = 30
+DEFAULT_BASELINE = 10
+DEFAULT_THINK = 1.0
+REQUEST_TIMEOUT = 10
+STARTUP_TIMEOUT = 120
+STREAM_BOUNDARY = b'--frame\r\n'
+# Share of the gallery already marked present today
+PRESENT_FRACTION = 0.25
+
+
+def parse_mix(value):
+    """'stats=4,today=2' -> {'stats': 4.0, 'today': 2.0}"""
+    mix = {}
+    for part in value.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight for {name}: {weight!r}")
+        if mix[name] < 0:
+            raise argparse.ArgumentTypeError(f"Negative weight for {name}")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("--mix needs at least one endpoint with a positive weight")
+    return mix
+
+
+def parse_levels(value):
+    """'1,8,32' -> [1, 8, 32]"""
+    try:
+        levels = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected comma-separated user counts, got {value!r}")
+    if not levels or any(level < 0 for level in levels):
+        raise argparse.ArgumentTypeError(f"Expected comma-separated user counts, got {value!r}")
+    return levels
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(port, server='flask', gallery_size=100, seed=0, history_days=0):
+    """Child process: seed a database in the current directory and serve the web app"""
+    os.environ.setdefault('ATTENDANCE_CAMERA_SOURCE', 'synthetic')
+    import run_web_system as web
+    load_students(web.db.db_path, gallery_size, seed)
+    if history_days:
+        load_attendance(web.db.db_path, history_days, seed)
+    web.face_system.refresh_gallery(force=True)
+
+    now = datetime.now()
+    present = [(student_id(i), now.strftime('%H:%M:%S'), None) for i in range(int(gallery_size * PRESENT_FRACTION))]
+    if present:
+        web.db.mark_attendance_bulk(now.date().isoformat(), present)
+
+    if server == 'async':
+        import async_web_system
+        async_web_system.serve(host='127.0.0.1', port=port)
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, web.app, threaded=True).serve_forever()
+
+
+class Target:
+    """Where requests go: host, port and a helper for one-off JSON calls"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.url = url.rstrip('/')
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+
+    def connection(self, timeout=REQUEST_TIMEOUT):
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def call(self, method, path, body=None, timeout=REQUEST_TIMEOUT):
+        conn = self.connection(timeout)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read() or b'null')
+        finally:
+            conn.close()
+
+    def frames(self):
+        """Frames the recognition loop has read so far"""
+        return self.call('GET', '/api/camera/status')[1]['frames']
+
+    def wait_ready(self, timeout=STARTUP_TIMEOUT, process=None):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if self.call('GET', '/api/stats', timeout=2)[0] == 200:
+                    return
+            except (OSError, http.client.HTTPException, ValueError):
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"Server at {self.url} did not answer within {timeout}s")
+
+    def start_camera(self):
+        """Start recognition unless it is running; wait for the first frames"""
+        if not self.call('GET', '/api/camera/status')[1].get('active'):
+            status, reply = self.call('POST', '/api/camera/start?wait=30')
+            if status != 200 or not reply.get('success'):
+                raise RuntimeError(f"Could not start the camera: {reply}")
+        start = self.frames()
+        deadline = time.monotonic() + 30
+        while self.frames() <= start:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Recognition loop is not reading frames")
+            time.sleep(0.2)
+
+
+class ApiClient(threading.Thread):
+    """Closed-loop user: request, wait for the answer, think, repeat"""
+
+    def __init__(self, target, mix, think, deadline, seed, settings_body, expect_rows=()):
+        super().__init__(daemon=True)
+        self.target = target
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.think = think
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.settings_body = json.dumps(settings_body)
+        self.expect_rows = set(expect_rows)
+        self.etag = None
+        # name -> latencies in seconds, name -> {error kind: count}
+        self.latencies = {name: [] for name in self.names}
+        self.errors = {name: {} for name in self.names}
+
+    def run(self):
+        conn = self.target.connection()
+        # Spread the first requests over one think time
+        time.sleep(self.random.uniform(0, self.think))
+        while time.monotonic() < self.deadline:
+            name = self.random.choices(self.names, self.weights)[0]
+            started = time.perf_counter()
+            error = self.request(conn, name)
+            elapsed = time.perf_counter() - started
+            if error:
+                self.errors[name][error] = self.errors[name].get(error, 0) + 1
+                conn.close()
+            else:
+                self.latencies[name].append(elapsed)
+            if self.think:
+                time.sleep(self.random.uniform(0.5, 1.5) * self.think)
+        conn.close()
+
+    def request(self, conn, name):
+        """Send one request on conn; return an error kind or None"""
+        method, path = ENDPOINTS[name]
+        headers, body = {}, None
+        if name == 'students' and self.etag:
+            headers['If-None-Match'] = self.etag
+        if method == 'POST':
+            headers['Content-Type'] = 'application/json'
+            body = self.settings_body
+        try:
+            # http.client reconnects by itself once the server closed the connection
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except socket.timeout:
+            return 'timeout'
+        except (OSError, http.client.HTTPException):
+            return 'connection'
+
+        if response.status == 304:
+            return None
+        if response.status >= 400:
+            return f'http_{response.status}'
+        if name == 'students':
+            self.etag = response.getheader('ETag')
+        # Handlers that swallow an exception still answer 200; judge the body too
+        try:
+            reply = json.loads(payload)
+        except ValueError:
+            return 'bad_json'
+        if isinstance(reply, dict) and reply.get('success') is False:
+            return 'failed'
+        if method == 'POST' and not (isinstance(reply, dict) and reply.get('success')):
+            return 'failed'
+        if name in self.expect_rows and reply == []:
+            return 'empty'
+        return None
+
+
+class StreamClient(threading.Thread):
+    """Reads /api/camera/stream until the deadline, timing frame arrivals"""
+
+    def __init__(self, target, deadline):
+        super().__init__(daemon=True)
+        self.target = target
+        self.deadline = deadline
+        self.first_frame = None
+        self.gaps = []
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        conn = self.target.connection()
+        started = time.perf_counter()
+        try:
+            conn.request('GET', '/api/camera/stream')
+            response = conn.getresponse()
+            if response.status != 200:
+                self.error = f'http_{response.status}'
+                return
+            tail = b''
+            last = None
+            while time.monotonic() < self.deadline:
+                chunk = response.read1(65536)
+                if not chunk:
+                    self.error = 'closed'
+                    break
+                self.bytes += len(chunk)
+                now = time.perf_counter()
+                # A boundary can be split across reads; keep the last few bytes
+                data = tail + chunk
+                found = data.count(STREAM_BOUNDARY)
+                tail = data[-(len(STREAM_BOUNDARY) - 1):]
+                for _ in range(found):
+                    if last is None:
+                        self.first_frame = now - started
+                    else:
+                        self.gaps.append(now - last)
+                    last = now
+                    self.frames += 1
+        except socket.timeout:
+            self.error = 'timeout'
+        except (OSError, http.client.HTTPException):
+            self.error = 'connection'
+        finally:
+            conn.close()
+
+
+class LoadTest:
+    def __init__(self, target, mix, think=DEFAULT_THINK, stream_clients=2, seed=0, expect_rows=()):
+        """expect_rows names list endpoints that must not answer []; those
+        already returning rows when the test starts are added.
+        """
+        self.target = target
+        self.mix = {name: weight for name, weight in mix.items() if weight > 0}
+        self.think = think
+        self.stream_clients = stream_clients
+        self.seed = seed
+        # Saving the threshold the server already has writes the setting without changing anything
+        threshold = target.call('GET', '/api/settings')[1].get('recognition_threshold', 0.7)
+        self.settings_body = {'recognition': {'threshold': threshold}}
+        self.expect_rows = set(expect_rows)
+        for name in LIST_ENDPOINTS:
+            status, reply = target.call(*ENDPOINTS[name])
+            if status == 200 and isinstance(reply, list) and reply:
+                self.expect_rows.add(name)
+
+    def baseline(self, seconds):
+        """Recognition frame rate with no clients"""
+        start, began = self.target.frames(), time.monotonic()
+        time.sleep(seconds)
+        elapsed = time.monotonic() - began
+        frames = self.target.frames() - start
+        return {'seconds': round(elapsed, 1), 'frames': frames, 'recognition_fps': round(frames / elapsed, 2)}
+
+    def step(self, users, seconds, baseline_fps=None):
+        """Run users API clients and the stream clients for seconds; return the step report"""
+        deadline = time.monotonic() + seconds
+        clients = [ApiClient(self.target, self.mix, self.think, deadline, self.seed * 1000 + i, self.settings_body,
+                             self.expect_rows)
+                   for i in range(users)]
+        streams = [StreamClient(self.target, deadline) for _ in range(self.stream_clients)]
+
+        start, began = self.target.frames(), time.monotonic()
+        for thread in clients + streams:
+            thread.start()
+        for thread in clients + streams:
+            thread.join(timeout=seconds + REQUEST_TIMEOUT + 5)
+        elapsed = time.monotonic() - began
+        fps = (self.target.frames() - start) / elapsed
+
+        endpoints = {}
+        requests = errors = 0
+        for name in self.mix:
+            latencies = [s for client in clients for s in client.latencies[name]]
+            kinds = {}
+            for client in clients:
+                for kind, count in client.errors[name].items():
+                    kinds[kind] = kinds.get(kind, 0) + count
+            failed = sum(kinds.values())
+            endpoints[name] = {**percentiles(latencies), 'errors': kinds,
+                               'error_rate': round(failed / (len(latencies) + failed), 4) if latencies or failed else 0}
+            requests += len(latencies) + failed
+            errors += failed
+
+        gaps = [gap for stream in streams for gap in stream.gaps]
+        stream_errors = {}
+        for stream in streams:
+            if stream.error:
+                stream_errors[stream.error] = stream_errors.get(stream.error, 0) + 1
+
+        return {
+            'users': users,
+            'stream_clients': len(streams),
+            'seconds': round(elapsed, 1),
+            'requests': requests,
+            'requests_per_s': round(requests / elapsed, 2),
+            'errors': errors,
+            'error_rate': round(errors / requests, 4) if requests else 0,
+            'endpoints': endpoints,
+            'stream': {
+                'frames': sum(stream.frames for stream in streams),
+                'fps_per_client': round(sum(stream.frames for stream in streams) / len(streams) / elapsed, 2)
+                if streams else None,
+                'mb_received': round(sum(stream.bytes for stream in streams) / 1e6, 1),
+                'first_frame': percentiles([s.first_frame for s in streams if s.first_frame is not None]),
+                'frame_gap': percentiles(gaps),
+                'errors': stream_errors
+            },
+            'recognition_fps': round(fps, 2),
+            'fps_degradation': round(1 - fps / baseline_fps, 4) if baseline_fps else None
+        }
+
+
+def run(args):
+    workdir = process = None
+    if args.url:
+        target = Target(args.url)
+    else:
+        port = free_port()
+        workdir = tempfile.mkdtemp(prefix="attendance_loadtest_")
+        env = dict(os.environ, ATTENDANCE_CAMERA_SOURCE=os.environ.get('ATTENDANCE_CAMERA_SOURCE', 'synthetic'))
+        here = os.path.dirname(os.path.abspath(__file__))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [here, env.get('PYTHONPATH')]))
+        log = open(os.path.join(workdir, 'server.log'), 'w')
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'loadtest', '--serve', str(port), '--server', args.server,
+             '--gallery-size', str(args.gallery_size), '--seed', str(args.seed),
+             '--history-days', str(args.history_days)],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        target = Target(f'http://127.0.0.1:{port}')
+
+    try:
+        try:
+            target.wait_ready(process=process)
+        except RuntimeError:
+            if workdir:
+                with open(os.path.join(workdir, 'server.log')) as f:
+                    print(f.read()[-2000:], file=sys.stderr)
+            raise
+        target.start_camera()
+
+        # A started server has its gallery and today's attendance seeded by serve()
+        seeded = LIST_ENDPOINTS if process and int(args.gallery_size * PRESENT_FRACTION) else ()
+        test = LoadTest(target, args.mix, args.think, args.stream_clients, args.seed, seeded)
+        print(f"Load testing {target.url} ({args.server if process else 'external'} server)")
+        baseline = test.baseline(args.baseline) if args.baseline else None
+        if baseline:
+            print(f"Baseline: {baseline['recognition_fps']} fps")
+
+        steps = []
+        for users in args.users:
+            result = test.step(users, args.duration, baseline['recognition_fps'] if baseline else None)
+            steps.append(result)
+            print(f"{users} users: {result['requests_per_s']} req/s, {result['error_rate']:.1%} errors, "
+                  f"{result['recognition_fps']} fps")
+
+        return {
+            'target': target.url,
+            'server': args.server if process else 'external',
+            'gallery_size': args.gallery_size if process else None,
+            'history_days': args.history_days if process else None,
+            'mix': test.mix,
+            'think_s': args.think,
+            'duration_s': args.duration,
+            'host': {'platform': platform.platform(), 'cpus': os.cpu_count(), 'python': platform.python_version()},
+            'baseline': baseline,
+            'steps': steps
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+            log.close()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the web API and camera stream")
+    parser.add_argument('--url', help="server to test (default: start one with a synthetic camera)")
+    parser.add_argument('--server', choices=('flask', 'async'), default='flask', help="server to start without --url")
+    parser.add_argument('--users', type=parse_levels, default=DEFAULT_USERS,
+                        help="API clients per step, comma-separated (e.g. 1,8,32)")
+    parser.add_argument('--stream-clients', type=int, default=2, help="MJPEG stream clients during each step")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f"endpoint weights, name=weight,... from: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--think', type=float, default=DEFAULT_THINK, help="mean seconds a client waits between requests")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help="seconds per step")
+    parser.add_argument('--baseline', type=float, default=DEFAULT_BASELINE,
+                        help="seconds of idle recognition measured first (0 to skip)")
+    parser.add_argument('--gallery-size', type=int, default=100, help="synthetic students in the started server")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the gallery and the request mix")
+    parser.add_argument('--history-days', type=int, default=0,
+                        help="class days of synthetic attendance in the started server (see datagen.py)")
+    parser.add_argument('--output', help="write the JSON report to this file instead of stdout")
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve(args.serve, args.server, args.gallery_size, args.seed, args.history_days)
+        return 0
+    try:
+        report = run(args)
+    except RuntimeError as e:
+        print(f"Load test failed: {e}", file=sys.stderr)
+        return 1
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,21 +9,58 @@ Features:
 - Attendance tracking
 - Report generation
 - Professional GUI interface
+- Headless daemon for kiosk/door units (python main.py --headless)
 
 Author: AI Assistant
 Version: 1.0
 """
 
+import argparse
 import sys
 import os
-from gui_application import AttendanceSystemGUI
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI-Powered Smart Attendance System")
+    parser.add_argument('--headless', action='store_true', help="run recognition without a display (kiosk/door units)")
+    parser.add_argument('--source', help="camera index, video file, image folder, stream URL or 'synthetic' (default: settings)")
+    parser.add_argument('--host', default='0.0.0.0', help="health/metrics listen address (headless)")
+    parser.add_argument('--port', type=int, default=8081, help="health/metrics port, 0 to disable (headless)")
+    parser.add_argument('--scale', type=float, default=0.5, help="resize factor applied before recognition (headless)")
+    parser.add_argument('--cooldown', type=float, default=60, help="seconds before the same student is written again (headless)")
+    parser.add_argument('--sync-url', default=os.environ.get('ATTENDANCE_SYNC_URL'),
+                        help="central server to forward attendance to (headless)")
+    parser.add_argument('--roi', default=None, help="detection regions x,y,w,h[;...] as frame fractions (headless, default: settings)")
+    parser.add_argument('--entry-line', default=None, help="entry line x1,y1,x2,y2 as frame fractions (headless, default: settings)")
+    parser.add_argument('--shards', default=None, help="departments to match, comma-separated, 'Site/*' for a prefix (headless, default: settings)")
+    parser.add_argument('--max-fps', type=float, default=None, help="cap recognition rate to save CPU (headless)")
+    parser.add_argument('--stale-after', type=float, default=10,
+                        help="seconds without frames before /healthz reports unhealthy (headless)")
+    return parser.parse_args(argv)
+
+def run_headless(args):
+    """Run the recognition daemon until SIGTERM"""
+    from headless import HeadlessDaemon
+    
+    print("Starting attendance recognition daemon (headless)...")
+    daemon = HeadlessDaemon(source=args.source, scale=args.scale, cooldown=args.cooldown, max_fps=args.max_fps,
+                            stale_after=args.stale_after, sync_url=args.sync_url, roi=args.roi,
+                            entry_line=args.entry_line, shards=args.shards)
+    sys.exit(daemon.run(host=args.host, port=args.port))
 
 def main():
     """Main function to start the application"""
+    args = parse_args()
+    if args.headless:
+        run_headless(args)
+        return
+    
     try:
         print("Starting AI-Powered Smart Attendance System...")
         print("Initializing components...")
         
+        # Tkinter is only needed for the GUI, not on headless units
+        from gui_application import AttendanceSystemGUI
+        
         # Create and run the GUI application
         app = AttendanceSystemGUI()
         print("System ready! Opening GUI...")
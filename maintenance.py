@@ -0,0 +1,241 @@
+"""
+Database maintenance: statistics, space reclamation and history archival
+
+- optimize(): ANALYZE / PRAGMA optimize, incremental vacuum and a WAL
+  checkpoint, so the query planner has fresh statistics and freed pages
+  go back to the filesystem
+- archive_attendance(): moves attendance from old terms into one archive
+  database per term (archives/attendance_2024_T2.db, ...), so the live
+  table only holds recent terms
+- connect_for_range(): opens the live database with the archives that
+  overlap a date range ATTACHed, exposing one `attendance_range` view for
+  historical reports
+
+Terms are half-years by default (January and July starts); change
+TERM_START_MONTHS to match the academic calendar.
+"""
+
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+
+TERM_START_MONTHS = (1, 7)
+ARCHIVE_BATCH_SIZE = 10000
+# SQLite allows 10 attached databases by default; keep one spare
+MAX_ATTACHED_ARCHIVES = 9
+
+ATTENDANCE_COLUMNS = ('id', 'student_id', 'date', 'time_in', 'time_out', 'status', 'created_at')
+
+ARCHIVE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER PRIMARY KEY,
+        student_id TEXT NOT NULL,
+        date DATE NOT NULL,
+        time_in TIME,
+        time_out TIME,
+        status TEXT,
+        created_at TIMESTAMP
+    )
+'''
+
+
+def term_of(day):
+    """Return (label, start_date, end_date_exclusive) of the term containing day"""
+    if isinstance(day, str):
+        day = datetime.strptime(day[:10], '%Y-%m-%d').date()
+
+    starts = sorted(TERM_START_MONTHS)
+    started = [i for i, month in enumerate(starts) if month <= day.month]
+    if started:
+        index, year = started[-1], day.year
+    else:
+        # Before the first term start of the year: last term of previous year
+        index, year = len(starts) - 1, day.year - 1
+
+    start = date(year, starts[index], 1)
+    if index + 1 < len(starts):
+        end = date(year, starts[index + 1], 1)
+    else:
+        end = date(year + 1, starts[0], 1)
+    return f"{year}_T{index + 1}", start, end
+
+
+def previous_term_start(term_start):
+    """Start date of the term before the one starting at term_start"""
+    return term_of(date.fromordinal(term_start.toordinal() - 1))[1]
+
+
+class MaintenanceManager:
+    def __init__(self, db_path="attendance_system.db", archive_dir=None):
+        self.db_path = db_path
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "archives")
+
+    def optimize(self, vacuum_pages=0):
+        """Refresh planner statistics and release free pages
+
+        vacuum_pages=0 releases every free page.
+        """
+        start = time.perf_counter()
+        size_before = os.path.getsize(self.db_path)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.cursor()
+            analyzed = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+            if analyzed:
+                cursor.execute('PRAGMA optimize')
+            else:
+                cursor.execute('ANALYZE')
+
+            auto_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+            free_before = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            if auto_vacuum == 2:
+                # executescript steps the pragma to completion; execute() would free one page
+                conn.executescript(f'PRAGMA incremental_vacuum({int(vacuum_pages)});')
+            elif free_before:
+                # Databases created before incremental mode need one full
+                # VACUUM to switch; after that only incremental passes run
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+            free_after = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            conn.commit()
+
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+
+        return {
+            'size_before': size_before,
+            'size_after': os.path.getsize(self.db_path),
+            'pages_freed': free_before - free_after,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+
+    def archive_path(self, term_label):
+        return os.path.join(self.archive_dir, f"attendance_{term_label}.db")
+
+    def archive_attendance(self, keep_terms=2, today=None):
+        """Move attendance older than the last keep_terms terms into per-term archives
+
+        Rows keep their ids and are copied with INSERT OR IGNORE before being
+        deleted in small batches, so an interrupted run can simply be repeated
+        and writers are never locked out for long.
+        """
+        start = time.perf_counter()
+        keep_terms = max(1, int(keep_terms))
+        _, cutoff, _ = term_of(today or date.today())
+        for _ in range(keep_terms - 1):
+            cutoff = previous_term_start(cutoff)
+        cutoff = cutoff.isoformat()
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        moved = {}
+        try:
+            oldest = conn.execute('SELECT MIN(date) FROM attendance WHERE date < ?', (cutoff,)).fetchone()[0]
+            if oldest is None:
+                return {'removed': 0, 'terms': {}, 'cutoff': cutoff, 'seconds': 0}
+
+            os.makedirs(self.archive_dir, exist_ok=True)
+            label, term_start, term_end = term_of(oldest)
+            while term_start.isoformat() < cutoff:
+                count = self._archive_term(conn, label, term_start.isoformat(), term_end.isoformat())
+                if count:
+                    moved[label] = count
+                label, term_start, term_end = term_of(term_end)
+        finally:
+            conn.close()
+
+        return {
+            'removed': sum(moved.values()),
+            'terms': moved,
+            'cutoff': cutoff,
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+
+    def _archive_term(self, conn, label, date_from, date_to):
+        path = self.archive_path(label)
+        archive = sqlite3.connect(path)
+        archive.execute(ARCHIVE_SCHEMA)
+        archive.execute('CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance (date, student_id)')
+        archive.commit()
+        archive.close()
+
+        columns = ', '.join(ATTENDANCE_COLUMNS)
+        conn.execute('ATTACH DATABASE ? AS archive', (path,))
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)')
+        total = 0
+        try:
+            while True:
+                with conn:
+                    conn.execute('DELETE FROM temp.archive_batch')
+                    count = conn.execute('''
+                        INSERT INTO temp.archive_batch (id)
+                        SELECT id FROM main.attendance
+                        WHERE date >= ? AND date < ?
+                        LIMIT ?
+                    ''', (date_from, date_to, ARCHIVE_BATCH_SIZE)).rowcount
+                    if count <= 0:
+                        break
+
+                    conn.execute(f'''
+                        INSERT OR IGNORE INTO archive.attendance ({columns})
+                        SELECT {columns} FROM main.attendance
+                        WHERE id IN (SELECT id FROM temp.archive_batch)
+                    ''')
+                    conn.execute('''
+                        DELETE FROM main.attendance
+                        WHERE id IN (SELECT id FROM temp.archive_batch)
+                    ''')
+                total += count
+        finally:
+            conn.execute('DETACH DATABASE archive')
+        return total
+
+    def list_archives(self):
+        """Return (term_label, path) for every archive file, oldest first"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        archives = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            if name.startswith('attendance_') and name.endswith('.db'):
+                archives.append((name[len('attendance_'):-len('.db')], os.path.join(self.archive_dir, name)))
+        return archives
+
+    def overlapping_archives(self, date_from, date_to):
+        """Return (term_label, path) of archives holding dates in [date_from, date_to]"""
+        date_from, date_to = str(date_from), str(date_to)
+        overlapping = []
+        for label, path in self.list_archives():
+            _, term_start, term_end = term_of(label_start(label))
+            if term_start.isoformat() <= date_to and term_end.isoformat() > date_from:
+                overlapping.append((label, path))
+        return overlapping
+
+    def connect_for_range(self, date_from, date_to):
+        """Open the live DB with overlapping archives attached
+
+        The returned connection has a temporary view `attendance_range`
+        containing attendance rows from the live table and every archive
+        that overlaps [date_from, date_to].
+        """
+        overlapping = self.overlapping_archives(date_from, date_to)
+        if len(overlapping) > MAX_ATTACHED_ARCHIVES:
+            raise ValueError(f"Date range spans {len(overlapping)} archived terms; at most {MAX_ATTACHED_ARCHIVES} can be queried at once")
+
+        conn = sqlite3.connect(self.db_path)
+        sources = ['SELECT {cols} FROM main.attendance']
+        for label, path in overlapping:
+            alias = f"term_{label}"
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+            sources.append(f'SELECT {{cols}} FROM {alias}.attendance')
+
+        columns = ', '.join(ATTENDANCE_COLUMNS)
+        union = ' UNION ALL '.join(source.format(cols=columns) for source in sources)
+        conn.execute(f'CREATE TEMP VIEW attendance_range AS {union}')
+        return conn
+
+
+def label_start(label):
+    """First day of the term with the given label (e.g. '2024_T2')"""
+    year, term = label.split('_T')
+    return date(int(year), sorted(TERM_START_MONTHS)[int(term) - 1], 1)
@@ -0,0 +1,373 @@
+"""
+Lightweight metrics for the attendance system
+
+Counters, gauges and histograms that can be updated from the recognition
+loop, stream generators and request handlers without taking a shared
+lock: every thread writes into its own shard and shards are only summed
+when the metrics are collected. Exported in the Prometheus text
+exposition format by render_text(), or as a dict by snapshot().
+
+Usage:
+    FRAMES = counter('frames_processed_total', 'Frames run through recognition')
+    FRAMES.inc()
+
+    STAGE = histogram('recognition_stage_seconds', 'Time per stage', ('stage',))
+    with STAGE.labels('detect').time():
+        ...
+"""
+
+import bisect
+import functools
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Buckets (seconds) suited to per-frame work: 0.5 ms .. 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Sharded:
+    """Per-thread storage, merged on collection"""
+
+    # Past this many shards, those of finished threads are folded together
+    MAX_LIVE_SHARDS = 32
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = self._new_shard()
+        self._shards_lock = threading.Lock()
+
+    def _new_shard(self):
+        raise NotImplementedError
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._new_shard()
+            self._local.shard = shard
+            # Only taken once per thread
+            with self._shards_lock:
+                if len(self._shards) >= self.MAX_LIVE_SHARDS:
+                    self._retire_dead_shards()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _retire_dead_shards(self):
+        """Merge shards of exited threads (e.g. request threads) into one"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for i, value in enumerate(shard):
+                    self._retired[i] += value
+        self._shards = alive
+
+    def _merged(self):
+        """Element-wise sum of every shard"""
+        with self._shards_lock:
+            self._retire_dead_shards()
+            total = list(self._retired)
+            for _, shard in self._shards:
+                for i, value in enumerate(shard):
+                    total[i] += value
+        return total
+
+
+class Timer:
+    """Context manager and decorator that observes elapsed seconds"""
+
+    def __init__(self, metric):
+        self.metric = metric
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metric.observe(time.perf_counter() - self.start)
+        return False
+
+    def __call__(self, func):
+        metric = self.metric
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start)
+        return wrapper
+
+
+class CounterChild(_Sharded):
+    def _new_shard(self):
+        return [0.0]
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def value(self):
+        return self._merged()[0]
+
+
+class GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def value(self):
+        return self._value
+
+
+class HistogramChild(_Sharded):
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        super().__init__()
+
+    def _new_shard(self):
+        # One slot per bucket plus +Inf, then sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def time(self):
+        return Timer(self)
+
+    def value(self):
+        """Return (cumulative bucket counts, count, sum)"""
+        merged = self._merged()
+        counts = merged[:-1]
+        total = merged[-1]
+
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, total
+
+    def quantile(self, q):
+        """Estimate a quantile from the buckets (upper bound of the bucket)"""
+        cumulative, count, _ = self.value()
+        if count == 0:
+            return None
+        rank = q * count
+        for i, seen in enumerate(cumulative[:-1]):
+            if seen >= rank:
+                return self.buckets[i]
+        return float('inf')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metric:
+    """A named metric family, optionally split by label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), **kwargs):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.kwargs = kwargs
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._new_child()
+                    self._children[values] = child
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+    def _label_text(self, values, extra=None):
+        pairs = list(zip(self.labelnames, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def render(self):
+        for values, child in self.children():
+            yield f"{self.name}{self._label_text(values)} {child.value()}"
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def render(self):
+        for values, child in self.children():
+            yield f"{self.name}{self._label_text(values)} {child.value()}"
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def _new_child(self):
+        return HistogramChild(self.kwargs.get('buckets', DEFAULT_BUCKETS))
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def render(self):
+        for values, child in self.children():
+            cumulative, count, total = child.value()
+            for bound, seen in zip(child.buckets, cumulative):
+                yield f"{self.name}_bucket{self._label_text(values, ('le', bound))} {seen}"
+            yield f"{self.name}_bucket{self._label_text(values, ('le', '+Inf'))} {count}"
+            yield f"{self.name}_count{self._label_text(values)} {count}"
+            yield f"{self.name}_sum{self._label_text(values)} {total}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render_text(self):
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Summarize all metrics as plain values for JSON APIs"""
+        result = {}
+        for metric in self.metrics():
+            for values, child in metric.children():
+                key = metric.name
+                if values:
+                    key += '{' + ','.join(f"{k}={v}" for k, v in zip(metric.labelnames, values)) + '}'
+                if metric.kind == 'histogram':
+                    _, count, total = child.value()
+                    p50 = child.quantile(0.5)
+                    p95 = child.quantile(0.95)
+                    result[key] = {
+                        'count': count,
+                        'avg_ms': round(total / count * 1000, 3) if count else 0,
+                        'p50_ms': p50 * 1000 if p50 is not None else None,
+                        'p95_ms': p95 * 1000 if p95 is not None else None
+                    }
+                else:
+                    result[key] = child.value()
+        return result
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=()):
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+
+def render_text():
+    return REGISTRY.render_text()
+
+
+def snapshot():
+    return REGISTRY.snapshot()
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Recognition loop metrics, shared by the web server and the headless daemon
+ATTENDANCE_MARKED = counter('attendance_marked_total', 'Attendance writes from the recognition loop')
+CAPTURE_LATENCY = histogram(
+    'attendance_capture_to_decision_seconds', 'Time from frame capture to the recognition decision for it')
+
+
+def max_rss_kb():
+    """Peak resident set size of this process in KB, if available"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
@@ -0,0 +1,110 @@
+"""
+Built-in sampling profiler
+
+Samples the stacks of every thread in the process (recognition loop,
+stream generators, request handlers) at a fixed interval using
+sys._current_frames(). Nothing runs between profiles, so it costs
+nothing while idle.
+
+Output is in collapsed-stack format ("thread;outer;inner count" per line)
+which flamegraph.pl and speedscope read directly, plus a table of the
+functions with the most samples.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_SECONDS = 60
+DEFAULT_INTERVAL = 0.005
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.samples = 0
+        self.duration = 0
+
+    def sample(self, skip_thread_id):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread_id:
+                continue
+
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if not stack:
+                continue
+            stack.reverse()
+
+            thread_name = names.get(thread_id, str(thread_id)).replace(';', ':')
+            self.stacks[thread_name + ';' + ';'.join(stack)] += 1
+            self.self_counts[stack[-1]] += 1
+            # Count recursive functions once per sample
+            for label in set(stack):
+                self.total_counts[label] += 1
+
+        self.samples += 1
+
+    def run(self, seconds):
+        """Sample all other threads for the given number of seconds"""
+        own_id = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_sample = start
+
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_sample:
+                time.sleep(next_sample - now)
+            self.sample(own_id)
+            next_sample += self.interval
+
+        self.duration = time.perf_counter() - start
+        return self
+
+    def collapsed(self):
+        """Collapsed stacks, one "frame;frame;frame count" per line"""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=25):
+        total = sum(self.self_counts.values()) or 1
+        rows = []
+        for label, count in self.total_counts.most_common(limit):
+            own = self.self_counts.get(label, 0)
+            rows.append({
+                'function': label,
+                'self_samples': own,
+                'total_samples': count,
+                'self_percent': round(own * 100.0 / total, 2),
+                'total_percent': round(count * 100.0 / total, 2)
+            })
+        return rows
+
+
+def profile(seconds, interval=DEFAULT_INTERVAL):
+    """Run one profile; returns None if another profile is already running"""
+    seconds = max(0.1, min(float(seconds), MAX_SECONDS))
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        return SamplingProfiler(interval).run(seconds)
+    finally:
+        _profile_lock.release()
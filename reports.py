@@ -0,0 +1,399 @@
+"""
+Attendance reports over date ranges
+
+Two rollup tables are kept in step with attendance by triggers:
+- attendance_monthly_totals: present days per student per month
+- attendance_daily_totals: rows recorded and present per day per department
+
+A report reads whole months from the monthly rollup and only scans raw
+attendance for the partial months at either end of the range. The per-day
+chart and the number of class days come from the daily rollup. A semester report
+therefore reads a few rows per student instead of one per attendance mark.
+
+A class day is any day in the range with attendance recorded. A student's
+percentage is present days / class days, and every status except
+'Absent' counts as present.
+
+Ranges that reach into archived terms (see maintenance.py) are computed
+from the raw rows of the live table and the attached archives.
+
+Results, and their encoded JSON, are kept in a small LRU cache tagged
+with the attendance and students change counters (data_versions table,
+bumped by triggers). Attendance inserts, deletes, archival and changes
+to student_id, date or status invalidate it, as do enrolments, renames,
+deletions and department moves; time_out updates from repeat
+recognitions do not.
+"""
+
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import metrics
+from maintenance import term_of
+
+REPORT_CACHE_SIZE = 64
+LOW_ATTENDANCE_THRESHOLD = 75.0
+# Partial-month edges shorter than this are read through the date index
+SHORT_EDGE_DAYS = 7
+
+REPORT_SECONDS = metrics.histogram('attendance_report_seconds', 'Time to build a report on a cache miss', ('kind',))
+REPORT_CACHE = metrics.counter('attendance_report_cache_total', 'Report cache lookups', ('result',))
+
+PRESENT = "status IS NOT 'Absent'"
+STUDENT_DEPARTMENT = "COALESCE((SELECT department FROM students WHERE student_id = {row}.student_id), '')"
+
+
+def _add_totals(row):
+    return f'''
+        INSERT INTO attendance_monthly_totals (student_id, month, present)
+        VALUES ({row}.student_id, substr({row}.date, 1, 7), {row}.{PRESENT})
+        ON CONFLICT (student_id, month) DO UPDATE SET present = present + excluded.present;
+        INSERT INTO attendance_daily_totals (date, department, recorded, present)
+        VALUES ({row}.date, {STUDENT_DEPARTMENT.format(row=row)}, 1, {row}.{PRESENT})
+        ON CONFLICT (date, department) DO UPDATE SET
+            recorded = recorded + 1, present = present + excluded.present;
+    '''
+
+
+def _remove_totals(row):
+    return f'''
+        UPDATE attendance_monthly_totals SET present = present - ({row}.{PRESENT})
+        WHERE student_id = {row}.student_id AND month = substr({row}.date, 1, 7);
+        UPDATE attendance_daily_totals SET recorded = recorded - 1, present = present - ({row}.{PRESENT})
+        WHERE date = {row}.date AND department = {STUDENT_DEPARTMENT.format(row=row)};
+    '''
+
+
+REPORT_SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS attendance_monthly_totals (
+        student_id TEXT NOT NULL,
+        month TEXT NOT NULL,
+        present INTEGER NOT NULL,
+        PRIMARY KEY (student_id, month)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS attendance_daily_totals (
+        date TEXT NOT NULL,
+        department TEXT NOT NULL,
+        recorded INTEGER NOT NULL,
+        present INTEGER NOT NULL,
+        PRIMARY KEY (date, department)
+    ) WITHOUT ROWID;
+
+    CREATE TRIGGER IF NOT EXISTS report_totals_insert AFTER INSERT ON attendance
+    BEGIN {_add_totals('NEW')} END;
+
+    CREATE TRIGGER IF NOT EXISTS report_totals_delete AFTER DELETE ON attendance
+    BEGIN {_remove_totals('OLD')} END;
+
+    CREATE TRIGGER IF NOT EXISTS report_totals_update AFTER UPDATE OF student_id, date, status ON attendance
+    BEGIN {_remove_totals('OLD')} {_add_totals('NEW')} END;
+
+    -- Move a student's days to the new department in the daily rollup
+    CREATE TRIGGER IF NOT EXISTS report_totals_department AFTER UPDATE OF department ON students
+    WHEN COALESCE(OLD.department, '') != COALESCE(NEW.department, '')
+    BEGIN
+        UPDATE attendance_daily_totals SET
+            recorded = recorded - (SELECT COUNT(*) FROM attendance a
+                                   WHERE a.student_id = NEW.student_id AND a.date = attendance_daily_totals.date),
+            present = present - (SELECT COUNT(*) FROM attendance a
+                                 WHERE a.student_id = NEW.student_id AND a.date = attendance_daily_totals.date
+                                 AND a.{PRESENT})
+        WHERE department = COALESCE(OLD.department, '')
+          AND date IN (SELECT date FROM attendance WHERE student_id = NEW.student_id);
+        INSERT INTO attendance_daily_totals (date, department, recorded, present)
+        SELECT date, COALESCE(NEW.department, ''), COUNT(*), SUM({PRESENT})
+        FROM attendance WHERE student_id = NEW.student_id GROUP BY date
+        ON CONFLICT (date, department) DO UPDATE SET
+            recorded = recorded + excluded.recorded, present = present + excluded.present;
+    END;
+'''
+
+REBUILD_TOTALS = f'''
+    DELETE FROM attendance_monthly_totals;
+    DELETE FROM attendance_daily_totals;
+    INSERT INTO attendance_monthly_totals (student_id, month, present)
+    SELECT student_id, substr(date, 1, 7), SUM({PRESENT})
+    FROM attendance GROUP BY student_id, substr(date, 1, 7);
+    INSERT INTO attendance_daily_totals (date, department, recorded, present)
+    SELECT a.date, COALESCE(s.department, ''), COUNT(*), SUM(a.{PRESENT})
+    FROM attendance a LEFT JOIN students s ON s.student_id = a.student_id
+    GROUP BY a.date, COALESCE(s.department, '');
+'''
+
+
+def parse_date(value):
+    """Accept 'YYYY-MM-DD' strings or date objects; raises ValueError otherwise"""
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def default_range(report_type, today=None):
+    """Date range the reports page uses for each report type"""
+    today = today or date.today()
+    if report_type == 'weekly':
+        # Week starts on Sunday, as in reports.js
+        start = today - timedelta(days=(today.weekday() + 1) % 7)
+        return start, start + timedelta(days=6)
+    if report_type == 'monthly':
+        start = today.replace(day=1)
+        return start, _next_month(start) - timedelta(days=1)
+    return today, today
+
+
+def _next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def split_range(start, end):
+    """Split [start, end] into whole months and the leftover day ranges
+
+    Returns ((first_month, last_month) or None, [(day_from, day_to), ...])
+    with months as 'YYYY-MM'.
+    """
+    first = start if start.day == 1 else _next_month(start)
+    last = end if (end + timedelta(days=1)).day == 1 else end.replace(day=1) - timedelta(days=1)
+    if first > last:
+        return None, [(start, end)]
+
+    edges = []
+    if start < first:
+        edges.append((start, first - timedelta(days=1)))
+    if last < end:
+        edges.append((last + timedelta(days=1), end))
+    return (first.strftime('%Y-%m'), last.strftime('%Y-%m')), edges
+
+
+class ReportEngine:
+    def __init__(self, db_path="attendance_system.db", maintenance=None, cache_size=REPORT_CACHE_SIZE):
+        self.db_path = db_path
+        self.maintenance = maintenance
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_version = None
+        self._lock = threading.Lock()
+        self.init_schema()
+
+    def init_schema(self):
+        """Create the rollup tables and triggers, filling them on first use"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executescript(REPORT_SCHEMA)
+            filled = conn.execute('SELECT 1 FROM attendance_daily_totals LIMIT 1').fetchone()
+            has_rows = conn.execute('SELECT 1 FROM attendance LIMIT 1').fetchone()
+            if has_rows and not filled:
+                self.rebuild_totals(conn)
+        finally:
+            conn.close()
+
+    def rebuild_totals(self, conn=None):
+        """Recompute both rollups from the attendance table"""
+        own = conn is None
+        conn = conn or sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executescript('BEGIN IMMEDIATE;' + REBUILD_TOTALS + 'COMMIT;')
+        finally:
+            if own:
+                conn.close()
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_version = None
+
+    def data_version(self):
+        """(attendance, students) change counters; reports read both tables"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            versions = dict(conn.execute(
+                "SELECT name, version FROM data_versions WHERE name IN ('attendance', 'students')").fetchall())
+        finally:
+            conn.close()
+        return versions.get('attendance', 0), versions.get('students', 0)
+
+    def _cached(self, key, build):
+        version = self.data_version()
+        with self._lock:
+            if version != self._cache_version:
+                self._cache.clear()
+                self._cache_version = version
+            elif key in self._cache:
+                self._cache.move_to_end(key)
+                REPORT_CACHE.labels('hit').inc()
+                return self._cache[key]
+
+        REPORT_CACHE.labels('miss').inc()
+        with REPORT_SECONDS.labels(key[0]).time():
+            result = build()
+
+        with self._lock:
+            # A write while building clears the cache; don't add to the new generation
+            if version == self._cache_version:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def range_report(self, date_from, date_to, department=None):
+        """Per-student attendance over [date_from, date_to] plus summary and charts"""
+        date_from, date_to = parse_date(date_from), parse_date(date_to)
+        if date_from > date_to:
+            date_from, date_to = date_to, date_from
+        department = department or None
+        key = ('range', date_from, date_to, department)
+        return self._cached(key, lambda: self._build(date_from, date_to, department))
+
+    def low_attendance(self, threshold=LOW_ATTENDANCE_THRESHOLD, date_from=None, date_to=None, department=None):
+        """Students below threshold percent, lowest first (default range: current term)"""
+        today = date.today()
+        date_from = parse_date(date_from) if date_from else term_of(today)[1]
+        date_to = parse_date(date_to) if date_to else today
+        report = self.range_report(date_from, date_to, department)
+
+        low = [row for row in report['data'] if row['attendance_percentage'] < threshold]
+        low.sort(key=lambda row: (row['attendance_percentage'], row['student_id']))
+        return {
+            'data': low,
+            'summary': self._summary(low, report['charts']['attendance']['values']),
+            'charts': report['charts'],
+            'threshold': threshold,
+            'start_date': report['start_date'],
+            'end_date': report['end_date']
+        }
+
+    def report_json(self, kind, **params):
+        """Cached JSON API body ({"success": true, ...}) for range_report or low_attendance
+
+        Encoding 10k student rows costs about as much as building them, so
+        the encoded body is cached next to the report.
+        """
+        if kind not in ('range_report', 'low_attendance'):
+            raise ValueError(f"Unknown report: {kind}")
+        key = (f'{kind}_json',) + tuple(sorted((name, str(value)) for name, value in params.items()))
+        return self._cached(key, lambda: json.dumps({'success': True, **getattr(self, kind)(**params)}))
+
+    def _build(self, date_from, date_to, department):
+        start, end = date_from.isoformat(), date_to.isoformat()
+        archived = self.maintenance and self.maintenance.overlapping_archives(start, end)
+        if archived:
+            conn = self.maintenance.connect_for_range(start, end)
+        else:
+            conn = sqlite3.connect(self.db_path)
+
+        try:
+            if archived:
+                present_by_student, daily = self._query_raw(conn, start, end, department)
+            else:
+                present_by_student, daily = self._query_totals(conn, date_from, date_to, department)
+
+            roster_sql = 'SELECT student_id, name, department FROM main.students'
+            roster_params = ()
+            if department:
+                roster_sql += ' WHERE department = ?'
+                roster_params = (department,)
+            roster = conn.execute(roster_sql + ' ORDER BY student_id', roster_params).fetchall()
+        finally:
+            conn.close()
+
+        total_days = len(daily)
+        scale = 100.0 / total_days if total_days else 0.0
+        present_of = present_by_student.get
+        data = []
+        by_department = {}
+        for student_id, name, dept in roster:
+            present = min(present_of(student_id, 0), total_days)
+            percentage = round(present * scale, 1)
+            data.append({
+                'student_id': student_id,
+                'name': name,
+                'department': dept,
+                'present_days': present,
+                'total_days': total_days,
+                'attendance_percentage': percentage
+            })
+            totals = by_department.setdefault(dept or 'N/A', [0.0, 0])
+            totals[0] += percentage
+            totals[1] += 1
+
+        day_values = [count for _, count in daily]
+        departments = sorted(by_department)
+        return {
+            'data': data,
+            'summary': self._summary(data, day_values),
+            'charts': {
+                'attendance': {'labels': [day for day, _ in daily], 'values': day_values},
+                'department': {
+                    'labels': departments,
+                    'values': [round(by_department[d][0] / by_department[d][1], 1) for d in departments]
+                }
+            },
+            'start_date': start,
+            'end_date': end
+        }
+
+    def _query_totals(self, conn, date_from, date_to, department):
+        """Per-student present days and per-day present counts from the rollups"""
+        months, edges = split_range(date_from, date_to)
+        present_by_student = {}
+        if months:
+            present_by_student.update(conn.execute('''
+                SELECT student_id, SUM(present) FROM attendance_monthly_totals
+                WHERE month BETWEEN ? AND ?
+                GROUP BY student_id
+            ''', months))
+        for edge_from, edge_to in edges:
+            # A few days are cheapest read by date and sorted; longer edges
+            # skip-scan the (student_id, date, status) index instead
+            hint = 'INDEXED BY idx_attendance_date' if (edge_to - edge_from).days < SHORT_EDGE_DAYS else ''
+            for student_id, present in conn.execute(f'''
+                SELECT student_id, SUM({PRESENT}) FROM attendance {hint}
+                WHERE date BETWEEN ? AND ?
+                GROUP BY student_id
+            ''', (edge_from.isoformat(), edge_to.isoformat())):
+                present_by_student[student_id] = present_by_student.get(student_id, 0) + present
+
+        # Class days count every department; present counts only the selected one
+        present_sum = 'SUM(CASE WHEN department = ? THEN present ELSE 0 END)' if department else 'SUM(present)'
+        params = ((department,) if department else ()) + (date_from.isoformat(), date_to.isoformat())
+        daily = conn.execute(f'''
+            SELECT date, {present_sum} FROM attendance_daily_totals
+            WHERE date BETWEEN ? AND ?
+            GROUP BY date
+            HAVING SUM(recorded) > 0
+            ORDER BY date
+        ''', params).fetchall()
+        return present_by_student, daily
+
+    def _query_raw(self, conn, start, end, department):
+        """Same as _query_totals, from raw rows of the attendance_range view"""
+        present_by_student = dict(conn.execute(f'''
+            SELECT student_id, SUM({PRESENT}) FROM attendance_range
+            WHERE date BETWEEN ? AND ?
+            GROUP BY student_id
+        ''', (start, end)))
+
+        present = PRESENT
+        params = (start, end)
+        if department:
+            present += ' AND student_id IN (SELECT student_id FROM main.students WHERE department = ?)'
+            params = (department,) + params
+        daily = conn.execute(f'''
+            SELECT date, SUM({present}) FROM attendance_range
+            WHERE date BETWEEN ? AND ?
+            GROUP BY date
+            ORDER BY date
+        ''', params).fetchall()
+        return present_by_student, daily
+
+    @staticmethod
+    def _summary(rows, day_values):
+        return {
+            'totalStudents': len(rows),
+            'averagePresent': round(sum(day_values) / len(day_values), 1) if day_values else 0,
+            'averageAttendance': round(sum(r['attendance_percentage'] for r in rows) / len(rows), 1) if rows else 0,
+            'daysCovered': len(day_values)
+        }
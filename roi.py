@@ -0,0 +1,138 @@
+"""
+Camera regions of interest and entry line
+
+A door camera only needs the strip around the entrance. CameraZones holds
+the parts of the frame worth searching (camera_roi) and an optional
+virtual entry line (camera_entry_line), both as fractions of the frame so
+they survive resolution changes and downscaling:
+
+    camera_roi         x,y,w,h[;x,y,w,h...]   e.g. 0.25,0.3,0.5,0.7
+    camera_entry_line  x1,y1,x2,y2            e.g. 0,0.6,1,0.6
+
+Only the regions are converted and run through detection, so the cost of
+those stages scales with the region area. Regions should not overlap (a
+face inside two regions is found twice) and need some margin around the
+faces: a face cut by a region edge is not detected.
+
+With an entry line, attendance follows line crossings instead of
+sightings (see IdentityVoter): crossing to the right of the line, as
+drawn from the first point to the second, is an entry and sets time_in;
+crossing back is an exit and sets time_out. For a horizontal line drawn
+left to right, walking down the image is an entry.
+"""
+
+import cv2
+
+# Faces within this fraction of the frame size from the line count as on
+# it, so jitter around the line is not a crossing
+LINE_MARGIN = 0.02
+
+ROI_COLOR = (255, 200, 0)
+LINE_COLOR = (0, 200, 255)
+
+
+def _floats(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(',')]
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if len(numbers) != count or not all(0.0 <= n <= 1.0 for n in numbers):
+        raise ValueError(f"Invalid {name}: {value!r} (expected {count} fractions between 0 and 1)")
+    return numbers
+
+
+def parse_regions(value):
+    """'x,y,w,h;...' fractions -> [(x, y, w, h), ...]; empty means the whole frame"""
+    regions = []
+    for part in (value or '').split(';'):
+        if not part.strip():
+            continue
+        x, y, w, h = _floats(part, 4, 'region')
+        if w <= 0 or h <= 0 or x + w > 1.0 or y + h > 1.0:
+            raise ValueError(f"Invalid region: {part!r} (must be non-empty and inside the frame)")
+        regions.append((x, y, w, h))
+    return regions
+
+
+def parse_line(value):
+    """'x1,y1,x2,y2' fractions -> tuple, or None when unset"""
+    if not value or not value.strip():
+        return None
+    x1, y1, x2, y2 = _floats(value, 4, 'entry line')
+    if (x1, y1) == (x2, y2):
+        raise ValueError(f"Invalid entry line: {value!r} (the two points must differ)")
+    return x1, y1, x2, y2
+
+
+class EntryLine:
+    """Entry line in pixel coordinates of one frame size"""
+
+    def __init__(self, x1, y1, x2, y2, margin=0.0):
+        self.start = (x1, y1)
+        self.end = (x2, y2)
+        self.dx, self.dy = x2 - x1, y2 - y1
+        self.length = (self.dx ** 2 + self.dy ** 2) ** 0.5
+        self.margin = margin
+
+    def side(self, box):
+        """+1 right of the line (in), -1 left of it (out), 0 on it"""
+        top, right, bottom, left = box
+        cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+        distance = (self.dx * (cy - self.start[1]) - self.dy * (cx - self.start[0])) / self.length
+        if abs(distance) <= self.margin:
+            return 0
+        return 1 if distance > 0 else -1
+
+
+class CameraZones:
+    def __init__(self, regions=(), line=None):
+        self.regions = list(regions)
+        self.line = line
+        # (width, height) -> pixel regions and line; frame size rarely changes
+        self._cache = {}
+
+    @classmethod
+    def from_settings(cls, get_setting, roi=None, entry_line=None):
+        """Zones from the camera_roi / camera_entry_line settings; arguments override them"""
+        if roi is None:
+            roi = get_setting('camera_roi', '')
+        if entry_line is None:
+            entry_line = get_setting('camera_entry_line', '')
+        return cls(parse_regions(roi), parse_line(entry_line))
+
+    def __bool__(self):
+        return bool(self.regions) or self.line is not None
+
+    def area_fraction(self):
+        """Share of the frame that is searched"""
+        return min(1.0, sum(w * h for _, _, w, h in self.regions)) if self.regions else 1.0
+
+    def for_size(self, width, height):
+        """(pixel regions or None, EntryLine or None) for a frame size
+
+        Regions are (top, right, bottom, left) boxes like face locations.
+        """
+        key = (width, height)
+        cached = self._cache.get(key)
+        if cached is None:
+            boxes = [(int(y * height), int(round((x + w) * width)), int(round((y + h) * height)), int(x * width))
+                     for x, y, w, h in self.regions] or None
+            line = None
+            if self.line is not None:
+                x1, y1, x2, y2 = self.line
+                line = EntryLine(x1 * width, y1 * height, x2 * width, y2 * height,
+                                 margin=LINE_MARGIN * max(width, height))
+            cached = self._cache[key] = (boxes, line)
+        return cached
+
+    def draw(self, frame):
+        """Outline the regions and entry line on a BGR frame in place"""
+        height, width = frame.shape[:2]
+        boxes, line = self.for_size(width, height)
+        for top, right, bottom, left in boxes or ():
+            cv2.rectangle(frame, (left, top), (right - 1, bottom - 1), ROI_COLOR, 1)
+        if line is not None:
+            start = tuple(int(v) for v in line.start)
+            end = (int(line.start[0] + line.dx), int(line.start[1] + line.dy))
+            cv2.line(frame, start, end, LINE_COLOR, 2)
+        return frame
@@ -6,13 +6,31 @@ Runs Flask backend with real-time face recognition
 
 import sys
 import os
+import hashlib
+import hmac
+import json
+import platform
+import tempfile
 import threading
 import time
-from flask import Flask, render_template, jsonify, request, Response, send_from_directory
+from flask import Flask, render_template, jsonify, request, Response, send_from_directory, g
 from flask_cors import CORS
 import cv2
 import numpy as np
 from datetime import datetime
+from frame_source import acquire_source, source_from_settings, DEFAULT_RESOLUTION, DEFAULT_FPS, DEFAULT_FOURCC
+import metrics
+import profiler
+from backup import BackupManager
+from maintenance import MaintenanceManager
+from face_recognition_system import DEFAULT_QUALITY
+from reports import ReportEngine, LOW_ATTENDANCE_THRESHOLD, default_range, parse_date
+from voting import voter_from_settings
+from roi import CameraZones, parse_line, parse_regions
+from frame_buffers import FramePool, StreamEncoder
+from sync import IngestManager, OutboxSync, decode_ingest_body
+from warmup import WarmUp
+import events
 
 # Import our existing systems
 try:
@@ -25,29 +43,51 @@ except ImportError:
 app = Flask(__name__, static_folder='static')
 CORS(app)
 
+# The profiling endpoint is off unless explicitly enabled
+app.config['ENABLE_PROFILER'] = os.environ.get('ATTENDANCE_ENABLE_PROFILER', '').lower() in ('1', 'true', 'yes')
+
 # Initialize systems
 print("Initializing AI Attendance System...")
 db = EnhancedDatabase()
 face_system = SimpleFaceSystem(db) if hasattr(SimpleFaceSystem, '__init__') else None
 
+backup_manager = BackupManager(getattr(db, 'db_path', 'attendance_system.db'))
+maintenance_manager = MaintenanceManager(getattr(db, 'db_path', 'attendance_system.db'))
+report_engine = ReportEngine(getattr(db, 'db_path', 'attendance_system.db'), maintenance_manager)
+ingest_manager = IngestManager(getattr(db, 'db_path', 'attendance_system.db'))
+event_log = events.EventLog(events.default_directory(getattr(db, 'db_path', 'attendance_system.db')))
+# Started by main() (or the ASGI lifespan, or the first camera start); recognition waits for it
+warmup = WarmUp(face_system, db, shards=(lambda: db.get_setting('camera_shards', '')) if hasattr(db, 'get_setting') else None)
+
+# Metrics
+REQUEST_SECONDS = metrics.histogram('attendance_http_request_seconds', 'Flask request latency', ('endpoint', 'method'))
+REQUESTS_TOTAL = metrics.counter('attendance_http_requests_total', 'Flask requests served', ('endpoint', 'status'))
+STREAM_CLIENTS = metrics.gauge('attendance_stream_clients', 'Connected MJPEG stream clients')
+
 # Global variables
 camera = None
 recognition_active = False
-current_frame = None
 
 class WebCameraManager:
     def __init__(self):
         self.camera = None
         self.active = False
         self.frame_count = 0
+        self.last_latency = None
+        self.zones = CameraZones()
         
     def start_camera(self):
         try:
             if not self.active:
-                self.camera = cv2.VideoCapture(0)
+                spec, options = source_from_settings(db.get_setting) if hasattr(db, 'get_setting') else (None, {})
+                self.zones = CameraZones.from_settings(db.get_setting) if hasattr(db, 'get_setting') else CameraZones()
+                # Only the departments bound to this camera are matched
+                if hasattr(db, 'get_setting') and hasattr(face_system, 'bind_shards'):
+                    face_system.bind_shards(db.get_setting('camera_shards', ''))
+                self.camera = acquire_source(spec, **options)
                 if self.camera.isOpened():
                     self.active = True
-                    print("Camera started successfully")
+                    print(f"Camera started successfully: {self.camera.describe()}")
                     return True
                 else:
                     print("Failed to open camera")
@@ -67,16 +107,352 @@ class WebCameraManager:
             print(f"Camera stop error: {e}")
         return False
     
+    def restart_camera(self):
+        """Reopen the camera so changed capture settings take effect"""
+        if not self.active:
+            return False
+        self.stop_camera()
+        return self.start_camera()
+    
     def get_frame(self):
-        if self.active and self.camera:
-            ret, frame = self.camera.read()
+        frame, _ = self.get_frame_with_timestamp()
+        return frame
+    
+    def get_frame_with_timestamp(self, copy=True):
+        """Return (frame, capture time); blocks until a new frame arrives
+        
+        With copy=False the frame is shared with other readers and must
+        not be modified.
+        """
+        camera = self.camera
+        if self.active and camera:
+            ret, frame, captured_at = camera.read_with_timestamp(timeout=1.0, copy=copy)
             if ret:
                 self.frame_count += 1
-                return frame
-        return None
+                return frame, captured_at
+        return None, None
+    
+    def record_latency(self, captured_at):
+        self.last_latency = time.time() - captured_at
+        metrics.CAPTURE_LATENCY.observe(self.last_latency)
+    
+    def describe(self):
+        camera = self.camera
+        return camera.describe() if self.active and camera else {}
+    
+    def health(self):
+        """Capture supervisor state: running, reconnecting, ended or closed"""
+        camera = self.camera
+        return camera.health() if self.active and camera else {'state': 'closed'}
+    
+    def ended(self):
+        """True once a recorded source has run out (live cameras reconnect instead)"""
+        camera = self.camera
+        return self.active and camera is not None and not camera.isOpened()
 
 camera_manager = WebCameraManager()
 
+class Publisher:
+    """Latest-value channel that wakes waiting threads and notifies listeners"""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.value = None
+        self.listeners = []
+    
+    def publish(self, value):
+        with self.condition:
+            self.sequence += 1
+            self.value = value
+            sequence = self.sequence
+            listeners = list(self.listeners)
+            self.condition.notify_all()
+        
+        for listener in listeners:
+            try:
+                listener(sequence, value)
+            except Exception as e:
+                print(f"Publisher listener error: {e}")
+    
+    def wait(self, last_sequence, timeout=None):
+        """Block until something newer than last_sequence is published"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > last_sequence, timeout)
+            return self.sequence, self.value
+    
+    def subscribe(self, listener):
+        with self.condition:
+            self.listeners.append(listener)
+    
+    def unsubscribe(self, listener):
+        with self.condition:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+# Processed frames as (PooledFrame, recognized_faces, face_locations), and attendance events
+frame_publisher = Publisher()
+attendance_publisher = Publisher()
+
+# Camera frames are copied once into pooled buffers; stream clients share one annotated JPEG per frame
+frame_pool = FramePool()
+stream_encoder = StreamEncoder(overlay=lambda canvas: camera_manager.zones.draw(canvas))
+STREAM_BOUNDARY = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+OFFLINE_INTERVAL = 1.0
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - start)
+        REQUESTS_TOTAL.labels(endpoint, response.status_code).inc()
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Metrics in Prometheus text exposition format"""
+    return Response(metrics.render_text(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/api/debug/profile')
+def debug_profile():
+    """Sample all threads for ?seconds=N and return flamegraph-ready stacks"""
+    if not app.config.get('ENABLE_PROFILER'):
+        return jsonify({'success': False, 'message': 'Profiler is disabled (set ATTENDANCE_ENABLE_PROFILER=1)'}), 403
+    
+    try:
+        seconds = float(request.args.get('seconds', 5))
+        interval = float(request.args.get('interval', profiler.DEFAULT_INTERVAL * 1000)) / 1000
+        limit = max(1, int(request.args.get('limit', 25)))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'seconds and interval must be numbers, limit an integer'}), 400
+    
+    result = profiler.profile(seconds, max(interval, 0.001))
+    if result is None:
+        return jsonify({'success': False, 'message': 'A profile is already running'}), 409
+    
+    if request.args.get('format') == 'collapsed':
+        return Response(result.collapsed() + '\n', mimetype='text/plain')
+    
+    return jsonify({
+        'success': True,
+        'seconds': round(result.duration, 3),
+        'samples': result.samples,
+        'interval_ms': result.interval * 1000,
+        'top_functions': result.top_functions(limit),
+        'collapsed': result.collapsed()
+    })
+
+@app.route('/api/system/info')
+def system_info():
+    """Database, backup and platform information for the settings page"""
+    try:
+        info = db.get_database_info() if hasattr(db, 'get_database_info') else {}
+        backups = backup_manager.list_backups()
+        size_kb = info.get('size_bytes', 0) / 1024
+        return jsonify({
+            'success': True,
+            'database': {
+                'status': 'Connected',
+                'connected': True,
+                'students': info.get('students', 0),
+                'records': info.get('records', 0),
+                'size': f"{size_kb / 1024:.1f} MB" if size_kb >= 1024 else f"{size_kb:.0f} KB"
+            },
+            'backup': {
+                'lastBackup': backups[0]['created'] if backups else None,
+                'location': backup_manager.backup_dir,
+                'count': len(backups),
+                'autoEnabled': False
+            },
+            'system': {
+                'platform': f"{platform.system()} {platform.release()} / Python {platform.python_version()}",
+                'camera_active': camera_manager.active,
+                'recognition_active': recognition_active
+            },
+            'metrics': metrics.snapshot()
+        })
+    except Exception as e:
+        print(f"System info error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/backup/create', methods=['POST'])
+def create_backup():
+    """Snapshot the database without blocking recognition"""
+    try:
+        data = request.get_json(silent=True) or {}
+        compress = str(data.get('compress', request.args.get('compress', 'true'))).lower() not in ('0', 'false', 'no')
+        result = backup_manager.create_backup(compress=compress)
+        
+        if hasattr(db, 'log_action'):
+            db.log_action("CREATE_BACKUP", "WEB_USER", f"Backup created: {result['file']}")
+        
+        return jsonify({'success': True, 'message': 'Backup created successfully', **result})
+    except Exception as e:
+        print(f"Backup error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/backup/restore', methods=['POST'])
+def restore_backup():
+    """Restore the database from an uploaded backup and reload the gallery"""
+    global students_response
+    upload = request.files.get('backup_file')
+    if upload is None:
+        return jsonify({'success': False, 'message': 'No backup file uploaded'})
+    
+    fd, upload_path = tempfile.mkstemp(suffix='.upload')
+    os.close(fd)
+    try:
+        upload.save(upload_path)
+        success, message, details = backup_manager.restore_backup(upload_path)
+        
+        if success:
+            # Older backups may predate the current schema, triggers and rollups
+            if hasattr(db, 'init_database'):
+                db.init_database()
+            report_engine.init_schema()
+            ingest_manager.init_schema()
+            # The restored change counters may repeat values already cached
+            report_engine.clear_cache()
+            if hasattr(db, 'clear_roster_cache'):
+                db.clear_roster_cache()
+            students_response = (None, None, None)
+            if face_system and hasattr(face_system, 'load_known_faces'):
+                face_system.load_known_faces()
+            if hasattr(db, 'log_action'):
+                db.log_action("RESTORE_BACKUP", "WEB_USER", f"Backup restored from upload {upload.filename}")
+        
+        return jsonify({'success': success, 'message': message, **(details or {})})
+    except Exception as e:
+        print(f"Restore error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+    finally:
+        os.remove(upload_path)
+
+@app.route('/api/database/optimize', methods=['POST'])
+def optimize_database():
+    """Refresh query statistics and release free pages"""
+    try:
+        result = maintenance_manager.optimize()
+        if hasattr(db, 'log_action'):
+            db.log_action("OPTIMIZE_DATABASE", "WEB_USER", f"Database optimized: {result}")
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        print(f"Optimize error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/database/cleanup', methods=['POST'])
+def cleanup_database():
+    """Archive attendance older than the most recent terms"""
+    try:
+        data = request.get_json(silent=True) or {}
+        keep_terms = int(data.get('keep_terms', request.args.get('keep_terms', 2)))
+        result = maintenance_manager.archive_attendance(keep_terms=keep_terms)
+        if result['removed']:
+            maintenance_manager.optimize()
+        if hasattr(db, 'log_action'):
+            db.log_action("CLEANUP_DATABASE", "WEB_USER", f"Archived {result['removed']} attendance records")
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        print(f"Cleanup error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/sync/ingest', methods=['POST'])
+def sync_ingest():
+    """Apply a batch of attendance events uploaded by an edge node"""
+    token = os.environ.get('ATTENDANCE_SYNC_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('X-Sync-Token', ''), token):
+        return jsonify({'success': False, 'message': 'Invalid sync token'}), 403
+    
+    try:
+        payload = decode_ingest_body(request.get_data(), request.headers.get('Content-Encoding'))
+        result = ingest_manager.ingest(payload.get('node_id'), payload['events'])
+    except (ValueError, OSError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Sync ingest error: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+    return jsonify({'success': True, **result})
+
+@app.route('/api/sync/nodes')
+def sync_nodes():
+    """Edge nodes that have uploaded attendance"""
+    try:
+        return jsonify({'success': True, 'nodes': ingest_manager.nodes()})
+    except Exception as e:
+        print(f"Sync nodes error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/reports/generate')
+def generate_report():
+    """Per-student attendance, summary and chart data over a date range"""
+    try:
+        default_from, default_to = default_range(request.args.get('type', 'daily'))
+        body = report_engine.report_json(
+            'range_report',
+            date_from=request.args.get('start_date') or default_from,
+            date_to=request.args.get('end_date') or default_to,
+            department=request.args.get('department')
+        )
+        return Response(body, mimetype='application/json')
+    except Exception as e:
+        print(f"Report error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/reports/low-attendance')
+def low_attendance_report():
+    """Students below the attendance threshold (default: current term, 75%)"""
+    try:
+        body = report_engine.report_json(
+            'low_attendance',
+            threshold=float(request.args.get('threshold', LOW_ATTENDANCE_THRESHOLD)),
+            date_from=request.args.get('start_date'),
+            date_to=request.args.get('end_date'),
+            department=request.args.get('department')
+        )
+        return Response(body, mimetype='application/json')
+    except Exception as e:
+        print(f"Low attendance report error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/analytics/occupancy')
+def occupancy_analytics():
+    """Faces, distinct students and entry line crossings per hour of one day"""
+    try:
+        day = parse_date(request.args.get('date') or datetime.now().date())
+        event_log.flush()
+        rows, _ = events.load(event_log.directory, day)
+        return jsonify({'success': True, **events.hourly_occupancy(rows, day)})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Occupancy error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/analytics/dwell')
+def dwell_analytics():
+    """Time each student spent in view over a date range"""
+    try:
+        date_from = parse_date(request.args.get('start_date') or datetime.now().date())
+        date_to = parse_date(request.args.get('end_date') or date_from)
+        max_gap = float(request.args.get('max_gap', events.DEFAULT_MAX_GAP))
+        event_log.flush()
+        rows, student_ids = events.load(event_log.directory, date_from, date_to)
+        students = events.dwell_times(rows, student_ids, max_gap)
+        names = {s[0]: s[1] for s in db.get_all_students()} if hasattr(db, 'get_all_students') else {}
+        for row in students:
+            row['name'] = names.get(row['student_id'])
+        return jsonify({'success': True, 'start_date': date_from.isoformat(), 'end_date': date_to.isoformat(),
+                        'max_gap': max_gap, 'students': students})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        print(f"Dwell error: {e}")
+        return jsonify({'success': False, 'message': str(e)})
+
 @app.route('/')
 def index():
     return send_from_directory('static', 'index.html')
@@ -104,21 +480,41 @@ def get_stats():
         print(f"Stats error: {e}")
         return jsonify({'today': 0, 'week': 0, 'total_students': 0, 'avg_daily': 0})
 
+# (roster version, encoded /api/students body, ETag), replaced as a whole
+students_response = (None, None, None)
+
+def student_json(s):
+    return {
+        'id': s[0],
+        'name': s[1], 
+        'email': s[2] if len(s) > 2 else '',
+        'phone': s[3] if len(s) > 3 else '',
+        'department': s[4] if len(s) > 4 else '',
+        'course': s[5] if len(s) > 5 else '',
+        'year': s[6] if len(s) > 6 else 1,
+        'status': s[7] if len(s) > 7 else 'Active'
+    }
+
 @app.route('/api/students')
 def get_students():
-    """Get all students"""
+    """Get all students (ETag / If-None-Match aware)"""
+    global students_response
     try:
-        students = db.get_all_students()
-        return jsonify([{
-            'id': s[0],
-            'name': s[1], 
-            'email': s[2] if len(s) > 2 else '',
-            'phone': s[3] if len(s) > 3 else '',
-            'department': s[4] if len(s) > 4 else '',
-            'course': s[5] if len(s) > 5 else '',
-            'year': s[6] if len(s) > 6 else 1,
-            'status': s[7] if len(s) > 7 else 'Active'
-        } for s in students])
+        if not hasattr(db, 'get_roster'):
+            return jsonify([student_json(s) for s in db.get_all_students()])
+        
+        version, students = db.get_roster()
+        cached_version, body, etag = students_response
+        if cached_version != version:
+            body = json.dumps([student_json(s) for s in students])
+            # Hash of the body, so a restored database can never match an old tag
+            etag = hashlib.sha1(body.encode()).hexdigest()
+            students_response = (version, body, etag)
+        
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
     except Exception as e:
         print(f"Students error: {e}")
         return jsonify([])
@@ -162,26 +558,25 @@ def add_student():
 def get_today_attendance():
     """Get today's attendance records"""
     try:
-        today = datetime.now().date()
-        if hasattr(db, 'get_attendance_records'):
-            records = db.get_attendance_records(date_from=today)
-        else:
-            records = []
+        today = datetime.now().date().isoformat()
+        # Rows are (name, student_id, date, time_in, time_out, status)
+        records = db.get_attendance_records(today)
+        departments = {student[0]: student[4] for student in db.get_roster()[1]}
         
         return jsonify([{
             'name': r[0],
             'student_id': r[1],
-            'department': r[2] if len(r) > 2 else '',
-            'date': str(r[3]) if len(r) > 3 else str(today),
-            'time_in': str(r[4]) if len(r) > 4 and r[4] else None,
-            'time_out': str(r[5]) if len(r) > 5 and r[5] else None,
-            'status': r[6] if len(r) > 6 else 'Present',
-            'confidence': r[7] if len(r) > 7 else 0.9,
-            'location': r[8] if len(r) > 8 else 'Main Campus'
+            'department': departments.get(r[1]) or '',
+            'date': str(r[2]),
+            'time_in': str(r[3]) if r[3] else None,
+            'time_out': str(r[4]) if r[4] else None,
+            'status': r[5] or 'Present',
+            'confidence': 0.9,
+            'location': 'Main Campus'
         } for r in records])
     except Exception as e:
         print(f"Today attendance error: {e}")
-        return jsonify([])
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/camera/start', methods=['POST'])
 def start_camera():
@@ -189,15 +584,21 @@ def start_camera():
     global recognition_active
     
     try:
+        # ?wait=<seconds> holds the response until recognition is warm (or the time runs out)
+        wait = min(max(request.args.get('wait', 0, type=float), 0), 60)
+        warmup.start()
         if camera_manager.start_camera():
             recognition_active = True
-            # Start recognition thread
+            # Start recognition thread; it takes frames once the warm-up is done
             threading.Thread(target=recognition_loop, daemon=True).start()
             
             if hasattr(db, 'log_action'):
                 db.log_action("START_CAMERA", "WEB_USER", "Camera started from web interface")
             
-            return jsonify({'success': True, 'message': 'Camera started'})
+            if wait:
+                warmup.wait(wait)
+            return jsonify({'success': True, 'ready': warmup.ready, 'warmup': warmup.status(),
+                            'message': 'Camera started' if warmup.ready else 'Camera started, recognition warming up'})
         else:
             return jsonify({'success': False, 'message': 'Failed to start camera'})
     except Exception as e:
@@ -224,86 +625,141 @@ def stop_camera():
 @app.route('/api/camera/status')
 def camera_status():
     """Get camera status"""
+    latency = metrics.CAPTURE_LATENCY.labels()
+    p50 = latency.quantile(0.5)
+    p95 = latency.quantile(0.95)
+    last = camera_manager.last_latency
     return jsonify({
         'active': recognition_active,
-        'camera_available': camera_manager.active
+        'camera_available': camera_manager.active,
+        'capture': camera_manager.describe(),
+        'health': camera_manager.health(),
+        'frames': camera_manager.frame_count,
+        'ready': warmup.ready,
+        'warmup': warmup.status(),
+        'capture_to_decision_ms': {
+            'last': round(last * 1000, 1) if last is not None else None,
+            'p50': p50 * 1000 if p50 is not None else None,
+            'p95': p95 * 1000 if p95 is not None else None
+        }
     })
 
+@app.route('/api/ready')
+def readiness():
+    """200 once recognition is warmed up, 503 with the progress before that"""
+    status = warmup.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
 def recognition_loop():
     """Main recognition loop"""
-    global recognition_active, current_frame
+    global recognition_active
     
     print("Starting recognition loop...")
     
+    # No frame is taken before the warm-up; the reader drops what arrives meanwhile
+    while recognition_active and not warmup.wait(timeout=1.0):
+        pass
+    
+    # Attendance is written once a face has matched the same student in K of N frames
+    get_setting = db.get_setting if hasattr(db, 'get_setting') else (lambda key, default=None: default)
+    voter = voter_from_settings(get_setting, threshold=0.7)
+    published = None
+    
     while recognition_active:
         try:
-            frame = camera_manager.get_frame()
-            if frame is not None:
-                current_frame = frame.copy()
+            # Blocks until the reader has a newer frame, so no fixed delay is needed
+            shared, captured_at = camera_manager.get_frame_with_timestamp(copy=False)
+            if shared is not None:
+                # The only copy of the frame, into a recycled buffer
+                pooled = frame_pool.copy(shared)
+                recognized_faces, face_locations, line = [], [], None
                 
                 # Perform face recognition if system available
                 if face_system and hasattr(face_system, 'recognize_faces_in_frame'):
-                    recognized_faces, face_locations = face_system.recognize_faces_in_frame(frame)
-                    
-                    # Mark attendance for recognized faces
-                    for face_info in recognized_faces:
-                        if face_info.get('student_id') and face_info.get('confidence', 0) > 0.7:
-                            if hasattr(db, 'mark_attendance'):
-                                db.mark_attendance(face_info['student_id'], face_info['confidence'])
-                            print(f"Attendance marked for: {face_info['name']}")
-            
-            time.sleep(0.1)  # Small delay
+                    # Only the configured regions are searched; the entry line, if any, drives time_in/time_out
+                    regions, line = camera_manager.zones.for_size(shared.shape[1], shared.shape[0])
+                    recognized_faces, face_locations = face_system.recognize_faces_in_frame(pooled.array, regions)
+                
+                # Every face seen goes to the event log; written in the background
+                event_log.record_frame(captured_at, face_locations, recognized_faces)
+                
+                # Readers retain() the published frame while they use it
+                frame_publisher.publish((pooled, recognized_faces, face_locations))
+                if published is not None:
+                    published.release()
+                published = pooled
+                
+                # Mark attendance for identities confirmed across frames
+                for face_info in voter.update(face_locations, recognized_faces, line=line):
+                    direction = face_info.get('direction')
+                    event_log.record_commit(captured_at, face_info)
+                    if hasattr(db, 'mark_attendance'):
+                        db.mark_attendance(face_info['student_id'], direction=direction)
+                        metrics.ATTENDANCE_MARKED.inc()
+                        attendance_publisher.publish({
+                            'student_id': face_info['student_id'],
+                            'name': face_info['name'],
+                            'confidence': float(face_info['confidence']),
+                            'direction': direction,
+                            'timestamp': datetime.now().isoformat(timespec='seconds')
+                        })
+                    print(f"Attendance marked for: {face_info['name']}" + (f" ({direction})" if direction else ""))
+                
+                camera_manager.record_latency(captured_at)
+            elif camera_manager.ended():
+                print("Camera source ended")
+                recognition_active = False
+                camera_manager.stop_camera()
+            else:
+                # Reconnecting or between frames; the capture supervisor brings the camera back
+                time.sleep(0.1)
         except Exception as e:
             print(f"Recognition loop error: {e}")
             time.sleep(1)
     
+    if published is not None:
+        published.release()
+    event_log.flush()
     print("Recognition loop stopped")
 
+_offline_jpeg = None
+
+def offline_jpeg():
+    """Placeholder shown while the camera is off, encoded once"""
+    global _offline_jpeg
+    if _offline_jpeg is None:
+        blank_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+        cv2.putText(blank_frame, 'Camera Offline', (200, 240), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        _offline_jpeg = cv2.imencode('.jpg', blank_frame)[1].tobytes()
+    return _offline_jpeg
+
 def generate_frames():
     """Generate video frames for streaming"""
-    global current_frame, recognition_active
-    
-    while True:
-        try:
-            if recognition_active and current_frame is not None:
-                frame = current_frame.copy()
+    STREAM_CLIENTS.inc()
+    sequence = 0
+    try:
+        while True:
+            try:
+                jpeg = None
+                if recognition_active:
+                    # Wakes on each processed frame; every client shares one annotated encode of it
+                    sequence, value = frame_publisher.wait(sequence, timeout=OFFLINE_INTERVAL)
+                    if value is not None:
+                        jpeg = stream_encoder.encode(sequence, value)
                 
-                # Perform face recognition for display
-                if face_system and hasattr(face_system, 'recognize_faces_in_frame'):
-                    recognized_faces, face_locations = face_system.recognize_faces_in_frame(frame)
-                    
-                    # Draw rectangles and labels
-                    for (top, right, bottom, left), face_info in zip(face_locations, recognized_faces):
-                        color = (0, 255, 0) if face_info.get('student_id') else (0, 0, 255)
-                        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                        
-                        name = face_info.get('name', 'Unknown')
-                        confidence = face_info.get('confidence', 0)
-                        label = f"{name} ({confidence:.1%})"
-                        
-                        cv2.rectangle(frame, (left, bottom - 35), (right, bottom), color, cv2.FILLED)
-                        cv2.putText(frame, label, (left + 6, bottom - 6), cv2.FONT_HERSHEY_DUPLEX, 0.6, (255, 255, 255), 1)
+                if jpeg is None:
+                    jpeg = offline_jpeg()
+                    time.sleep(OFFLINE_INTERVAL)
                 
-                # Encode frame
-                ret, buffer = cv2.imencode('.jpg', frame)
-                if ret:
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            else:
-                # Send blank frame when not active
-                blank_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(blank_frame, 'Camera Offline', (200, 240), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-                ret, buffer = cv2.imencode('.jpg', blank_frame)
-                if ret:
-                    frame_bytes = buffer.tobytes()
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            
-            time.sleep(0.033)  # ~30 FPS
-        except Exception as e:
-            print(f"Frame generation error: {e}")
-            time.sleep(1)
+                # Written as separate chunks so the shared JPEG is never copied per client
+                yield STREAM_BOUNDARY
+                yield jpeg
+                yield b'\r\n'
+            except Exception as e:
+                print(f"Frame generation error: {e}")
+                time.sleep(1)
+    finally:
+        STREAM_CLIENTS.dec()
 
 @app.route('/api/camera/stream')
 def video_stream():
@@ -311,38 +767,102 @@ def video_stream():
     return Response(generate_frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+# Settings page field -> face quality threshold (stored as quality_<name>)
+QUALITY_SETTING_FIELDS = {
+    'minFaceSize': 'min_face_size',
+    'minSharpness': 'min_sharpness',
+    'maxYaw': 'max_yaw'
+}
+
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     """Get system settings"""
+    get_setting = db.get_setting if hasattr(db, 'get_setting') else (lambda key, default=None: default)
     try:
-        if hasattr(db, 'get_setting'):
-            return jsonify({
-                'recognition_threshold': float(db.get_setting('recognition_threshold', '0.7')),
-                'camera_resolution': db.get_setting('camera_resolution', '640x480')
-            })
-        else:
-            return jsonify({
-                'recognition_threshold': 0.7,
-                'camera_resolution': '640x480'
-            })
+        threshold = float(get_setting('recognition_threshold', '0.7'))
+        quality = {field: float(get_setting(f'quality_{name}', DEFAULT_QUALITY[name]))
+                   for field, name in QUALITY_SETTING_FIELDS.items()}
+        resolution = get_setting('camera_resolution', DEFAULT_RESOLUTION)
+        camera = {
+            'index': get_setting('camera_index', '0'),
+            'resolution': resolution,
+            'frameRate': float(get_setting('camera_fps', DEFAULT_FPS)),
+            'fourcc': get_setting('camera_fourcc', DEFAULT_FOURCC),
+            'roi': get_setting('camera_roi', ''),
+            'entryLine': get_setting('camera_entry_line', ''),
+            'shards': get_setting('camera_shards', '')
+        }
     except Exception as e:
         print(f"Get settings error: {e}")
-        return jsonify({'recognition_threshold': 0.7, 'camera_resolution': '640x480'})
+        threshold, resolution = 0.7, DEFAULT_RESOLUTION
+        quality = {field: DEFAULT_QUALITY[name] for field, name in QUALITY_SETTING_FIELDS.items()}
+        camera = {'index': '0', 'resolution': resolution, 'frameRate': DEFAULT_FPS, 'fourcc': DEFAULT_FOURCC,
+                  'roi': '', 'entryLine': '', 'shards': ''}
+    
+    # Flat keys for older clients, nested data for the settings page
+    return jsonify({
+        'success': True,
+        'recognition_threshold': threshold,
+        'camera_resolution': resolution,
+        'data': {
+            'recognition': {'threshold': threshold, **quality},
+            'camera': camera
+        }
+    })
+
+# Settings page field -> stored setting key
+CAMERA_SETTING_KEYS = {
+    'index': 'camera_index',
+    'resolution': 'camera_resolution',
+    'frameRate': 'camera_fps',
+    'fourcc': 'camera_fourcc',
+    'roi': 'camera_roi',
+    'entryLine': 'camera_entry_line',
+    'shards': 'camera_shards'
+}
 
 @app.route('/api/settings', methods=['POST'])
 def save_settings():
     """Save system settings"""
     try:
-        data = request.json
+        data = request.json or {}
+        
+        updates = {}
+        if 'recognition_threshold' in data:
+            updates['recognition_threshold'] = data['recognition_threshold']
+        if 'camera_resolution' in data:
+            updates['camera_resolution'] = data['camera_resolution']
+        if 'threshold' in (data.get('recognition') or {}):
+            updates['recognition_threshold'] = data['recognition']['threshold']
+        for field, key in CAMERA_SETTING_KEYS.items():
+            if field in (data.get('camera') or {}):
+                updates[key] = data['camera'][field]
+        for field, name in QUALITY_SETTING_FIELDS.items():
+            if field in (data.get('recognition') or {}):
+                updates[f'quality_{name}'] = float(data['recognition'][field])
+        
+        # Reject malformed regions/lines before anything is saved
+        if 'camera_roi' in updates:
+            parse_regions(updates['camera_roi'])
+        if 'camera_entry_line' in updates:
+            parse_line(updates['camera_entry_line'])
         
         if hasattr(db, 'set_setting'):
-            if 'recognition_threshold' in data:
-                db.set_setting('recognition_threshold', str(data['recognition_threshold']))
-                if face_system and hasattr(face_system, 'recognition_threshold'):
-                    face_system.recognition_threshold = float(data['recognition_threshold'])
+            camera_changed = False
+            for key, value in updates.items():
+                if key.startswith('camera_'):
+                    camera_changed = camera_changed or str(value) != str(db.get_setting(key))
+                db.set_setting(key, value)
+            
+            if 'recognition_threshold' in updates and face_system and hasattr(face_system, 'recognition_threshold'):
+                face_system.recognition_threshold = float(updates['recognition_threshold'])
+            
+            if any(key.startswith('quality_') for key in updates) and hasattr(face_system, 'load_quality_settings'):
+                face_system.load_quality_settings()
             
-            if 'camera_resolution' in data:
-                db.set_setting('camera_resolution', data['camera_resolution'])
+            # Resolution, frame rate, FOURCC, zones and shards are applied when the device opens
+            if camera_changed:
+                camera_manager.restart_camera()
             
             if hasattr(db, 'log_action'):
                 db.log_action("SAVE_SETTINGS", "WEB_USER", f"Settings updated: {data}")
@@ -386,6 +906,21 @@ def main():
     print("Note: Make sure your camera is not being used by other applications")
     print("=" * 60)
     
+    # A web UI running on an edge node can forward its attendance too
+    if os.environ.get('ATTENDANCE_SYNC_URL'):
+        OutboxSync(getattr(db, 'db_path', 'attendance_system.db')).start(threading.Event())
+        print(f"Syncing attendance to {os.environ['ATTENDANCE_SYNC_URL']}")
+    
+    # Models, caches and a first inference, while the server comes up
+    warmup.start()
+    
+    if '--async' in sys.argv:
+        # Reuse this module's app and globals instead of importing a second copy
+        sys.modules.setdefault('run_web_system', sys.modules[__name__])
+        import async_web_system
+        async_web_system.serve(host='0.0.0.0', port=5000)
+        return
+    
     try:
         app.run(debug=False, host='0.0.0.0', port=5000, threaded=True)
     except KeyboardInterrupt:
@@ -96,6 +96,9 @@ class SettingsManager {
             document.getElementById('cameraIndex').value = settings.camera.index || 0;
             document.getElementById('cameraResolution').value = settings.camera.resolution || '1280x720';
             document.getElementById('frameRate').value = settings.camera.frameRate || 15;
+            document.getElementById('cameraRoi').value = settings.camera.roi || '';
+            document.getElementById('entryLine').value = settings.camera.entryLine || '';
+            document.getElementById('cameraShards').value = settings.camera.shards || '';
             document.getElementById('showBoundingBox').checked = settings.camera.showBoundingBox !== false;
             document.getElementById('showConfidence').checked = settings.camera.showConfidence !== false;
         }
@@ -127,6 +130,9 @@ class SettingsManager {
                 index: parseInt(document.getElementById('cameraIndex').value),
                 resolution: document.getElementById('cameraResolution').value,
                 frameRate: parseInt(document.getElementById('frameRate').value),
+                roi: document.getElementById('cameraRoi').value.trim(),
+                entryLine: document.getElementById('entryLine').value.trim(),
+                shards: document.getElementById('cameraShards').value.trim(),
                 showBoundingBox: document.getElementById('showBoundingBox').checked,
                 showConfidence: document.getElementById('showConfidence').checked
             },
@@ -0,0 +1,198 @@
+"""
+Gallery shards per department
+
+One process can serve several schools or departments, each with its own
+cameras. A camera bound to shards (the camera_shards setting, or
+--shards) only matches the students of those departments instead of the
+whole gallery:
+
+    camera_shards   Computer Science,Physics
+    camera_shards   North/*                  every department starting with "North/"
+
+Empty means the whole gallery, as before. A site hosting several schools
+names departments "<school>/<department>" and binds each door camera to
+its school with a trailing *.
+
+Each shard is a FaceGallery of one department's students, loaded from
+the database the first time a camera needs it. Loaded shards are shared
+by every FaceRecognitionSystem in the process using the same database
+(like the roster cache) and kept up to date from the student change log.
+When they hold more than the memory budget
+(ATTENDANCE_SHARD_BUDGET_MB), the least recently used ones are dropped
+and reloaded when needed again. The budget should cover the bindings in
+use at the same time; below that, shards are reloaded on every refresh.
+
+Students without a department are only matched by unbound cameras.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+from gallery import DEFAULT_PRECISION, FaceGallery
+
+DEFAULT_BUDGET_MB = float(os.environ.get('ATTENDANCE_SHARD_BUDGET_MB', '256'))
+
+SHARD_LOADS = metrics.counter('attendance_gallery_shard_lookups_total', 'Gallery shard lookups', ('result',))
+SHARD_EVICTIONS = metrics.counter('attendance_gallery_shard_evictions_total', 'Gallery shards dropped to stay in budget')
+SHARDS_LOADED = metrics.gauge('attendance_gallery_shards_loaded', 'Gallery shards held in memory')
+SHARD_BYTES = metrics.gauge('attendance_gallery_shard_bytes', 'Memory held by loaded gallery shards')
+
+# Shard caches per (database file, precision), shared by every recognizer in the process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def parse_shards(value):
+    """'A,B,North/*' -> ('A', 'B', 'North/*'); empty means unsharded"""
+    return tuple(part.strip() for part in (value or '').split(',') if part.strip())
+
+
+class ShardView:
+    """Matching snapshot over the shards bound to one camera
+
+    Read by match_face like a FaceGallery: ids, names, distances() and
+    len(). Distances are computed shard by shard and concatenated, so no
+    encodings are copied.
+    """
+
+    def __init__(self, shards=(), version=0, generation=0, precision=None):
+        self.shards = list(shards)
+        self.version = version
+        self.generation = generation
+        self.precision = precision
+        self.ids = [student_id for shard in self.shards for student_id in shard.ids]
+        self.names = [name for shard in self.shards for name in shard.names]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def encodings(self):
+        if not self.shards:
+            return np.empty((0, 128))
+        return np.vstack([shard.encodings for shard in self.shards])
+
+    def nbytes(self):
+        return sum(shard.nbytes() for shard in self.shards)
+
+    def distances(self, encoding):
+        if not self.shards:
+            return np.empty(0)
+        if len(self.shards) == 1:
+            return self.shards[0].distances(encoding)
+        return np.concatenate([shard.distances(encoding) for shard in self.shards])
+
+
+class ShardCache:
+    def __init__(self, db, precision=None, budget_bytes=None):
+        self.db = db
+        self.precision = precision or DEFAULT_PRECISION
+        self.budget_bytes = int(DEFAULT_BUDGET_MB * 2 ** 20 if budget_bytes is None else budget_bytes)
+        self.lock = threading.Lock()
+        # department -> FaceGallery, least recently used first
+        self.shards = OrderedDict()
+        # Change-log sequence every loaded shard reflects
+        self.version = db.get_face_change_seq()
+        # Bumped whenever a loaded shard or the set of departments changes
+        self.generation = 0
+        self.departments = None
+
+    def resolve(self, bindings):
+        """Department names matching bindings ('Physics', 'North/*')"""
+        with self.lock:
+            if self.departments is None:
+                self.departments = self.db.get_departments()
+            departments = self.departments
+        resolved = []
+        for binding in bindings:
+            if binding.endswith('*'):
+                matches = [d for d in departments if d.startswith(binding[:-1])]
+            else:
+                matches = [binding] if binding in departments else []
+            resolved.extend(d for d in matches if d not in resolved)
+        return resolved
+
+    def get(self, department, keep=()):
+        """The shard of one department, loading it if needed"""
+        with self.lock:
+            shard = self.shards.get(department)
+            if shard is not None:
+                self.shards.move_to_end(department)
+                SHARD_LOADS.labels('hit').inc()
+                return shard
+
+            # Loaded under the lock so a refresh can't run between the read and
+            # the insert. Matching never waits: it uses views already built
+            SHARD_LOADS.labels('miss').inc()
+            version, rows = self.db.get_face_gallery(department)
+            shard = self.shards[department] = FaceGallery.from_rows(rows, version, self.precision)
+            self._evict(keep=set(keep) | {department})
+            self._update_gauges()
+            return shard
+
+    def view(self, bindings):
+        """ShardView over every department matching bindings"""
+        departments = self.resolve(bindings)
+        generation, version = self.generation, self.version
+        shards = [self.get(department, keep=departments) for department in departments]
+        return ShardView(shards, version, generation, self.precision)
+
+    def refresh(self):
+        """Apply the student change log to the loaded shards; True if anything changed"""
+        with self.lock:
+            seq = self.db.get_face_change_seq()
+            if seq == self.version:
+                return False
+            if seq < self.version:
+                # Change log went backwards: the database was restored
+                self.shards.clear()
+                self.departments = None
+            else:
+                seq, changes = self.db.get_face_changes(self.version, with_department=True)
+                for department, shard in list(self.shards.items()):
+                    # Students who moved to another department leave this shard (no encoding = removal)
+                    rows = [(student_id, name, blob if moved_to == department else None)
+                            for student_id, name, blob, moved_to in changes
+                            if moved_to == department or student_id in shard.index]
+                    if rows:
+                        self.shards[department] = shard.apply(rows, seq)
+                self._evict()
+            # Departments may have appeared or emptied; listed again on the next view
+            self.departments = None
+            self.version = seq
+            self.generation += 1
+            self._update_gauges()
+        return True
+
+    def nbytes(self):
+        with self.lock:
+            return sum(shard.nbytes() for shard in self.shards.values())
+
+    def _evict(self, keep=()):
+        # Called with the lock held
+        total = sum(shard.nbytes() for shard in self.shards.values())
+        for department in list(self.shards):
+            if total <= self.budget_bytes:
+                break
+            if department in keep:
+                continue
+            total -= self.shards.pop(department).nbytes()
+            SHARD_EVICTIONS.inc()
+
+    def _update_gauges(self):
+        SHARDS_LOADED.set(len(self.shards))
+        SHARD_BYTES.set(sum(shard.nbytes() for shard in self.shards.values()))
+
+
+def shard_cache(db, precision=None):
+    """The process-wide ShardCache for db's database file"""
+    key = (getattr(db, 'db_path', None), precision)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ShardCache(db, precision)
+        return cache
@@ -0,0 +1,510 @@
+"""
+Edge -> central attendance sync
+
+Door units keep their own attendance_system.db and run recognition
+locally. On an edge node, OutboxSync adds a `sync_outbox` table that
+triggers fill with the current state of every attendance row that
+changes. A background loop uploads the outbox in gzip-compressed JSON
+batches to POST /api/sync/ingest on the central run_web_system.py and
+deletes rows once the server has acknowledged them. If the server is
+unreachable, the outbox keeps growing and upload resumes from the oldest
+unacknowledged row when it comes back.
+
+Every outbox row carries a random event_id. The central IngestManager
+records the ids it has applied, so a batch resent after a lost
+acknowledgement is not applied twice. Events carry the full row state
+(time_in, time_out, status) and the edge's local time of the change
+(changed_at). They merge into the central table as earliest time_in and
+latest time_out. An event without a time_out (the student came back in
+through an entry line, or was first seen after an exit elsewhere) clears
+the central time_out when it was recorded after that exit, so a
+re-entered student is not reported as gone. The latest such sighting is
+kept in sync_inside, and exits before it are ignored, so the order in
+which doors upload does not matter. Replays and events from several
+doors for the same student therefore converge on the same row.
+Doors are compared by their clocks, which should be kept in sync (NTP).
+Events from older edges without changed_at never clear a time_out.
+
+A malformed batch (not a list of objects with event_id, student_id and
+date) is refused with a 400. Events whose values are invalid (a date
+that is not YYYY-MM-DD, times that are not HH:MM:SS, a student unknown
+to the central server) are skipped and reported back as rejected, so
+one bad row cannot block a node's outbox.
+
+Usage on an edge node:
+    python main.py --headless --sync-url http://central:5000
+    python -m sync --server http://central:5000 --once
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+from datetime import datetime
+
+import metrics
+from database import DatabaseManager
+
+SYNC_BATCH_SIZE = 500
+SYNC_INTERVAL = 5
+MAX_BACKOFF = 300
+# Applied event ids are remembered this long; edge outboxes older than
+# this would be re-applied, which the merge rules make harmless
+EVENT_RETENTION_DAYS = 30
+MAX_INGEST_BYTES = 16 * 1024 * 1024
+# Rejected events listed in an ingest response; the rest are only counted
+MAX_REPORTED_REJECTS = 20
+
+OUTBOX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sync_outbox (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT NOT NULL DEFAULT (lower(hex(randomblob(16)))),
+        student_id TEXT NOT NULL,
+        date DATE NOT NULL,
+        time_in TIME,
+        time_out TIME,
+        status TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_sync_outbox_student_date ON sync_outbox (student_id, date);
+
+    -- One pending event per attendance row: a newer state replaces an
+    -- unsent one, so per-frame time_out updates don't pile up offline
+    CREATE TRIGGER IF NOT EXISTS sync_outbox_insert AFTER INSERT ON attendance
+    BEGIN
+        DELETE FROM sync_outbox WHERE student_id = NEW.student_id AND date = NEW.date;
+        INSERT INTO sync_outbox (student_id, date, time_in, time_out, status)
+        VALUES (NEW.student_id, NEW.date, NEW.time_in, NEW.time_out, NEW.status);
+    END;
+    CREATE TRIGGER IF NOT EXISTS sync_outbox_update AFTER UPDATE OF time_in, time_out, status ON attendance
+    BEGIN
+        DELETE FROM sync_outbox WHERE student_id = NEW.student_id AND date = NEW.date;
+        INSERT INTO sync_outbox (student_id, date, time_in, time_out, status)
+        VALUES (NEW.student_id, NEW.date, NEW.time_in, NEW.time_out, NEW.status);
+    END;
+'''
+
+INGEST_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS sync_events (
+        event_id TEXT PRIMARY KEY,
+        node_id TEXT NOT NULL,
+        received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_sync_events_received ON sync_events (received_at);
+
+    -- Latest edge time each student was seen inside (event without a time_out)
+    CREATE TABLE IF NOT EXISTS sync_inside (
+        student_id TEXT NOT NULL,
+        date DATE NOT NULL,
+        seen_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (student_id, date)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS sync_nodes (
+        node_id TEXT PRIMARY KEY,
+        last_seen TIMESTAMP,
+        events INTEGER NOT NULL DEFAULT 0,
+        duplicates INTEGER NOT NULL DEFAULT 0
+    );
+'''
+
+EVENT_FIELDS = ('event_id', 'student_id', 'date', 'time_in', 'time_out', 'status', 'changed_at')
+# Outbox column per event field; created_at is UTC, events carry local time like attendance
+OUTBOX_COLUMNS = EVENT_FIELDS[:-1] + ("datetime(created_at, 'localtime')",)
+
+SYNC_EVENTS = metrics.counter('attendance_sync_events_total', 'Attendance events uploaded or ingested', ('result',))
+SYNC_PENDING = metrics.gauge('attendance_sync_outbox_pending', 'Attendance events waiting in the edge outbox')
+SYNC_BATCH_SECONDS = metrics.histogram('attendance_sync_batch_seconds', 'Time to upload or ingest one batch', ('side',))
+
+
+class SyncError(Exception):
+    pass
+
+
+class OutboxSync:
+    """Edge side: queue attendance changes and upload them to the central server"""
+
+    def __init__(self, db_path="attendance_system.db", server_url=None, token=None,
+                 batch_size=SYNC_BATCH_SIZE, timeout=30):
+        self.db_path = db_path
+        self.server_url = (server_url or os.environ.get('ATTENDANCE_SYNC_URL', '')).rstrip('/')
+        self.token = token if token is not None else os.environ.get('ATTENDANCE_SYNC_TOKEN')
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.last_error = None
+        self.last_success = None
+        self.init_schema()
+        self.node_id = self._node_id()
+
+    def init_schema(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executescript(OUTBOX_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _node_id(self):
+        """Stable id of this edge node, generated once and kept in settings"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT value FROM settings WHERE key = 'node_id'").fetchone()
+            if row and row[0]:
+                return row[0]
+            node_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+            conn.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('node_id', ?)", (node_id,))
+            conn.commit()
+            # Another process may have won the race
+            return conn.execute("SELECT value FROM settings WHERE key = 'node_id'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def backfill(self, since=None):
+        """Queue attendance recorded before the outbox existed (since a date, or all)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                # Dated at the row's own last time, not now, so old rows never look newer than a later exit
+                count = conn.execute('''
+                    INSERT INTO sync_outbox (student_id, date, time_in, time_out, status, created_at)
+                    SELECT student_id, date, time_in, time_out, status,
+                           datetime(date || ' ' || COALESCE(time_out, time_in, '00:00:00'), 'utc')
+                    FROM attendance
+                    WHERE date >= ? AND NOT EXISTS (
+                        SELECT 1 FROM sync_outbox o WHERE o.student_id = attendance.student_id AND o.date = attendance.date
+                    )
+                ''', (since or '',)).rowcount
+        finally:
+            conn.close()
+        return count
+
+    def pending(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            count = conn.execute('SELECT COUNT(*) FROM sync_outbox').fetchone()[0]
+        finally:
+            conn.close()
+        SYNC_PENDING.set(count)
+        return count
+
+    def _next_batch(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(f'''
+                SELECT seq, {', '.join(OUTBOX_COLUMNS)} FROM sync_outbox
+                ORDER BY seq LIMIT ?
+            ''', (self.batch_size,)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows], [dict(zip(EVENT_FIELDS, row[1:])) for row in rows]
+
+    def _acknowledge(self, seqs):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            # Rows replaced by a newer state since the read are already gone;
+            # the replacement has a new seq and goes in the next batch
+            conn.executemany('DELETE FROM sync_outbox WHERE seq = ?', [(seq,) for seq in seqs])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _post(self, events):
+        body = gzip.compress(json.dumps({'node_id': self.node_id, 'events': events}).encode('utf-8'))
+        request = urllib.request.Request(self.server_url + '/api/sync/ingest', data=body, method='POST')
+        request.add_header('Content-Type', 'application/json')
+        request.add_header('Content-Encoding', 'gzip')
+        if self.token:
+            request.add_header('X-Sync-Token', self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise SyncError(f"Server returned {e.code}: {e.read()[:200]!r}")
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise SyncError(f"Server unreachable: {e}")
+        if not result.get('success'):
+            raise SyncError(result.get('message', 'Ingest failed'))
+        return result
+
+    def sync_once(self):
+        """Upload everything pending; return counts. Raises SyncError when the server fails"""
+        if not self.server_url:
+            raise SyncError("No sync server configured")
+
+        sent = duplicates = rejected = batches = 0
+        while True:
+            seqs, events = self._next_batch()
+            if not events:
+                break
+            with SYNC_BATCH_SECONDS.labels('upload').time():
+                result = self._post(events)
+            self._acknowledge(seqs)
+            sent += len(events)
+            duplicates += result.get('duplicates', 0)
+            if result.get('rejected'):
+                # Acknowledged anyway: resending an invalid event can't succeed
+                rejected += result['rejected']
+                SYNC_EVENTS.labels('rejected').inc(result['rejected'])
+                print(f"Sync server rejected {result['rejected']} events: {result.get('errors')}")
+            batches += 1
+            SYNC_EVENTS.labels('sent').inc(len(events))
+            if len(events) < self.batch_size:
+                break
+
+        self.last_success = time.time()
+        self.last_error = None
+        self.pending()
+        return {'sent': sent, 'duplicates': duplicates, 'rejected': rejected, 'batches': batches}
+
+    def run(self, stop_event, interval=SYNC_INTERVAL):
+        """Sync every interval seconds until stop_event is set, backing off while offline"""
+        delay = interval
+        while not stop_event.is_set():
+            try:
+                result = self.sync_once()
+                if result['sent']:
+                    print(f"Synced {result['sent']} attendance events to {self.server_url}")
+                delay = interval
+            except SyncError as e:
+                if self.last_error is None:
+                    print(f"Sync failed, will retry: {e}")
+                self.last_error = str(e)
+                SYNC_EVENTS.labels('failed_batch').inc()
+                delay = min(delay * 2, MAX_BACKOFF)
+            except sqlite3.Error as e:
+                print(f"Sync outbox error: {e}")
+                delay = min(delay * 2, MAX_BACKOFF)
+            stop_event.wait(delay)
+
+    def start(self, stop_event, interval=SYNC_INTERVAL):
+        thread = threading.Thread(target=self.run, args=(stop_event, interval), daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {
+            'node_id': self.node_id,
+            'server': self.server_url,
+            'pending': self.pending(),
+            'last_success': self.last_success,
+            'last_error': self.last_error
+        }
+
+
+class IngestManager:
+    """Central side: apply event batches from edge nodes exactly once"""
+
+    def __init__(self, db_path="attendance_system.db"):
+        self.db_path = db_path
+        self.init_schema()
+
+    def init_schema(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.executescript(INGEST_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def ingest(self, node_id, events):
+        """Apply a batch in one transaction; return accepted/duplicate/rejected counts
+
+        Raises ValueError for a malformed batch. Events with invalid values
+        are skipped and listed under 'errors'.
+        """
+        if not node_id:
+            raise ValueError("node_id is required")
+        for event in events:
+            if not isinstance(event, dict):
+                raise ValueError("Every event must be an object")
+            if not (event.get('event_id') and event.get('student_id') and event.get('date')):
+                raise ValueError("Every event needs event_id, student_id and date")
+
+        start = time.perf_counter()
+        accepted = duplicates = rejected = 0
+        errors = []
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                cursor = conn.cursor()
+                known = self._known_students(cursor, events)
+                for event in events:
+                    reason = invalid_event(event, known)
+                    if reason:
+                        rejected += 1
+                        if len(errors) < MAX_REPORTED_REJECTS:
+                            errors.append({'event_id': str(event['event_id']), 'reason': reason})
+                        continue
+                    cursor.execute('INSERT OR IGNORE INTO sync_events (event_id, node_id) VALUES (?, ?)',
+                                   (event['event_id'], node_id))
+                    if cursor.rowcount == 0:
+                        duplicates += 1
+                        continue
+                    self._merge(cursor, event)
+                    accepted += 1
+
+                cursor.execute('''
+                    INSERT INTO sync_nodes (node_id, last_seen, events, duplicates)
+                    VALUES (?, CURRENT_TIMESTAMP, ?, ?)
+                    ON CONFLICT (node_id) DO UPDATE SET
+                        last_seen = excluded.last_seen,
+                        events = events + excluded.events,
+                        duplicates = duplicates + excluded.duplicates
+                ''', (node_id, accepted, duplicates))
+                cursor.execute('DELETE FROM sync_events WHERE received_at < datetime(\'now\', ?)',
+                               (f'-{EVENT_RETENTION_DAYS} days',))
+                cursor.execute('DELETE FROM sync_inside WHERE date < date(\'now\', ?)',
+                               (f'-{EVENT_RETENTION_DAYS} days',))
+        finally:
+            conn.close()
+
+        SYNC_BATCH_SECONDS.labels('ingest').observe(time.perf_counter() - start)
+        SYNC_EVENTS.labels('accepted').inc(accepted)
+        SYNC_EVENTS.labels('duplicate').inc(duplicates)
+        if rejected:
+            SYNC_EVENTS.labels('invalid').inc(rejected)
+        result = {'accepted': accepted, 'duplicates': duplicates, 'rejected': rejected}
+        if errors:
+            result['errors'] = errors
+        return result
+
+    @staticmethod
+    def _known_students(cursor, events):
+        ids = list({event['student_id'] for event in events if isinstance(event['student_id'], str)})
+        rows = cursor.execute('SELECT student_id FROM students WHERE student_id IN (SELECT value FROM json_each(?))',
+                              (json.dumps(ids),)).fetchall()
+        return {row[0] for row in rows}
+
+    def _merge(self, cursor, event):
+        inside_at = None
+        if not event.get('time_out') and event.get('changed_at'):
+            cursor.execute('''
+                INSERT INTO sync_inside (student_id, date, seen_at) VALUES (?, ?, ?)
+                ON CONFLICT (student_id, date) DO UPDATE SET seen_at = max(seen_at, excluded.seen_at)
+            ''', (event['student_id'], event['date'], event['changed_at']))
+        elif event.get('time_out'):
+            row = cursor.execute('SELECT seen_at FROM sync_inside WHERE student_id = ? AND date = ?',
+                                 (event['student_id'], event['date'])).fetchone()
+            inside_at = row[0] if row else None
+
+        existing = cursor.execute('''
+            SELECT id, time_in, time_out FROM attendance WHERE student_id = ? AND date = ?
+        ''', (event['student_id'], event['date'])).fetchone()
+
+        if existing is None:
+            cursor.execute('''
+                INSERT INTO attendance (student_id, date, time_in, time_out, status)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (event['student_id'], event['date'], event.get('time_in'), event.get('time_out'),
+                  event.get('status') or 'Present'))
+            return
+
+        # Only touch columns that move, so report caches aren't invalidated by replays
+        row_id, time_in, time_out = existing
+        if event.get('time_in') and (time_in is None or event['time_in'] < time_in):
+            cursor.execute('UPDATE attendance SET time_in = ? WHERE id = ?', (event['time_in'], row_id))
+        if event.get('time_out'):
+            # An exit from before the student was last seen inside is out of date
+            newer = time_out is None or event['time_out'] > time_out
+            if newer and (inside_at is None or f"{event['date']} {event['time_out']}" > inside_at):
+                cursor.execute('UPDATE attendance SET time_out = ? WHERE id = ?', (event['time_out'], row_id))
+        elif (not event.get('time_out') and time_out and event.get('changed_at')
+              and event['changed_at'] >= f"{event['date']} {time_out}"):
+            # The edge saw the student inside after the recorded exit
+            cursor.execute('UPDATE attendance SET time_out = NULL WHERE id = ?', (row_id,))
+
+    def nodes(self):
+        """Edge nodes that have synced, most recent first"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT node_id, last_seen, events, duplicates FROM sync_nodes ORDER BY last_seen DESC
+            ''').fetchall()
+        finally:
+            conn.close()
+        return [{'node_id': r[0], 'last_seen': r[1], 'events': r[2], 'duplicates': r[3]} for r in rows]
+
+
+def _valid_format(value, fmt):
+    """True for a string in exactly fmt (zero-padded, so values compare as strings)"""
+    if not isinstance(value, str):
+        return False
+    try:
+        return datetime.strptime(value, fmt).strftime(fmt) == value
+    except ValueError:
+        return False
+
+
+def invalid_event(event, known_students):
+    """Why an ingested event can't be applied, or None"""
+    if not isinstance(event['event_id'], str):
+        return "event_id must be a string"
+    if event['student_id'] not in known_students:
+        return f"Unknown student: {event['student_id']!r}"
+    if not _valid_format(event['date'], '%Y-%m-%d'):
+        return f"Invalid date: {event['date']!r}"
+    for field in ('time_in', 'time_out'):
+        if event.get(field) is not None and not _valid_format(event[field], '%H:%M:%S'):
+            return f"Invalid {field}: {event[field]!r}"
+    if event.get('changed_at') is not None and not _valid_format(event['changed_at'], '%Y-%m-%d %H:%M:%S'):
+        return f"Invalid changed_at: {event['changed_at']!r}"
+    if event.get('status') is not None and not isinstance(event['status'], str):
+        return f"Invalid status: {event['status']!r}"
+    return None
+
+
+def decode_ingest_body(data, content_encoding=None):
+    """Parse a (possibly gzip-compressed) ingest request body, refusing oversized payloads"""
+    if (content_encoding or '').lower() == 'gzip':
+        try:
+            with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+                data = f.read(MAX_INGEST_BYTES + 1)
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            raise ValueError(f"Invalid gzip body: {e}")
+    if len(data) > MAX_INGEST_BYTES:
+        raise ValueError("Sync batch too large")
+    payload = json.loads(data)
+    if not isinstance(payload, dict) or not isinstance(payload.get('events'), list):
+        raise ValueError("Expected {node_id, events: [...]}")
+    if not all(isinstance(event, dict) for event in payload['events']):
+        raise ValueError("Every event must be an object")
+    return payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload this node's attendance outbox to the central server")
+    parser.add_argument('--server', help="central server URL (default: $ATTENDANCE_SYNC_URL)")
+    parser.add_argument('--db', default='attendance_system.db', help="edge database")
+    parser.add_argument('--once', action='store_true', help="upload what is pending and exit")
+    parser.add_argument('--backfill', nargs='?', const='', metavar='SINCE',
+                        help="first queue existing attendance (optionally from YYYY-MM-DD on)")
+    parser.add_argument('--interval', type=float, default=SYNC_INTERVAL, help="seconds between uploads")
+    args = parser.parse_args()
+
+    # Creates the settings table on a fresh database
+    DatabaseManager(args.db)
+    outbox = OutboxSync(args.db, args.server)
+    if args.backfill is not None:
+        print(f"Queued {outbox.backfill(args.backfill)} existing attendance records")
+    if args.once:
+        print(json.dumps(outbox.sync_once()))
+        return
+
+    stop_event = threading.Event()
+    try:
+        outbox.run(stop_event, args.interval)
+    except KeyboardInterrupt:
+        stop_event.set()
+
+
+if __name__ == '__main__':
+    main()
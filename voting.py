@@ -0,0 +1,193 @@
+"""
+Multi-frame identity voting
+
+A single frame's match is not enough to mark attendance: one noisy frame
+can match the wrong student. IdentityVoter follows each face across
+frames (a track, joined by box overlap) and keeps its last N votes in a
+small ring buffer. A track commits an identity once that student holds
+K of the N votes, and commits it only once, so a person standing at the
+door for a minute is one attendance write instead of hundreds.
+
+With an entry line (roi.EntryLine) the track also remembers which side
+of the line it was last seen on. Switching sides is a crossing, reported
+once the track has a committed identity, with face_info['direction'] set
+to 'in' or 'out'; tracks that never cross are not reported at all.
+
+Usage:
+    voter = IdentityVoter(k=3, n=5)
+    for face_info in voter.update(face_locations, recognized_faces):
+        db.mark_attendance(face_info['student_id'])
+"""
+
+import time
+
+import numpy as np
+
+import metrics
+
+DEFAULT_K = 3
+DEFAULT_N = 5
+# A track nobody matched for this long is dropped
+TRACK_TIMEOUT = 1.5
+MAX_TRACKS = 64
+MIN_IOU = 0.3
+NO_VOTE = -1
+
+VOTES = metrics.counter('attendance_identity_votes_total', 'Per-frame identity votes', ('result',))
+COMMITS = metrics.counter('attendance_identity_commits_total', 'Identities committed after K of N votes')
+CROSSINGS = metrics.counter('attendance_line_crossings_total', 'Entry line crossings by confirmed identities', ('direction',))
+
+
+def box_iou(a, b):
+    """Overlap of two (top, right, bottom, left) boxes, 0..1"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    inter = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    __slots__ = ('box', 'votes', 'position', 'last_seen', 'committed', 'best', 'side', 'crossing')
+
+    def __init__(self, box, n, now):
+        self.box = box
+        # Ring buffer of interned student ids (NO_VOTE for unknown/low confidence)
+        self.votes = np.full(n, NO_VOTE, dtype=np.int32)
+        self.position = 0
+        self.last_seen = now
+        self.committed = set()
+        # Best-confidence face_info per voted identity, reported on commit
+        self.best = {}
+        # Entry line mode: last side seen (0 until off the line) and a
+        # crossing waiting for the identity to be confirmed
+        self.side = 0
+        self.crossing = None
+
+    def vote(self, code):
+        self.votes[self.position] = code
+        self.position = (self.position + 1) % len(self.votes)
+
+    def leader(self, k):
+        """Identity code holding at least k votes, or None"""
+        votes = self.votes[self.votes != NO_VOTE]
+        if len(votes) < k:
+            return None
+        counts = np.bincount(votes)
+        code = int(counts.argmax())
+        return code if counts[code] >= k else None
+
+
+class IdentityVoter:
+    def __init__(self, k=DEFAULT_K, n=DEFAULT_N, threshold=0.0, track_timeout=TRACK_TIMEOUT):
+        n = max(1, int(n))
+        self.k = min(max(1, int(k)), n)
+        self.n = n
+        self.threshold = threshold
+        self.track_timeout = track_timeout
+        self.tracks = []
+        # student_id <-> small int, so ring buffers stay int32 arrays
+        self.codes = {}
+        self.student_ids = []
+
+    def _code(self, student_id):
+        code = self.codes.get(student_id)
+        if code is None:
+            code = self.codes[student_id] = len(self.student_ids)
+            self.student_ids.append(student_id)
+        return code
+
+    def _track_for(self, box, now, claimed):
+        best, best_iou = None, MIN_IOU
+        for track in self.tracks:
+            if id(track) in claimed:
+                continue
+            iou = box_iou(track.box, box)
+            if iou >= best_iou:
+                best, best_iou = track, iou
+        if best is None:
+            best = Track(box, self.n, now)
+            self.tracks.append(best)
+        claimed.add(id(best))
+        return best
+
+    def update(self, face_locations, recognized_faces, now=None, line=None):
+        """Add one frame's matches; return the face_info of newly committed identities
+
+        With an entry line, return the face_info (plus 'direction') of
+        confirmed identities that crossed it instead.
+        """
+        now = time.monotonic() if now is None else now
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.track_timeout]
+
+        commits = []
+        claimed = set()
+        for box, face_info in zip(face_locations, recognized_faces):
+            box = tuple(box)
+            track = self._track_for(box, now, claimed)
+            track.box = box
+            track.last_seen = now
+            code = self._vote(track, face_info)
+
+            if line is not None:
+                crossed = self._cross(track, line.side(box))
+                if crossed is not None:
+                    commits.append(crossed)
+            elif code is not None and code not in track.committed and np.count_nonzero(track.votes == code) >= self.k:
+                track.committed.add(code)
+                COMMITS.inc()
+                commits.append(track.best[code])
+
+        # Faces that vanish between frames leave tracks behind; keep the newest
+        if len(self.tracks) > MAX_TRACKS:
+            self.tracks.sort(key=lambda t: t.last_seen)
+            del self.tracks[:len(self.tracks) - MAX_TRACKS]
+        return commits
+
+    def _vote(self, track, face_info):
+        """Record face_info's vote on track; return its identity code or None"""
+        student_id = face_info.get('student_id')
+        if not student_id or face_info.get('confidence', 0) <= self.threshold:
+            track.vote(NO_VOTE)
+            VOTES.labels('none').inc()
+            return None
+
+        code = self._code(student_id)
+        track.vote(code)
+        VOTES.labels('match').inc()
+        if face_info.get('confidence', 0) >= track.best.get(code, {}).get('confidence', -1):
+            track.best[code] = face_info
+        return code
+
+    def _cross(self, track, side):
+        """Update the track's side of the entry line; return a confirmed crossing or None"""
+        if side:
+            if track.side and side != track.side:
+                track.crossing = 'in' if side > 0 else 'out'
+            track.side = side
+        if track.crossing is None:
+            return None
+
+        # A face can cross before K votes are in; report it once they are
+        code = track.leader(self.k)
+        if code is None:
+            return None
+        direction, track.crossing = track.crossing, None
+        CROSSINGS.labels(direction).inc()
+        return dict(track.best[code], direction=direction)
+
+    def reset(self):
+        self.tracks = []
+
+
+def voter_from_settings(get_setting, threshold=0.0):
+    """IdentityVoter configured from the vote_k / vote_n settings"""
+    try:
+        k = int(get_setting('vote_k', DEFAULT_K))
+        n = int(get_setting('vote_n', DEFAULT_N))
+    except (TypeError, ValueError):
+        k, n = DEFAULT_K, DEFAULT_N
+    return IdentityVoter(k, n, threshold)
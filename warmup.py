@@ -0,0 +1,173 @@
+"""
+Startup warm-up
+
+The first frame through recognition used to pay every one-off cost at
+once: loading the detector, dlib's first HOG pass and model
+initialization, the first distance computation over the gallery and a
+cold SQLite page cache. The first student at the door waited seconds for
+it, while /api/camera/start had already reported success.
+
+WarmUp pays those costs before any frame is accepted, in order:
+
+    models      load the face detector (the Haar cascade without dlib;
+                face_recognition loads its models on import)
+    database    read the roster, today's attendance and the recognition
+                settings, so their pages and the roster cache are hot
+    gallery     bind the camera's shards, if any, and bring the face
+                gallery up to date with the student change log
+    inference   run detection, the quality checks, encoding and matching
+                on synthetic frames of the camera's resolution
+
+Progress is reported by status(): the web app's /api/camera/status and
+/api/ready, the headless daemon's /healthz and /readyz. The recognition
+loops wait() for the warm-up before taking frames; frames the camera
+delivers meanwhile are dropped by the grab-latest reader.
+
+A failed step is reported with its error and recognition starts cold
+rather than not at all; start() runs the warm-up again.
+"""
+
+import threading
+import time
+from datetime import date
+
+import cv2
+
+import metrics
+from frame_source import SyntheticSource, source_from_settings
+
+STEPS = ('models', 'database', 'gallery', 'inference')
+# The first pass pays the one-off costs; the second shows the steady state
+WARMUP_PASSES = 2
+DEFAULT_FRAME_SIZE = (640, 480)
+
+WARMUP_SECONDS = metrics.histogram('attendance_warmup_step_seconds', 'Time spent in each warm-up step', ('step',))
+WARMUP_READY = metrics.gauge('attendance_warmup_ready', '1 once recognition is warmed up')
+
+
+class WarmUp:
+    def __init__(self, face_system, db=None, frame_size=None, scale=1.0, shards=None, passes=WARMUP_PASSES):
+        """frame_size is (width, height), by default the configured camera
+        resolution; scale is the resize recognition applies to frames.
+        shards, or a function returning them, is bound before the gallery
+        is loaded (see shards.py); None leaves the binding alone.
+        """
+        self.face_system = face_system
+        self.db = db if db is not None else getattr(face_system, 'db', None)
+        self.frame_size = frame_size
+        self.scale = scale
+        self.shards = shards
+        self.passes = max(1, passes)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.state = 'cold'
+        self.step = None
+        self.timings = {}
+        self.passes_ms = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def start(self):
+        """Warm up on a background thread; False if already warming or ready"""
+        with self.lock:
+            if self.state in ('warming', 'ready'):
+                return False
+            self.state = 'warming'
+            self.done.clear()
+        threading.Thread(target=self._run, name='warm-up', daemon=True).start()
+        return True
+
+    def wait(self, timeout=None):
+        """Block until the warm-up has finished (ready or failed); False on timeout"""
+        return self.done.wait(timeout)
+
+    def status(self):
+        """Progress for status endpoints"""
+        finished = len(self.timings)
+        end = self.finished_at or time.time()
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'step': self.step,
+            'progress': round(finished / len(STEPS), 2),
+            'steps_ms': dict(self.timings),
+            'inference_passes_ms': list(self.passes_ms),
+            'seconds': round(end - self.started_at, 2) if self.started_at else None,
+            'error': self.error
+        }
+
+    def _run(self):
+        self.started_at, self.finished_at = time.time(), None
+        self.timings, self.passes_ms, self.error = {}, [], None
+        state = 'ready'
+        for name in STEPS:
+            self.step = name
+            began = time.perf_counter()
+            try:
+                getattr(self, f'_{name}')()
+            except Exception as e:
+                self.error = f"{name}: {e}"
+                state = 'failed'
+                print(f"Warm-up failed at {name}: {e}")
+                break
+            elapsed = time.perf_counter() - began
+            WARMUP_SECONDS.labels(name).observe(elapsed)
+            self.timings[name] = round(elapsed * 1000, 1)
+
+        self.step = None
+        self.finished_at = time.time()
+        self.state = state
+        WARMUP_READY.set(1 if state == 'ready' else 0)
+        if state == 'ready':
+            print(f"Recognition warmed up in {self.finished_at - self.started_at:.2f}s {self.timings}")
+        self.done.set()
+
+    def _models(self):
+        if hasattr(self.face_system, 'load_models'):
+            self.face_system.load_models()
+
+    def _database(self):
+        if hasattr(self.db, 'get_roster'):
+            self.db.get_roster()
+        if hasattr(self.db, 'get_attendance_records'):
+            self.db.get_attendance_records(date.today().isoformat())
+        if hasattr(self.face_system, 'load_quality_settings'):
+            self.face_system.load_quality_settings()
+
+    def _gallery(self):
+        shards = self.shards() if callable(self.shards) else self.shards
+        if shards is not None and hasattr(self.face_system, 'bind_shards'):
+            self.face_system.bind_shards(shards)
+        if hasattr(self.face_system, 'refresh_gallery'):
+            self.face_system.refresh_gallery(force=True)
+
+    def _inference(self):
+        if not hasattr(self.face_system, 'warm_up'):
+            return
+        width, height = self._frame_size()
+        source = SyntheticSource(width, height, fps=0, frames=self.passes)
+        source.open()
+        try:
+            for _ in range(self.passes):
+                ret, frame = source.read()
+                began = time.perf_counter()
+                if self.scale != 1.0:
+                    frame = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+                self.face_system.warm_up(frame)
+                self.passes_ms.append(round((time.perf_counter() - began) * 1000, 1))
+        finally:
+            source.release()
+
+    def _frame_size(self):
+        if self.frame_size:
+            return self.frame_size
+        if hasattr(self.db, 'get_setting'):
+            _, options = source_from_settings(self.db.get_setting)
+            if 'width' in options:
+                return options['width'], options['height']
+        return DEFAULT_FRAME_SIZE